@@ -0,0 +1,102 @@
+"""Compares WebSocket gateway throughput with the raw TCP listener
+
+Each client pipelines pings and waits for every pong. Chat messages need a
+logged in user, pings only need a connection, so they measure the transport
+rather than the database.
+
+Run from the repository root:
+    python -m benchmarks.bench_gateway
+"""
+
+import asyncio
+import os
+import tempfile
+import time
+
+from server.chat_server import ChatServer
+from server.server_config import ServerConfig
+from server.sqlite_database import SqliteDatabase
+from common import (
+    CODECS,
+    WEBSOCKET_OPCODES,
+    FrameDecoder,
+    WebSocketDecoder,
+    encode_frame,
+    encode_websocket_frame,
+    handshake_request,
+    serialize_ping_message,
+)
+
+
+def _pings(count: int, codec: str):
+    for nonce in range(count):
+        payload = serialize_ping_message(nonce, codec)
+        yield payload.encode() if isinstance(payload, str) else payload
+
+
+async def _tcp_client(port: int, count: int, codec: str) -> None:
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.writelines(encode_frame(ping) for ping in _pings(count, codec))
+    decoder = FrameDecoder()
+    received = 0
+    while received < count:
+        received += len(decoder.feed(await reader.read(65536)))
+    writer.close()
+
+
+async def _websocket_client(port: int, count: int, codec: str) -> None:
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    request, _ = handshake_request("127.0.0.1", port)
+    writer.write(request)
+    await reader.readuntil(b"\r\n\r\n")
+
+    opcode = (
+        WEBSOCKET_OPCODES.text if codec == CODECS.json else WEBSOCKET_OPCODES.binary
+    )
+    mask = os.urandom(4)
+    writer.writelines(
+        encode_websocket_frame(opcode, ping, mask) for ping in _pings(count, codec)
+    )
+    decoder = WebSocketDecoder(require_mask=False)
+    received = 0
+    while received < count:
+        received += len(decoder.feed(await reader.read(65536)))
+    writer.close()
+
+
+async def _run(clients: int, count: int, codec: str) -> None:
+    with tempfile.TemporaryDirectory() as directory:
+        db = SqliteDatabase(db_name=os.path.join(directory, "bench.db"))
+        db._initialize_database(drop=True)
+        server = ChatServer(db=db, config=ServerConfig(heartbeat_interval=0))
+        loop = asyncio.get_running_loop()
+        tcp = await loop.create_server(server._create_proto, "127.0.0.1", 0)
+        websocket = await loop.create_server(
+            server._create_websocket_proto, "127.0.0.1", 0
+        )
+
+        results = {}
+        for name, listener, client in [
+            ("tcp", tcp, _tcp_client),
+            ("websocket", websocket, _websocket_client),
+        ]:
+            port = listener.sockets[0].getsockname()[1]
+            start = time.perf_counter()
+            await asyncio.gather(*(client(port, count, codec) for _ in range(clients)))
+            elapsed = time.perf_counter() - start
+            results[name] = clients * count / elapsed
+            print(f"{name:<12}{codec:<8}{results[name]:>14,.0f}")
+
+        print(f"{'ratio':<20}{results['websocket'] / results['tcp']:>14.2f}")
+        tcp.close()
+        websocket.close()
+
+
+def main(clients: int = 10, count: int = 2000) -> None:
+    print(f"{'listener':<12}{'codec':<8}{'round trips/s':>14}")
+    for codec in CODECS:
+        asyncio.run(_run(clients, count, codec))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""Compares the generated message encoders with building a dict per message
+
+Run from the repository root:
+    python -m benchmarks.bench_message_factory
+"""
+
+import timeit
+
+from common import (
+    CODECS,
+    ERRORS,
+    ERROR_TYPES,
+    FIELDS_CHAT_MESSAGES,
+    FIELDS_ERROR_MESSAGE,
+    FIELDS_LOGIN_RESPONSE_MESSAGE,
+    MESSAGE_TYPE,
+    MESSAGE_TYPES,
+    decode_message,
+    encode_message,
+    serialize_chat,
+    serialize_chat_messages,
+    serialize_error_message,
+    serialize_login_response_message,
+)
+from common.message_factory import _binary_codec
+
+ROOMID = "11111111-2222-3333-4444-555555555555"
+USERID = "3f2b8a4e-1c2d-4e5f-9a8b-7c6d5e4f3a2b"
+CHATS = [
+    serialize_chat(f"Message number {i}", USERID, "User1", roomid=ROOMID)
+    for i in range(30)
+]
+
+
+def _dict_error(codec):
+    payload = {
+        MESSAGE_TYPE: MESSAGE_TYPES.error,
+        FIELDS_ERROR_MESSAGE.errortype: ERROR_TYPES.invalid_username_password,
+        FIELDS_ERROR_MESSAGE.message: ERRORS.invalid_username_password,
+    }
+    return encode_message(payload, codec)
+
+
+def _dict_login_response(codec):
+    payload = {
+        MESSAGE_TYPE: MESSAGE_TYPES.login_response,
+        FIELDS_LOGIN_RESPONSE_MESSAGE.username: "User1",
+        FIELDS_LOGIN_RESPONSE_MESSAGE.userid: USERID,
+        FIELDS_LOGIN_RESPONSE_MESSAGE.roomid: ROOMID,
+        FIELDS_LOGIN_RESPONSE_MESSAGE.roomname: "Lobby",
+    }
+    return encode_message(payload, codec)
+
+
+def _dict_chat_messages(codec):
+    payload = {
+        MESSAGE_TYPE: MESSAGE_TYPES.chat,
+        FIELDS_CHAT_MESSAGES.messages: CHATS,
+    }
+    return encode_message(payload, codec)
+
+
+CASES = [
+    (
+        "error",
+        _dict_error,
+        lambda codec: serialize_error_message(
+            ERROR_TYPES.invalid_username_password,
+            ERRORS.invalid_username_password,
+            codec,
+        ),
+    ),
+    (
+        "login_response",
+        _dict_login_response,
+        lambda codec: serialize_login_response_message(
+            USERID, "User1", ROOMID, "Lobby", codec
+        ),
+    ),
+    (
+        "chat x30",
+        _dict_chat_messages,
+        lambda codec: serialize_chat_messages(CHATS, codec),
+    ),
+]
+
+
+def _best(func, number):
+    return min(timeit.repeat(func, number=number, repeat=5)) / number * 1e6
+
+
+def main(number: int = 20000) -> None:
+    print(f"{'message':<16}{'codec':<8}{'dict us':>10}{'schema us':>11}{'speedup':>9}")
+    for name, legacy, generated in CASES:
+        runs = number if name != "chat x30" else number // 20
+        for codec in CODECS:
+            assert decode_message(legacy(codec)) == decode_message(generated(codec))
+            before = _best(lambda: legacy(codec), runs)
+            after = _best(lambda: generated(codec), runs)
+            print(
+                f"{name:<16}{codec:<8}{before:>10.2f}{after:>11.2f}"
+                f"{before / after:>8.1f}x"
+            )
+
+    for name, legacy, _ in CASES:
+        runs = number if name != "chat x30" else number // 20
+        encoded = legacy(CODECS.binary)
+        before = _best(lambda: _binary_codec.decode(encoded), runs)
+        after = _best(lambda: decode_message(encoded), runs)
+        print(
+            f"{name + ' decode':<24}{before:>10.2f}{after:>11.2f}{before / after:>8.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
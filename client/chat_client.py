@@ -1,8 +1,7 @@
 from __future__ import annotations
 import asyncio
 from datetime import datetime, timezone
-import json
-from typing import Dict, List
+from typing import Any, Callable, Dict, List, Set
 
 import textual.events as events
 
@@ -33,34 +32,49 @@ from .chat_client_protocol import (
     Chatroom,
 )
 from common import (
+    CODECS,
+    COMPRESSIONS,
+    RESYNC_MODES,
     User,
     COMMAND_TYPES,
     ERRORS,
     ERROR_TYPES,
     FIELDS_BLACKLIST_RESPONSE_MESSAGE,
     FIELDS_CREATE_ROOM_RESPONSE_MESSAGE,
+    FIELDS_HISTORY_RESPONSE_MESSAGE,
     FIELDS_JOIN_ROOM_RESPONSE_MESSAGE,
     FIELDS_LIST_USERS_MESSAGE,
+    FIELDS_CHAT_MESSAGE,
     FIELDS_CHAT_MESSAGES,
     FIELDS_LIST_ROOMS_MESSAGE,
     FIELDS_LOGIN_RESPONSE_MESSAGE,
+    FIELDS_RESUME_RESPONSE_MESSAGE,
     FIELDS_ERROR_MESSAGE,
     FIELDS_UNBLOCK_RESPONSE_MESSAGE,
     MESSAGE_TYPE,
     MESSAGE_TYPES,
+    RequestTimeoutError,
+    decode_message,
     serialize_blacklist_message,
     serialize_chat,
     serialize_chat_messages,
     serialize_create_room_message,
+    serialize_history_message,
     serialize_join_room_message,
     serialize_list_rooms_message,
     serialize_list_users_message,
     serialize_login_message,
     serialize_logout_message,
     serialize_register_message,
+    serialize_resume_message,
     serialize_unblock_message,
 )
 
+# Reconnect attempts before giving up on a lost connection, the delay
+# doubles after each attempt
+RESUME_ATTEMPTS = 3
+RESUME_DELAY = 1.0
+
 
 class ChatApp(MultiviewApp, AbstractMessageHandler):
 
@@ -68,10 +82,22 @@ class ChatApp(MultiviewApp, AbstractMessageHandler):
     _protocol = AbstractChatClientProtocol
     _messages: List[dict] = []
     _room: Chatroom | None = None
+    # Id of the oldest message shown, None until history arrives
+    _history_cursor: str | None = None
+    _history_more: bool = True
+    # Id of the newest message seen in the room, sent when rejoining it
+    _last_seen_id: str | None = None
+    # Token from the login response, resumes the session after a reconnect
+    _session_token: str | None = None
+    # Last room list and its version, the server only resends it on change
+    _room_list: List[str] | None = None
+    _room_list_version: int | None = None
 
     def __init__(self, protocol: AbstractChatClientProtocol):
         self._protocol = protocol
         self._protocol.message_handler = self
+        # Requests in flight, the loop only keeps weak references to tasks
+        self._requests: Set[asyncio.Task] = set()
         super().__init__(title="Chat App", log="log.log")
 
     @property
@@ -108,6 +134,14 @@ class ChatApp(MultiviewApp, AbstractMessageHandler):
 
     async def add_messages(self, message: dict):
         self._messages.append(message[FIELDS_CHAT_MESSAGES.messages])
+        messages = message[FIELDS_CHAT_MESSAGES.messages] or []
+        if self._history_cursor is None and len(messages) > 0:
+            self._history_cursor = messages[0].get(FIELDS_CHAT_MESSAGE.id, None)
+        roomid = self._room.id if self._room is not None else None
+        for chat in reversed(messages):
+            if chat.get(FIELDS_CHAT_MESSAGE.roomid, None) == roomid:
+                self._last_seen_id = chat.get(FIELDS_CHAT_MESSAGE.id, None)
+                break
 
         if not isinstance(self.view, ChatView):
             return
@@ -116,9 +150,12 @@ class ChatApp(MultiviewApp, AbstractMessageHandler):
             message[FIELDS_CHAT_MESSAGES.messages], self._user
         )
 
-    async def on_message_received(self, data: str):
+    async def on_message_received(self, data: str | bytes | Dict[str, Any]):
         self.log("Received data:\n", data)
-        message = json.loads(data)
+        message = data if isinstance(data, dict) else decode_message(data)
+        await self.handle_message(message)
+
+    async def handle_message(self, message: Dict[str, Any]) -> None:
         match message[MESSAGE_TYPE]:
             case MESSAGE_TYPES.blacklist_response:
                 await self.handle_blacklist_response_message(message)
@@ -128,6 +165,8 @@ class ChatApp(MultiviewApp, AbstractMessageHandler):
                 await self.handle_create_room_response_message(message)
             case MESSAGE_TYPES.error:
                 await self.handle_error_message(message)
+            case MESSAGE_TYPES.history_response:
+                await self.handle_history_response(message)
             case MESSAGE_TYPES.join_room_response:
                 await self.handle_join_room_response_message(message)
             case MESSAGE_TYPES.list_rooms:
@@ -138,6 +177,8 @@ class ChatApp(MultiviewApp, AbstractMessageHandler):
                 await self.handle_login_response(message)
             case MESSAGE_TYPES.register_response:
                 await self.handle_register_response(message)
+            case MESSAGE_TYPES.resume_response:
+                await self.handle_resume_response(message)
             case MESSAGE_TYPES.unblock_response:
                 await self.handle_unblock_response(message)
 
@@ -170,18 +211,38 @@ class ChatApp(MultiviewApp, AbstractMessageHandler):
         server_response_message = ServerResponseMessage(self, f"Room {name} created.")
         await self._chat_view.handle_server_response(server_response_message)
 
+    async def handle_history_response(self, message: Dict[str, Any]) -> None:
+        roomid = message.get(FIELDS_HISTORY_RESPONSE_MESSAGE.roomid, "")
+        if self._room is None or roomid != self._room.id:
+            return
+        messages = message.get(FIELDS_HISTORY_RESPONSE_MESSAGE.messages, None) or []
+        cursor = message.get(FIELDS_HISTORY_RESPONSE_MESSAGE.cursor, "")
+        if len(cursor) > 0:
+            self._history_cursor = cursor
+        self._history_more = message.get(FIELDS_HISTORY_RESPONSE_MESSAGE.more, False)
+
+        if len(messages) == 0 or self.view != self._chat_view:
+            return
+        self._messages.insert(0, messages)
+        await self._chat_view.prepend_history_messages(messages, self._user)
+
     async def handle_join_room_response_message(self, message: Dict[str, str]) -> None:
         userid = message.get(FIELDS_JOIN_ROOM_RESPONSE_MESSAGE.userid, "").strip()
         roomid = message.get(FIELDS_JOIN_ROOM_RESPONSE_MESSAGE.roomid, "").strip()
         roomname = message.get(FIELDS_JOIN_ROOM_RESPONSE_MESSAGE.roomname, "").strip()
+        resync = message.get(FIELDS_JOIN_ROOM_RESPONSE_MESSAGE.resync, None)
         if len(userid) == 0 or userid != self._user.userid:
             return
-        if len(roomid) == 0 or self._room.id == roomid:
+        if len(roomid) == 0 or len(roomname) == 0:
             return
-        if len(roomname) == 0:
+        # On a delta resync only the missed messages follow, keep the rest
+        if self._room.id == roomid and resync != RESYNC_MODES.full:
             return
 
         self._messages.clear()
+        self._history_cursor = None
+        self._history_more = True
+        self._last_seen_id = None
         await self._chat_view.clear_history()
 
         self._room.id = roomid
@@ -194,8 +255,15 @@ class ChatApp(MultiviewApp, AbstractMessageHandler):
 
     async def handle_list_rooms(self, message: Dict[str, str]) -> None:
         rooms = message.get(FIELDS_LIST_ROOMS_MESSAGE.rooms, None)
+        version = message.get(FIELDS_LIST_ROOMS_MESSAGE.version, None)
         if rooms is None:
-            return
+            # Not modified since the list we already have
+            if version is None or version != self._room_list_version:
+                return
+            rooms = self._room_list
+        else:
+            self._room_list = rooms
+            self._room_list_version = version
 
         if self.view != self._chat_view:
             return
@@ -218,6 +286,8 @@ class ChatApp(MultiviewApp, AbstractMessageHandler):
 
     async def handle_login_response(self, message: Dict[str, str]) -> None:
         self._messages.clear()
+        self._history_cursor = None
+        self._history_more = True
         await self._chat_view.clear_history()
         username = message.get(FIELDS_LOGIN_RESPONSE_MESSAGE.username, "").strip()
         userid = message.get(FIELDS_LOGIN_RESPONSE_MESSAGE.userid, "").strip()
@@ -235,6 +305,7 @@ class ChatApp(MultiviewApp, AbstractMessageHandler):
             id=roomid,
             name=roomname,
         )
+        self._session_token = message.get(FIELDS_LOGIN_RESPONSE_MESSAGE.token, None)
 
         self.app.sub_title = username
 
@@ -245,6 +316,17 @@ class ChatApp(MultiviewApp, AbstractMessageHandler):
     async def handle_register_response(self, message: Dict[str, str]) -> None:
         await self.swap_to_view("signinView")
 
+    async def handle_resume_response(self, message: Dict[str, str]) -> None:
+        userid = message.get(FIELDS_RESUME_RESPONSE_MESSAGE.userid, "").strip()
+        if len(userid) == 0:
+            return
+        # The room follows in a join_room_response
+        self._user = User(
+            username=message.get(FIELDS_RESUME_RESPONSE_MESSAGE.username, ""),
+            userid=userid,
+        )
+        self._session_token = message.get(FIELDS_RESUME_RESPONSE_MESSAGE.token, None)
+
     async def handle_unblock_response(self, message: Dict[str, str]) -> None:
         if self.view != self._chat_view:
             return
@@ -268,6 +350,10 @@ class ChatApp(MultiviewApp, AbstractMessageHandler):
             await self.view.handle_invalid_login(InvalidLogin(self))
         elif error_type == ERRORS.username_exists and isinstance(self.view, SignupView):
             await self.view.handle_invalid_username(InvalidUsername(self))
+        elif error_type == ERROR_TYPES.invalid_session:
+            # The session could not be resumed, sign in again
+            self._session_token = None
+            await self.swap_to_view("signinView")
         else:
             error = ErrorMessage(
                 self,
@@ -276,6 +362,27 @@ class ChatApp(MultiviewApp, AbstractMessageHandler):
             )
             await self.view.handle_error(error)
 
+    def request(self, build: Callable[[str | None], str | bytes]) -> asyncio.Task:
+        """Sends a request without waiting for earlier ones to be answered
+
+        build is called with the request id and returns the serialized
+        request. The response is handled like any other message, in the
+        order it arrived, the task only reports requests left unanswered.
+        """
+        task = asyncio.create_task(self._request(build))
+        self._requests.add(task)
+        task.add_done_callback(self._requests.discard)
+        return task
+
+    async def _request(self, build: Callable[[str | None], str | bytes]) -> None:
+        try:
+            await self.protocol.request(build)
+        except RequestTimeoutError:
+            error = ErrorMessage(
+                self, ERROR_TYPES.server_error, "Server did not respond in time"
+            )
+            await self.view.handle_error(error)
+
     async def handle_command(self, command: CommandMessage):
         match command.command_type:
             case COMMAND_TYPES.block:
@@ -284,6 +391,8 @@ class ChatApp(MultiviewApp, AbstractMessageHandler):
                 await self.handle_command_create_room(command.command_data)
             case COMMAND_TYPES.dm:
                 await self.handle_command_dm(command.command_data)
+            case COMMAND_TYPES.history:
+                await self.handle_command_history()
             case COMMAND_TYPES.join_room:
                 await self.handle_command_join_room(command.command_data)
             case COMMAND_TYPES.list_rooms:
@@ -300,8 +409,11 @@ class ChatApp(MultiviewApp, AbstractMessageHandler):
         blocked_username = command_data.strip()
         if len(blocked_username) == 0:
             return
-        payload = serialize_blacklist_message(userid, blocked_username)
-        await self.protocol.send(payload)
+        self.request(
+            lambda requestid: serialize_blacklist_message(
+                userid, blocked_username, codec=self.protocol.codec, requestid=requestid
+            )
+        )
 
     async def handle_command_dm(self, command_data: str) -> None:
         m = command_data.split(maxsplit=1)
@@ -330,7 +442,7 @@ class ChatApp(MultiviewApp, AbstractMessageHandler):
             target_username=target_username,
         )
 
-        payload = serialize_chat_messages([chat_message])
+        payload = serialize_chat_messages([chat_message], codec=self.protocol.codec)
         await self.protocol.send(payload)
 
     async def handle_command_create_room(self, command_data: str) -> None:
@@ -340,23 +452,62 @@ class ChatApp(MultiviewApp, AbstractMessageHandler):
             )
             return await self._chat_view.handle_error(error_msg)
 
-        payload = serialize_create_room_message(command_data)
+        self.request(
+            lambda requestid: serialize_create_room_message(
+                command_data, codec=self.protocol.codec, requestid=requestid
+            )
+        )
+
+    async def handle_command_history(self) -> None:
+        if self._room is None:
+            return
+        if not self._history_more:
+            response = ServerResponseMessage(self, "No older messages")
+            return await self._chat_view.handle_server_response(response)
+
+        # Pages may arrive in several chunks, they are handled as they come
+        payload = serialize_history_message(
+            self._room.id, self._history_cursor or "", codec=self.protocol.codec
+        )
         await self.protocol.send(payload)
 
     async def handle_command_join_room(self, command_data: str) -> None:
-        payload = serialize_join_room_message(self._user.userid, command_data)
-        await self.protocol.send(payload)
+        userid = self._user.userid
+        # Rejoining the current room only asks for the messages missed since
+        lastid = None
+        if self._room is not None and self._room.name == command_data.strip():
+            lastid = self._last_seen_id
+        self.request(
+            lambda requestid: serialize_join_room_message(
+                userid,
+                command_data,
+                codec=self.protocol.codec,
+                requestid=requestid,
+                lastid=lastid,
+            )
+        )
 
     async def handle_command_list_rooms(self) -> None:
-        payload = serialize_list_rooms_message()
-        await self.protocol.send(payload)
+        self.request(
+            lambda requestid: serialize_list_rooms_message(
+                codec=self.protocol.codec,
+                requestid=requestid,
+                version=self._room_list_version,
+            )
+        )
 
     async def handle_command_list_users(self) -> None:
-        payload = serialize_list_users_message(self._room.id, self._room.name)
-        await self.protocol.send(payload)
+        room = self._room
+        self.request(
+            lambda requestid: serialize_list_users_message(
+                room.id, room.name, codec=self.protocol.codec, requestid=requestid
+            )
+        )
 
     async def handle_command_logout(self) -> None:
-        payload = serialize_logout_message(self._user.userid, self._user.username)
+        payload = serialize_logout_message(
+            self._user.userid, self._user.username, codec=self.protocol.codec
+        )
         await self.protocol.send(payload)
         self._user = None
         await self.swap_to_view("introView")
@@ -366,16 +517,49 @@ class ChatApp(MultiviewApp, AbstractMessageHandler):
         blocked_username = command_data.strip()
         if len(blocked_username) == 0:
             return
-        payload = serialize_unblock_message(userid, blocked_username)
-        await self.protocol.send(payload)
+        self.request(
+            lambda requestid: serialize_unblock_message(
+                userid, blocked_username, codec=self.protocol.codec, requestid=requestid
+            )
+        )
 
     async def on_connection_lost(self) -> None:
+        if self._session_token is not None and await self._resume_session():
+            return
         error = ErrorMessage(self, ERROR_TYPES.server_error, "Connection lost")
         await self.view.handle_error(error)
         await asyncio.sleep(2)
         shutdown = events.ShutdownRequest(self)
         await self.on_shutdown_request(shutdown)
 
+    async def _resume_session(self) -> bool:
+        """Reconnects and resumes the session with its token
+
+        Returns:
+            bool: False if the server could not be reached
+        """
+        token = self._session_token
+        roomid = self._room.id if self._room is not None else ""
+        lastid = self._last_seen_id
+        for attempt in range(RESUME_ATTEMPTS):
+            await asyncio.sleep(RESUME_DELAY * 2**attempt)
+            try:
+                await self.protocol.connect()
+            except OSError as e:
+                self.log("Reconnect failed: ", e)
+                continue
+            self.request(
+                lambda requestid: serialize_resume_message(
+                    token,
+                    roomid,
+                    lastid,
+                    codec=self.protocol.codec,
+                    requestid=requestid,
+                )
+            )
+            return True
+        return False
+
     async def on_close(self) -> None:
         pass
 
@@ -401,7 +585,7 @@ class ChatApp(MultiviewApp, AbstractMessageHandler):
             roomid=self._room.id,
         )
 
-        payload = serialize_chat_messages([chat_message])
+        payload = serialize_chat_messages([chat_message], codec=self.protocol.codec)
         await self.protocol.send(payload)
 
     async def handle_login(self, event: Login):
@@ -410,12 +594,14 @@ class ChatApp(MultiviewApp, AbstractMessageHandler):
         if len(username) == 0 or len(password) == 0:
             return
 
-        payload = serialize_login_message(username, password)
+        payload = serialize_login_message(username, password, codec=self.protocol.codec)
         await self.protocol.send(payload)
 
     async def handle_logout(self, event: Logout):
         if self._user is not None:
-            payload = serialize_logout_message(self._user.userid, self._user.username)
+            payload = serialize_logout_message(
+                self._user.userid, self._user.username, codec=self.protocol.codec
+            )
             await self.protocol.send(payload)
             self._user = None
         self.app.sub_title = None
@@ -428,7 +614,9 @@ class ChatApp(MultiviewApp, AbstractMessageHandler):
         if len(username) == 0 or len(password) == 0:
             return
 
-        payload = serialize_register_message(username, password)
+        payload = serialize_register_message(
+            username, password, codec=self.protocol.codec
+        )
         await self.protocol.send(payload)
 
 
@@ -438,6 +626,8 @@ def run_client(
     *,
     test: bool = False,
     protocol_type: str = "basic",
+    codec: str = CODECS.json,
+    compression: str = COMPRESSIONS.none,
 ):
     async def _run_client(host, port):
         protocol: ChatClientProtocol = None
@@ -451,10 +641,14 @@ def run_client(
         else:
             if protocol_type == "high":
                 print("Starting with high-level protocol")
-                protocol = HighLevelProtocol(host=host, port=port)
+                protocol = HighLevelProtocol(
+                    host=host, port=port, codec=codec, compression=compression
+                )
             else:
                 print("Starting with ChatClientProtocol")
-                protocol = ChatClientProtocol(host=host, port=port)
+                protocol = ChatClientProtocol(
+                    host=host, port=port, codec=codec, compression=compression
+                )
         app = ChatApp(protocol=protocol)
         await app.process_messages()
 
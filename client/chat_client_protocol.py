@@ -5,25 +5,53 @@ from datetime import datetime, timezone
 import json
 import os
 from random import uniform
-from typing import Coroutine
+from typing import Any, Callable, Coroutine, Dict, List, Set, Tuple
 from common import (
+    ACK_DELAY,
+    ACK_EVERY,
+    CODECS,
+    COMPRESSIONS,
     ENCODING,
+    MAX_FRAME_SIZE,
+    FrameDecoder,
+    FrameError,
+    PendingRequests,
+    ReceiveWindow,
+    decode_message,
+    encode_frame,
     FIELDS_CHAT_MESSAGES,
     MESSAGE_TYPE,
     MESSAGE_TYPES,
     FIELDS_CHAT_MESSAGE,
     FIELDS_ERROR_MESSAGE,
+    FIELDS_HELLO_RESPONSE_MESSAGE,
     FIELDS_LOGIN_MESSAGE,
     FIELDS_LOGIN_RESPONSE_MESSAGE,
     FIELDS_LOGOUT_MESSAGE,
     FIELDS_REGISTER_MESSAGE,
     FIELDS_REGISTER_RESPONSE_MESSAGE,
+    FIELDS_PING_MESSAGE,
+    FIELDS_RESEND_GAP_MESSAGE,
+    serialize_ack_message,
+    serialize_hello_message,
+    serialize_pong_message,
+    serialize_resend_message,
 )
 
+# Largest payload checked for a ping or resend_gap message
+_CONTROL_MAX_SIZE = 128
+
+
+# Tasks started by _async, the loop only keeps weak references to them
+_tasks: Set[asyncio.Task] = set()
+
 
 def _async(coro: Coroutine):
     loop = asyncio.get_event_loop()
-    return loop.create_task(coro)
+    task = loop.create_task(coro)
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+    return task
 
 
 class Chatroom:
@@ -37,7 +65,10 @@ class Chatroom:
 
 class AbstractMessageHandler:
     @abstractmethod
-    async def on_message_received(self, data: str) -> None:
+    async def on_message_received(self, data: str | bytes | Dict[str, Any]) -> None:
+        """Handles a message from the server, passed on decoded if the
+        protocol already decoded it
+        """
         raise NotImplementedError
 
     async def on_connection_lost(self) -> None:
@@ -50,11 +81,201 @@ class AbstractMessageHandler:
 class AbstractChatClientProtocol(ABC):
     _is_connected: bool = False
     _message_handler: AbstractMessageHandler
-
-    def __init__(self, host: str, port: int):
+    codec: str = CODECS.json
+    compression: str = COMPRESSIONS.none
+    sequenced: bool = False
+    # Set from the server's hello_response
+    negotiated: bool = False
+    version: int = 1
+    max_frame_size: int = MAX_FRAME_SIZE
+    batching: bool = True
+    # Requests waiting for their response, None if the protocol can not
+    # match responses to requests
+    pending: PendingRequests | None = None
+
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        *,
+        codec: str = CODECS.json,
+        compression: str = COMPRESSIONS.none,
+        sequenced: bool = True,
+    ):
         self._host = host
         self._port = port
         self._is_connected = False
+        self.codec = codec
+        self.compression = compression
+        self.sequenced = sequenced
+        self._window = ReceiveWindow()
+        self._ack_handle: asyncio.TimerHandle | None = None
+        self._pongs: List[str | bytes] = []
+        self.pending = PendingRequests()
+
+    def _reset(self) -> None:
+        # A new connection numbers its frames from 1 again
+        if self._ack_handle is not None:
+            self._ack_handle.cancel()
+            self._ack_handle = None
+        self._window = ReceiveWindow()
+        self._pongs = []
+        self._decoder = FrameDecoder()
+        self.negotiated = False
+
+    def _hello(self) -> str:
+        return serialize_hello_message(
+            [self.codec],
+            [self.compression],
+            self.sequenced,
+            max_frame_size=self._decoder.max_frame_size,
+        )
+
+    def _negotiate(self, payload: bytes) -> bool:
+        """Records the features the server picked in its hello_response
+
+        Returns:
+            bool: False if the payload is not the hello_response
+        """
+        try:
+            message = decode_message(payload)
+        except Exception:
+            return False
+        if message.get(MESSAGE_TYPE, None) != MESSAGE_TYPES.hello_response:
+            return False
+        self.version = message.get(FIELDS_HELLO_RESPONSE_MESSAGE.version, 1)
+        self.max_frame_size = message.get(
+            FIELDS_HELLO_RESPONSE_MESSAGE.max_frame_size, MAX_FRAME_SIZE
+        )
+        self.batching = message.get(FIELDS_HELLO_RESPONSE_MESSAGE.batching, True)
+        self.negotiated = True
+        return True
+
+    def _check_frame_size(self, data: bytes) -> None:
+        if len(data) > self.max_frame_size:
+            raise FrameError(
+                f"Frame of {len(data)} bytes exceeds the server's "
+                f"{self.max_frame_size} bytes"
+            )
+
+    async def request(
+        self,
+        build: Callable[[str | None], str | bytes],
+        timeout: float | None = None,
+    ) -> Dict[str, Any] | None:
+        """Sends a request and waits for the response carrying its request id
+
+        Many requests can be in flight at once. Cancelling the awaiting task
+        cancels the request.
+
+        Args:
+            build (Callable[[str | None], str | bytes]): Called with the
+                request id, returns the serialized request
+            timeout (float | None, optional): Seconds to wait for the
+                response. Defaults to PendingRequests.timeout.
+
+        Raises:
+            RequestTimeoutError: No response within timeout seconds
+
+        Returns:
+            Dict[str, Any] | None: The decoded response, None if the protocol
+                does not match responses. Either way the response reaches the
+                message handler, in order with the messages around it.
+        """
+        if self.pending is None:
+            await self.send(build(None))
+            return None
+
+        requestid = self.pending.next_id()
+        future = self.pending.add(requestid, timeout)
+        try:
+            await self.send(build(requestid))
+            return await future
+        finally:
+            self.pending.cancel(requestid)
+
+    def _receive_frames(
+        self, frames: List[Tuple[int | None, bytes]]
+    ) -> List[bytes | Dict[str, Any]]:
+        """Puts sequenced frames back in order, answers pings and completes
+        pending requests
+
+        Returns:
+            List[bytes | Dict[str, Any]]: Messages ready for the message
+                handler, the ones decoded to complete a request are passed
+                on decoded
+        """
+        payloads: List[bytes | Dict[str, Any]] = []
+        for sequence, payload in frames:
+            if sequence is not None:
+                payloads += self._window.receive(sequence, payload)
+                continue
+            if not self.negotiated and self._negotiate(payload):
+                continue
+            message = self._control_message(payload)
+            if message is None:
+                payloads.append(payload)
+            elif message[MESSAGE_TYPE] == MESSAGE_TYPES.ping:
+                nonce = message.get(FIELDS_PING_MESSAGE.nonce, 0)
+                self._pongs.append(serialize_pong_message(nonce, codec=self.codec))
+            else:
+                payloads += self._window.skip(
+                    message[FIELDS_RESEND_GAP_MESSAGE.first_sequence],
+                    message[FIELDS_RESEND_GAP_MESSAGE.last_sequence],
+                )
+
+        if self.pending is not None and len(self.pending) > 0:
+            payloads = [self._resolve(p) for p in payloads]
+        return payloads
+
+    def _resolve(self, payload: bytes) -> bytes | Dict[str, Any]:
+        # Responses only complete their request, they are still handled in
+        # the order they arrived
+        try:
+            message = decode_message(payload)
+        except Exception:
+            return payload
+        self.pending.resolve(message)
+        return message
+
+    def _control_message(self, payload: bytes) -> Dict[str, Any] | None:
+        # Pings and resend gaps arrive unsequenced and are handled here
+        # rather than by the message handler. Both are tiny, so larger
+        # payloads are passed on without decoding them.
+        if len(payload) > _CONTROL_MAX_SIZE:
+            return None
+        try:
+            message = decode_message(payload)
+        except Exception:
+            return None
+        message_type = message.get(MESSAGE_TYPE, None)
+        if message_type == MESSAGE_TYPES.ping:
+            return message
+        if message_type == MESSAGE_TYPES.resend_gap and self.sequenced:
+            return message
+        return None
+
+    def _replies(self) -> List[str | bytes]:
+        """Pongs, resend requests and acknowledgements owed to the server"""
+        replies: List[str | bytes] = self._pongs
+        self._pongs = []
+        missing = self._window.missing()
+        if missing is not None:
+            replies.append(serialize_resend_message(*missing, codec=self.codec))
+        if self._window.unacknowledged >= ACK_EVERY:
+            replies.append(
+                serialize_ack_message(self._window.acknowledge(), codec=self.codec)
+            )
+        elif self._window.unacknowledged > 0 and self._ack_handle is None:
+            loop = asyncio.get_event_loop()
+            self._ack_handle = loop.call_later(ACK_DELAY, self._send_delayed_ack)
+        return replies
+
+    def _send_delayed_ack(self) -> None:
+        self._ack_handle = None
+        sequence = self._window.acknowledge()
+        if sequence is not None and self.is_connected:
+            _async(self.send(serialize_ack_message(sequence, codec=self.codec)))
 
     @property
     def is_connected(self) -> bool:
@@ -73,7 +294,7 @@ class AbstractChatClientProtocol(ABC):
         raise NotImplementedError("Protocols must implment connect")
 
     @abstractmethod
-    async def send(self, data: str):
+    async def send(self, data: str | bytes):
         raise NotImplementedError("Protocols must implement send method")
 
     @abstractmethod
@@ -83,17 +304,40 @@ class AbstractChatClientProtocol(ABC):
 
 class ChatClientProtocol(AbstractChatClientProtocol, asyncio.Protocol):
     _transport: asyncio.Transport
+    # Hands the messages of the last read to the message handler
+    _delivery: asyncio.Task | None = None
+
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        *,
+        codec: str = CODECS.json,
+        compression: str = COMPRESSIONS.none,
+        sequenced: bool = True,
+    ):
+        super().__init__(
+            host, port, codec=codec, compression=compression, sequenced=sequenced
+        )
+        self._decoder = FrameDecoder()
 
     async def connect(self):
         loop = asyncio.get_event_loop()
+        self._reset()
         await loop.create_connection(lambda: self, self._host, self._port)
+        await self.send(self._hello())
 
-    async def send(self, data: str):
+    async def send(self, data: str | bytes):
         if data:
-            message = data.encode(ENCODING)
-            self._transport.write(message)
+            message = data.encode(ENCODING) if isinstance(data, str) else data
+            self._check_frame_size(message)
+            self._transport.write(encode_frame(message))
 
     async def close(self):
+        self.pending.cancel_all()
+        if self._ack_handle is not None:
+            self._ack_handle.cancel()
+            self._ack_handle = None
         self._transport.close()
         # add this
         self._is_connected = False
@@ -107,14 +351,26 @@ class ChatClientProtocol(AbstractChatClientProtocol, asyncio.Protocol):
 
     def connection_lost(self, exc: Exception | None) -> None:
         self._is_connected = False
+        self.pending.cancel_all()
         if self.message_handler:
             _async(self.message_handler.on_connection_lost())
 
     def data_received(self, data: bytes) -> None:
-        message = data.decode(ENCODING)
-        message_handler = self.message_handler
-        if message_handler:
-            _async(message_handler.on_message_received(message))
+        frames = self._decoder.feed_sequenced(data)
+        messages = self._receive_frames(frames)
+        if self.message_handler and len(messages) > 0:
+            self._delivery = _async(self._deliver(self._delivery, messages))
+        for reply in self._replies():
+            _async(self.send(reply))
+
+    async def _deliver(
+        self, previous: asyncio.Task | None, messages: List[bytes | Dict[str, Any]]
+    ) -> None:
+        # Messages are handled one at a time, in the order they arrived
+        if previous is not None:
+            await asyncio.wait([previous])
+        for message in messages:
+            await self.message_handler.on_message_received(message)
 
 
 class TestProtocol(AbstractChatClientProtocol):
@@ -170,22 +426,44 @@ class HighLevelProtocol(AbstractChatClientProtocol):
     _reader: asyncio.StreamReader | None = None
     _writer: asyncio.StreamWriter | None = None
 
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        *,
+        codec: str = CODECS.json,
+        compression: str = COMPRESSIONS.none,
+        sequenced: bool = True,
+    ):
+        super().__init__(
+            host, port, codec=codec, compression=compression, sequenced=sequenced
+        )
+        self._decoder = FrameDecoder()
+
     async def connect(self) -> None:
         loop = asyncio.get_event_loop()
         reader, writer = await asyncio.open_connection(host=self._host, port=self._port)
+        self._reset()
         self._reader = reader
         self._writer = writer
         self._is_connected = True
         loop.create_task(self.receive())
+        await self.send(self._hello())
 
-    async def send(self, data: str) -> None:
+    async def send(self, data: str | bytes) -> None:
         if not self.is_connected or not self._writer:
             raise ConnectionError("Not connected to server")
-        data = data.encode(ENCODING)
-        self._writer.write(data)
+        if isinstance(data, str):
+            data = data.encode(ENCODING)
+        self._check_frame_size(data)
+        self._writer.write(encode_frame(data))
         await self._writer.drain()
 
     async def close(self):
+        self.pending.cancel_all()
+        if self._ack_handle is not None:
+            self._ack_handle.cancel()
+            self._ack_handle = None
         if self._writer:
             self._writer.close()
             self._is_connected = False
@@ -201,9 +479,12 @@ class HighLevelProtocol(AbstractChatClientProtocol):
             if len(data) == 0:
                 # disconnected?
                 continue
-            message = data.decode(ENCODING)
-            if self._message_handler:
-                await self._message_handler.on_message_received(message)
+            frames = self._decoder.feed_sequenced(data)
+            for payload in self._receive_frames(frames):
+                if self._message_handler:
+                    await self._message_handler.on_message_received(payload)
+            for reply in self._replies():
+                await self.send(reply)
 
 
 class HamletProtocol(AbstractChatClientProtocol):
@@ -56,6 +56,7 @@ _commands = namedtuple(
         "clear",
         "create_room",
         "dm",
+        "history",
         "join_room",
         "list",
         "logout",
@@ -68,6 +69,7 @@ COMMANDS = _commands(
     clear="\\clear",
     create_room="\\create",
     dm="\\dm",
+    history="\\history",
     join_room="\\join",
     list="\\list",
     logout="\\logout",
@@ -169,6 +171,8 @@ class ChatView(TabView):
                 if len(content) == 0:
                     return
                 message = CommandMessage(self, COMMAND_TYPES.dm, content)
+            case COMMANDS.history:
+                message = CommandMessage(self, COMMAND_TYPES.history)
             case COMMANDS.join_room:
                 if len(command_parts) < 2:
                     error_message = ErrorMessage(
@@ -388,21 +392,37 @@ class ChatView(TabView):
             active_user (str): The current logged in user, used to apply styles
         """
         for message in messages:
-            mine = message.get(FIELDS_CHAT_MESSAGE.authorid, "") == active_user.userid
-            style, border_style = get_styles(message, mine)
-            title_style = "italic" if mine else "bold"
-            title_align = "right" if mine else "left"
-            p = message_to_panel(
-                message=message,
-                style=style,
-                border_style=border_style,
-                title_style=title_style,
-                title_align=title_align,
-            )
-            self._message_panels.append(p)
+            self._message_panels.append(self._history_panel(message, active_user))
         group = Group(*self._message_panels) if len(self._message_panels) > 0 else ""
         await self._chat_scrollview.update(group, home=False)
 
+    async def prepend_history_messages(
+        self, messages: List[Dict[str, str]], active_user: User
+    ) -> None:
+        """Adds older messages above the current chat history
+
+        Args:
+            messages (List[dict]): A list of chat messages, oldest first
+            active_user (str): The current logged in user, used to apply styles
+        """
+        panels = [self._history_panel(message, active_user) for message in messages]
+        self._message_panels[:0] = panels
+        group = Group(*self._message_panels) if len(self._message_panels) > 0 else ""
+        await self._chat_scrollview.update(group, home=True)
+
+    def _history_panel(self, message: Dict[str, str], active_user: User) -> Panel:
+        mine = message.get(FIELDS_CHAT_MESSAGE.authorid, "") == active_user.userid
+        style, border_style = get_styles(message, mine)
+        title_style = "italic" if mine else "bold"
+        title_align = "right" if mine else "left"
+        return message_to_panel(
+            message=message,
+            style=style,
+            border_style=border_style,
+            title_style=title_style,
+            title_align=title_align,
+        )
+
     async def clear_history(self):
         """
         Clears all message panels from chat history window
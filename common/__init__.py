@@ -1,10 +1,46 @@
 from .errors import ERRORS, ERROR_TYPES
 from .commands import COMMAND_TYPES
 from .user import User
+from .compression import COMPRESSION_MIN_SIZE, CompressionError
+from .framing import (
+    FLAG_COMPRESSED,
+    FLAG_SEQUENCED,
+    FRAME_HEADER_SIZE,
+    MAX_FRAME_SIZE,
+    FrameDecoder,
+    FrameError,
+    encode_frame,
+    encode_frame_buffers,
+    encode_frame_header,
+    sequence_frame_header,
+)
+from .websocket import (
+    MAX_HANDSHAKE_SIZE,
+    WEBSOCKET_OPCODES,
+    WebSocketDecoder,
+    WebSocketError,
+    encode_websocket_frame,
+    encode_websocket_header,
+    handshake_request,
+    handshake_response,
+    parse_handshake,
+)
 
+from .binary_codec import BinaryCodecError
+from .delivery import ACK_DELAY, ACK_EVERY, ReceiveWindow
+from .correlation import REQUEST_TIMEOUT, PendingRequests, RequestTimeoutError
+from .schema import MessageSchema, SchemaRegistry
 from .message_factory import (
+    CODECS,
+    COMPRESSIONS,
+    RESYNC_MODES,
+    MESSAGE_REGISTRY,
+    MESSAGE_TAGS,
     MESSAGE_TYPE,
+    PROTOCOL_VERSION,
+    REQUEST_ID,
     MESSAGE_TYPES,
+    FIELDS_ACK_MESSAGE,
     FIELDS_BLACKLIST_MESSAGE,
     FIELDS_BLACKLIST_RESPONSE_MESSAGE,
     FIELDS_CREATE_ROOM_MESSAGE,
@@ -12,6 +48,10 @@ from .message_factory import (
     FIELDS_CHAT_MESSAGE,
     FIELDS_CHAT_MESSAGES,
     FIELDS_ERROR_MESSAGE,
+    FIELDS_HELLO_MESSAGE,
+    FIELDS_HELLO_RESPONSE_MESSAGE,
+    FIELDS_HISTORY_MESSAGE,
+    FIELDS_HISTORY_RESPONSE_MESSAGE,
     FIELDS_JOIN_ROOM_MESSAGE,
     FIELDS_JOIN_ROOM_RESPONSE_MESSAGE,
     FIELDS_LIST_ROOMS_MESSAGE,
@@ -19,17 +59,34 @@ from .message_factory import (
     FIELDS_LOGIN_MESSAGE,
     FIELDS_LOGIN_RESPONSE_MESSAGE,
     FIELDS_LOGOUT_MESSAGE,
+    FIELDS_PING_MESSAGE,
+    FIELDS_PONG_MESSAGE,
     FIELDS_REGISTER_MESSAGE,
     FIELDS_REGISTER_RESPONSE_MESSAGE,
+    FIELDS_RESEND_MESSAGE,
+    FIELDS_RESEND_GAP_MESSAGE,
+    FIELDS_RESUME_MESSAGE,
+    FIELDS_RESUME_RESPONSE_MESSAGE,
     FIELDS_UNBLOCK_MESSAGE,
     FIELDS_UNBLOCK_RESPONSE_MESSAGE,
     # message_factory,
+    decode_message,
+    encode_message,
+    transcode_message,
+    with_request_id,
+    encode_list_item,
+    join_list_items,
+    serialize_ack_message,
     serialize_blacklist_message,
     serialize_blacklist_response_message,
     serialize_chat,
     serialize_chat_messages,
     serialize_create_room_message,
     serialize_error_message,
+    serialize_hello_message,
+    serialize_hello_response_message,
+    serialize_history_message,
+    serialize_history_response_message,
     serialize_join_room_message,
     serialize_join_room_response_message,
     serialize_list_rooms_message,
@@ -37,9 +94,15 @@ from .message_factory import (
     serialize_login_message,
     serialize_login_response_message,
     serialize_logout_message,
+    serialize_ping_message,
+    serialize_pong_message,
     serialize_register_message,
     serialize_register_response_message,
     serialzie_create_room_response_message,
+    serialize_resend_message,
+    serialize_resend_gap_message,
+    serialize_resume_message,
+    serialize_resume_response_message,
     serialize_unblock_message,
     serialize_unblock_response_message,
 )
@@ -50,10 +113,48 @@ __all__ = [
     "COMMAND_TYPES",
     "User",
     "ENCODING",
+    "COMPRESSION_MIN_SIZE",
+    "CompressionError",
+    "FLAG_COMPRESSED",
+    "FLAG_SEQUENCED",
+    "FRAME_HEADER_SIZE",
+    "MAX_FRAME_SIZE",
+    "FrameDecoder",
+    "FrameError",
+    "encode_frame",
+    "encode_frame_buffers",
+    "encode_frame_header",
+    "sequence_frame_header",
+    "MAX_HANDSHAKE_SIZE",
+    "WEBSOCKET_OPCODES",
+    "WebSocketDecoder",
+    "WebSocketError",
+    "encode_websocket_frame",
+    "encode_websocket_header",
+    "handshake_request",
+    "handshake_response",
+    "parse_handshake",
     "ERRORS",
     "ERROR_TYPES",
+    "BinaryCodecError",
+    "ACK_DELAY",
+    "ACK_EVERY",
+    "ReceiveWindow",
+    "REQUEST_TIMEOUT",
+    "PendingRequests",
+    "RequestTimeoutError",
+    "MessageSchema",
+    "SchemaRegistry",
+    "CODECS",
+    "COMPRESSIONS",
+    "RESYNC_MODES",
+    "MESSAGE_REGISTRY",
+    "MESSAGE_TAGS",
     "MESSAGE_TYPE",
+    "PROTOCOL_VERSION",
+    "REQUEST_ID",
     "MESSAGE_TYPES",
+    "FIELDS_ACK_MESSAGE",
     "FIELDS_BLACKLIST_MESSAGE",
     "FIELDS_BLACKLIST_RESPONSE_MESSAGE",
     "FIELDS_CREATE_ROOM_MESSAGE",
@@ -61,6 +162,10 @@ __all__ = [
     "FIELDS_CHAT_MESSAGE",
     "FIELDS_CHAT_MESSAGES",
     "FIELDS_ERROR_MESSAGE",
+    "FIELDS_HELLO_MESSAGE",
+    "FIELDS_HELLO_RESPONSE_MESSAGE",
+    "FIELDS_HISTORY_MESSAGE",
+    "FIELDS_HISTORY_RESPONSE_MESSAGE",
     "FIELDS_JOIN_ROOM_MESSAGE",
     "FIELDS_JOIN_ROOM_RESPONSE_MESSAGE",
     "FIELDS_LIST_ROOMS_MESSAGE",
@@ -68,17 +173,34 @@ __all__ = [
     "FIELDS_LOGIN_MESSAGE",
     "FIELDS_LOGIN_RESPONSE_MESSAGE",
     "FIELDS_LOGOUT_MESSAGE",
+    "FIELDS_PING_MESSAGE",
+    "FIELDS_PONG_MESSAGE",
     "FIELDS_REGISTER_MESSAGE",
     "FIELDS_REGISTER_RESPONSE_MESSAGE",
+    "FIELDS_RESEND_MESSAGE",
+    "FIELDS_RESEND_GAP_MESSAGE",
+    "FIELDS_RESUME_MESSAGE",
+    "FIELDS_RESUME_RESPONSE_MESSAGE",
     "FIELDS_UNBLOCK_MESSAGE",
     "FIELDS_UNBLOCK_RESPONSE_MESSAGE",
     # "message_factory",
+    "decode_message",
+    "encode_message",
+    "transcode_message",
+    "with_request_id",
+    "encode_list_item",
+    "join_list_items",
+    "serialize_ack_message",
     "serialize_blacklist_message",
     "serialize_blacklist_response_message",
     "serialize_chat",
     "serialize_chat_messages",
     "serialize_create_room_message",
     "serialize_error_message",
+    "serialize_hello_message",
+    "serialize_hello_response_message",
+    "serialize_history_message",
+    "serialize_history_response_message",
     "serialize_join_room_message",
     "serialize_join_room_response_message",
     "serialize_list_rooms_message",
@@ -86,9 +208,15 @@ __all__ = [
     "serialize_login_message",
     "serialize_login_response_message",
     "serialize_logout_message",
+    "serialize_ping_message",
+    "serialize_pong_message",
     "serialize_register_message",
     "serialize_register_response_message",
     "serialzie_create_room_response_message",
+    "serialize_resend_message",
+    "serialize_resend_gap_message",
+    "serialize_resume_message",
+    "serialize_resume_response_message",
     "serialize_unblock_message",
     "serialize_unblock_response_message",
 ]
@@ -0,0 +1,217 @@
+import re
+from typing import Any, Dict, List, Tuple
+
+# Every value is written as a one byte value type followed by its data
+VALUE_NONE = 0
+VALUE_STR = 1
+VALUE_INT = 2
+VALUE_TRUE = 3
+VALUE_FALSE = 4
+VALUE_LIST = 5
+VALUE_RECORD = 6
+VALUE_MAP = 7
+VALUE_ABSENT = 8
+VALUE_UUID = 9
+
+_UUID_PATTERN = re.compile(
+    r"[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}\Z"
+)
+
+
+class BinaryCodecError(Exception):
+    def __init__(self, *args: object) -> None:
+        super().__init__(*args)
+
+
+def _write_varint(out: bytearray, value: int) -> None:
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _read_varint(data: bytes, offset: int) -> Tuple[int, int]:
+    result = 0
+    shift = 0
+    while True:
+        if offset >= len(data):
+            raise BinaryCodecError("Truncated varint")
+        byte = data[offset]
+        offset += 1
+        result |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return result, offset
+        shift += 7
+
+
+class BinaryCodec:
+    """Compact binary encoding for protocol messages.
+
+    Message types are written as integer tags and fields are written by their
+    position in the message schema instead of by name. Strings are length
+    prefixed and canonical UUID strings are packed into 16 bytes.
+
+    Dicts whose keys all belong to record_fields (chat messages) are written
+    positionally as records, any other dict is written as a map.
+    """
+
+    def __init__(
+        self,
+        type_field: str,
+        tags: Dict[str, int],
+        schemas: Dict[str, Tuple[str, ...]],
+        record_fields: Tuple[str, ...],
+    ) -> None:
+        self.type_field = type_field
+        self.tags = tags
+        self.types = {tag: name for name, tag in tags.items()}
+        self.schemas = schemas
+        self.record_fields = record_fields
+        self._record_field_set = frozenset(record_fields)
+
+    def encode(self, payload: Dict[str, Any]) -> bytes:
+        message_type = payload[self.type_field]
+        tag = self.tags.get(message_type, None)
+        if tag is None:
+            raise BinaryCodecError(f"Unknown message type: {message_type}")
+        fields = self.schemas[message_type]
+
+        out = bytearray()
+        _write_varint(out, tag)
+        _write_varint(out, len(fields))
+        written = 1
+        for field in fields:
+            if field in payload:
+                self._write_value(out, payload[field])
+                written += 1
+            else:
+                out.append(VALUE_ABSENT)
+
+        if written != len(payload):
+            unknown = set(payload) - set(fields) - {self.type_field}
+            raise BinaryCodecError(f"Fields not in schema: {unknown}")
+
+        return bytes(out)
+
+    def decode(self, data: bytes) -> Dict[str, Any]:
+        tag, offset = _read_varint(data, 0)
+        message_type = self.types.get(tag, None)
+        if message_type is None:
+            raise BinaryCodecError(f"Unknown message tag: {tag}")
+        fields = self.schemas[message_type]
+
+        count, offset = _read_varint(data, offset)
+        payload: Dict[str, Any] = {self.type_field: message_type}
+        for i in range(count):
+            value, offset = self._read_value(data, offset)
+            # Fields added by newer peers are skipped
+            if i < len(fields) and value is not _ABSENT:
+                payload[fields[i]] = value
+
+        return payload
+
+    def _write_value(self, out: bytearray, value: Any) -> None:
+        if value is None:
+            out.append(VALUE_NONE)
+        elif isinstance(value, str):
+            if len(value) == 36 and _UUID_PATTERN.match(value):
+                out.append(VALUE_UUID)
+                out += bytes.fromhex(value.replace("-", ""))
+                return
+            encoded = value.encode("utf8")
+            out.append(VALUE_STR)
+            _write_varint(out, len(encoded))
+            out += encoded
+        elif value is True:
+            out.append(VALUE_TRUE)
+        elif value is False:
+            out.append(VALUE_FALSE)
+        elif isinstance(value, int):
+            out.append(VALUE_INT)
+            # zigzag so small negative numbers stay small
+            _write_varint(out, (value << 1) if value >= 0 else ((-value << 1) - 1))
+        elif isinstance(value, (list, tuple)):
+            out.append(VALUE_LIST)
+            _write_varint(out, len(value))
+            for item in value:
+                self._write_value(out, item)
+        elif isinstance(value, dict):
+            if self._record_field_set.issuperset(value):
+                out.append(VALUE_RECORD)
+                _write_varint(out, len(self.record_fields))
+                for field in self.record_fields:
+                    if field in value:
+                        self._write_value(out, value[field])
+                    else:
+                        out.append(VALUE_ABSENT)
+            else:
+                out.append(VALUE_MAP)
+                _write_varint(out, len(value))
+                for key, item in value.items():
+                    self._write_value(out, str(key))
+                    self._write_value(out, item)
+        else:
+            raise BinaryCodecError(f"Can not encode value of type {type(value)}")
+
+    def _read_value(self, data: bytes, offset: int) -> Tuple[Any, int]:
+        if offset >= len(data):
+            raise BinaryCodecError("Truncated message")
+        value_type = data[offset]
+        offset += 1
+
+        if value_type == VALUE_STR:
+            length, offset = _read_varint(data, offset)
+            end = offset + length
+            if end > len(data):
+                raise BinaryCodecError("Truncated string")
+            return bytes(data[offset:end]).decode("utf8"), end
+        if value_type == VALUE_UUID:
+            end = offset + 16
+            if end > len(data):
+                raise BinaryCodecError("Truncated uuid")
+            h = bytes(data[offset:end]).hex()
+            return f"{h[:8]}-{h[8:12]}-{h[12:16]}-{h[16:20]}-{h[20:]}", end
+        if value_type == VALUE_NONE:
+            return None, offset
+        if value_type == VALUE_ABSENT:
+            return _ABSENT, offset
+        if value_type == VALUE_TRUE:
+            return True, offset
+        if value_type == VALUE_FALSE:
+            return False, offset
+        if value_type == VALUE_INT:
+            value, offset = _read_varint(data, offset)
+            return (value >> 1) if not value & 1 else -((value + 1) >> 1), offset
+        if value_type == VALUE_LIST:
+            count, offset = _read_varint(data, offset)
+            items: List[Any] = []
+            for _ in range(count):
+                item, offset = self._read_value(data, offset)
+                items.append(item)
+            return items, offset
+        if value_type == VALUE_RECORD:
+            count, offset = _read_varint(data, offset)
+            record: Dict[str, Any] = {}
+            for i in range(count):
+                item, offset = self._read_value(data, offset)
+                if i < len(self.record_fields) and item is not _ABSENT:
+                    record[self.record_fields[i]] = item
+            return record, offset
+        if value_type == VALUE_MAP:
+            count, offset = _read_varint(data, offset)
+            mapping: Dict[str, Any] = {}
+            for _ in range(count):
+                key, offset = self._read_value(data, offset)
+                item, offset = self._read_value(data, offset)
+                mapping[key] = item
+            return mapping, offset
+
+        raise BinaryCodecError(f"Unknown value type: {value_type}")
+
+
+class _Absent:
+    def __repr__(self) -> str:
+        return "<absent>"
+
+
+_ABSENT = _Absent()
@@ -6,6 +6,7 @@ _command_types = namedtuple(
         "block",
         "create_room",
         "dm",
+        "history",
         "join_room",
         "list_rooms",
         "list_users",
@@ -18,6 +19,7 @@ COMMAND_TYPES = _command_types(
     block="block",
     create_room="create_room",
     dm="dm",
+    history="history",
     join_room="join_room",
     list_rooms="list_rooms",
     list_users="list_users",
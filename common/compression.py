@@ -0,0 +1,72 @@
+import zlib
+
+# Frames smaller than this are not worth compressing
+COMPRESSION_MIN_SIZE = 512
+
+_WBITS = -15  # raw deflate, frames carry their own length
+
+
+# Preset dictionary made of the protocol's field names, so even a single
+# frame compresses well. zlib favours strings near the end of the
+# dictionary, so chat records, the most common content, go last.
+#
+# Peers must inflate with the exact dictionary a frame was deflated with,
+# and a mismatch yields garbage rather than an error. It is therefore
+# frozen as it was when compression was introduced: never change it, add
+# fields to the schemas without touching it.
+COMPRESSION_DICTIONARY = (
+    b'{"message_type": "message_chat", "messages": ""}'
+    b'{"message_type": "blacklist", "userid": "", "blocked_username": ""}'
+    b'{"message_type": "blacklist_response", "userid": "", "blocked_username": ""}'
+    b'{"message_type": "create_room", "name": ""}'
+    b'{"message_type": "create_room_response", "name": ""}'
+    b'{"message_type": "join_room", "userid": "", "roomname": "", "roomid": ""}'
+    b'{"message_type": "join_room_response", "userid": "", "roomname": "", "roomid'
+    b'": ""}'
+    b'{"message_type": "list_rooms", "rooms": ""}'
+    b'{"message_type": "list_users", "roomname": "", "roomid": "", "users": ""}'
+    b'{"message_type": "message_login", "username": "", "password": ""}'
+    b'{"message_type": "message_login_response", "username": "", "id": "", "roomid'
+    b'": "", "roomname": ""}'
+    b'{"message_type": "message_logout", "username": "", "id": ""}'
+    b'{"message_type": "message_register", "username": "", "password": ""}'
+    b'{"message_type": "message_register_response", "username": "", "status": ""}'
+    b'{"message_type": "message_error", "errortype": "", "message": ""}'
+    b'{"message_type": "unblock", "userid": "", "blocked_username": ""}'
+    b'{"message_type": "unblock_response", "userid": "", "blocked_username": ""}'
+    b'{"message_type": "hello", "codecs": "", "compressions": ""}'
+    b'{"message_type": "hello_response", "codec": "", "compression": ""}'
+    b'{"message_type": "message_chat", "messages": [{"id": "", "authorname": "", "'
+    b'authorid": "", "target_username": "", "roomid": "", "target_userid": "NONE",'
+    b' "message": "", "createdate": "+00:00"}, {"id": "", "authorname": "", "autho'
+    b'rid": "", "target_username": "", "roomid": "", "target_userid": "NONE", "mes'
+    b'sage": "", "createdate": "+00:00"}]}'
+)
+
+
+class CompressionError(Exception):
+    def __init__(self, *args: object) -> None:
+        super().__init__(*args)
+
+
+def compress_payload(payload: bytes, level: int = 6) -> bytes:
+    compressor = zlib.compressobj(
+        level, zlib.DEFLATED, _WBITS, zdict=COMPRESSION_DICTIONARY
+    )
+    return compressor.compress(payload) + compressor.flush()
+
+
+def decompress_payload(data: bytes, max_size: int) -> bytes:
+    """Inflates a compressed payload
+
+    Raises:
+        CompressionError: data is invalid or inflates past max_size
+    """
+    decompressor = zlib.decompressobj(_WBITS, zdict=COMPRESSION_DICTIONARY)
+    try:
+        payload = decompressor.decompress(data, max_size)
+    except zlib.error as e:
+        raise CompressionError(e)
+    if decompressor.unconsumed_tail:
+        raise CompressionError(f"Compressed frame inflates past {max_size} bytes")
+    return payload
@@ -0,0 +1,92 @@
+import asyncio
+from itertools import count
+from typing import Any, Dict
+
+from .message_factory import REQUEST_ID
+
+# Seconds to wait for a response before a request fails
+REQUEST_TIMEOUT = 10.0
+
+
+class RequestTimeoutError(Exception):
+    def __init__(self, *args: object) -> None:
+        super().__init__(*args)
+
+
+class PendingRequests:
+    """Requests waiting for a response, keyed by REQUEST_ID
+
+    Each request gets its own future, so many requests can be in flight
+    on one connection and answered in any order.
+    """
+
+    def __init__(self, timeout: float = REQUEST_TIMEOUT) -> None:
+        self.timeout = timeout
+        self._ids = count(1)
+        self._pending: Dict[str, asyncio.Future] = {}
+        self._timers: Dict[str, asyncio.TimerHandle] = {}
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def __contains__(self, requestid: str) -> bool:
+        return requestid in self._pending
+
+    def next_id(self) -> str:
+        return str(next(self._ids))
+
+    def add(self, requestid: str, timeout: float | None = None) -> asyncio.Future:
+        """Registers a request and returns the future of its response
+
+        The future fails with RequestTimeoutError if no response arrives
+        within timeout seconds.
+        """
+        if requestid in self._pending:
+            raise ValueError(f"Request {requestid} is already pending")
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending[requestid] = future
+        timeout = self.timeout if timeout is None else timeout
+        if timeout > 0:
+            self._timers[requestid] = loop.call_later(
+                timeout, self._expire, requestid, timeout
+            )
+        return future
+
+    def resolve(self, message: Dict[str, Any]) -> bool:
+        """Completes the request a response belongs to
+
+        Returns:
+            bool: False if the message does not answer a pending request
+        """
+        requestid = message.get(REQUEST_ID, None)
+        future = self._pop(requestid) if requestid is not None else None
+        if future is None:
+            return False
+        if not future.done():
+            future.set_result(message)
+        return True
+
+    def cancel(self, requestid: str) -> bool:
+        future = self._pop(requestid)
+        if future is None:
+            return False
+        return future.cancel()
+
+    def cancel_all(self) -> None:
+        for requestid in list(self._pending):
+            self.cancel(requestid)
+
+    def _expire(self, requestid: str, timeout: float) -> None:
+        self._timers.pop(requestid, None)
+        future = self._pop(requestid)
+        if future is not None and not future.done():
+            future.set_exception(
+                RequestTimeoutError(f"No response to request {requestid} in {timeout}s")
+            )
+
+    def _pop(self, requestid: str) -> asyncio.Future | None:
+        timer = self._timers.pop(requestid, None)
+        if timer is not None:
+            timer.cancel()
+        return self._pending.pop(requestid, None)
@@ -0,0 +1,86 @@
+from typing import Dict, List, Tuple
+
+# Acknowledge after this many frames, or after ACK_DELAY seconds
+ACK_EVERY = 32
+ACK_DELAY = 0.5
+# Out of order frames held while waiting for a resend
+MAX_PENDING_FRAMES = 1024
+
+
+class ReceiveWindow:
+    """Puts sequenced frames back in order on the receiving side
+
+    The server numbers every frame it sends from 1. Frames that arrive
+    after a gap are held until the missing frames are resent, or until the
+    server reports it can no longer resend them.
+    """
+
+    def __init__(self, max_pending: int = MAX_PENDING_FRAMES) -> None:
+        self.max_pending = max_pending
+        # Next sequence number to deliver
+        self.expected = 1
+        self.acknowledged = 0
+        self._pending: Dict[int, bytes] = {}
+        self._requested = 0
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending)
+
+    @property
+    def unacknowledged(self) -> int:
+        return self.expected - 1 - self.acknowledged
+
+    def receive(self, sequence: int, payload: bytes) -> List[bytes]:
+        """Adds a frame and returns the payloads that are now in order"""
+        if sequence < self.expected or sequence in self._pending:
+            # Duplicate, e.g. resent after the original arrived late
+            return []
+        if sequence != self.expected:
+            self._pending[sequence] = payload
+            if len(self._pending) > self.max_pending:
+                # The gap is not being filled, stop waiting for it
+                return self.skip(self.expected, min(self._pending) - 1)
+            return []
+
+        self.expected += 1
+        return [payload] + self._drain()
+
+    def skip(self, first_sequence: int, last_sequence: int) -> List[bytes]:
+        """Gives up on frames that can not be resent
+
+        Returns:
+            List[bytes]: Held payloads that are now in order
+        """
+        if first_sequence > self.expected or last_sequence < self.expected:
+            return []
+        self.expected = last_sequence + 1
+        for sequence in [s for s in self._pending if s < self.expected]:
+            del self._pending[sequence]
+        return self._drain()
+
+    def missing(self) -> Tuple[int, int] | None:
+        """Returns the (first, last) sequence range to ask the server to
+        resend, or None. Each gap is only reported once.
+        """
+        if len(self._pending) == 0:
+            return None
+        last_sequence = min(self._pending) - 1
+        if last_sequence <= self._requested:
+            return None
+        self._requested = last_sequence
+        return self.expected, last_sequence
+
+    def acknowledge(self) -> int | None:
+        """Returns the sequence number to acknowledge, None if up to date"""
+        if self.unacknowledged <= 0:
+            return None
+        self.acknowledged = self.expected - 1
+        return self.acknowledged
+
+    def _drain(self) -> List[bytes]:
+        payloads: List[bytes] = []
+        while self.expected in self._pending:
+            payloads.append(self._pending.pop(self.expected))
+            self.expected += 1
+        return payloads
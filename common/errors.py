@@ -10,6 +10,10 @@ _errors = namedtuple(
         "invalid_room",
         "server_error",
         "room_not_found",
+        "invalid_session",
+        "server_busy",
+        "rate_limited",
+        "message_not_found",
     ],
 )
 
@@ -21,6 +25,10 @@ ERROR_TYPES = _errors(
     invalid_room="invalid_room",
     server_error="server_error",
     room_not_found="room_not_found",
+    invalid_session="invalid_session",
+    server_busy="server_busy",
+    rate_limited="rate_limited",
+    message_not_found="message_not_found",
 )
 
 ERRORS = _errors(
@@ -31,4 +39,8 @@ ERRORS = _errors(
     server_error="server error",
     room_not_found="room_not_found",
     invalid_room="room already exists",
+    invalid_session="session expired, please sign in again",
+    server_busy="server busy, please try again",
+    rate_limited="sending too fast, please slow down",
+    message_not_found="message not found",
 )
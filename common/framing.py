@@ -0,0 +1,148 @@
+import struct
+from typing import List, Tuple
+
+from .compression import (
+    COMPRESSION_MIN_SIZE,
+    CompressionError,
+    compress_payload,
+    decompress_payload,
+)
+from .message_factory import COMPRESSIONS
+
+# Every payload on the wire is prefixed with a fixed size header:
+#   flags  (1 byte, unsigned)
+#   length (4 bytes, unsigned, big endian) - size of the payload that follows
+FRAME_HEADER = struct.Struct("!BI")
+FRAME_HEADER_SIZE = FRAME_HEADER.size
+# Sequenced frames carry their sequence number between header and payload
+FRAME_SEQUENCE = struct.Struct("!I")
+FRAME_SEQUENCE_SIZE = FRAME_SEQUENCE.size
+
+MAX_FRAME_SIZE = 1024 * 1024
+
+# Frame flags
+FLAG_COMPRESSED = 0x01
+FLAG_SEQUENCED = 0x02
+_KNOWN_FLAGS = FLAG_COMPRESSED | FLAG_SEQUENCED
+
+
+class FrameError(Exception):
+    def __init__(self, *args: object) -> None:
+        super().__init__(*args)
+
+
+def encode_frame_header(length: int, flags: int = 0) -> bytes:
+    if length > MAX_FRAME_SIZE:
+        raise FrameError(f"Frame of {length} bytes exceeds {MAX_FRAME_SIZE} bytes")
+    return FRAME_HEADER.pack(flags, length)
+
+
+def sequence_frame_header(header: bytes, sequence: int) -> bytes:
+    """Marks a frame header as sequenced and appends the sequence number
+
+    The payload is untouched, so frames shared between connections keep
+    sharing their payload buffer.
+    """
+    return (
+        bytes((header[0] | FLAG_SEQUENCED,))
+        + header[1:FRAME_HEADER_SIZE]
+        + FRAME_SEQUENCE.pack(sequence)
+    )
+
+
+def encode_frame(payload: bytes, flags: int = 0) -> bytes:
+    return encode_frame_header(len(payload), flags) + payload
+
+
+def encode_frame_buffers(
+    payload: bytes,
+    compression: str = COMPRESSIONS.none,
+    min_size: int = COMPRESSION_MIN_SIZE,
+) -> Tuple[bytes, bytes]:
+    """Builds the (header, payload) buffers of a frame
+
+    Payloads of at least min_size bytes are deflated when the connection
+    negotiated compression and it makes them smaller.
+    """
+    flags = 0
+    if compression == COMPRESSIONS.deflate and len(payload) >= min_size:
+        compressed = compress_payload(payload)
+        if len(compressed) < len(payload):
+            payload = compressed
+            flags |= FLAG_COMPRESSED
+    return encode_frame_header(len(payload), flags), payload
+
+
+class FrameDecoder:
+    """Incremental decoder for length prefixed frames.
+
+    TCP is a stream, so a single read can hold several frames, or only part
+    of one. Bytes are buffered until a full frame is available.
+    """
+
+    def __init__(self, max_frame_size: int = MAX_FRAME_SIZE) -> None:
+        self.max_frame_size = max_frame_size
+        self._buffer = bytearray()
+
+    @property
+    def buffered(self) -> int:
+        return len(self._buffer)
+
+    def feed(self, data: bytes) -> List[bytes]:
+        """Adds data to the buffer and returns every complete payload
+
+        Args:
+            data (bytes): Bytes read from the stream
+
+        Raises:
+            FrameError: The stream contains an invalid header
+
+        Returns:
+            List[bytes]: Complete payloads, in the order they were received
+        """
+        return [payload for _, payload in self.feed_sequenced(data)]
+
+    def feed_sequenced(self, data: bytes) -> List[Tuple[int | None, bytes]]:
+        """Like feed, but also returns the sequence number of each payload
+
+        Returns:
+            List[Tuple[int | None, bytes]]: (sequence, payload) pairs, the
+                sequence is None for frames sent without one
+        """
+        self._buffer.extend(data)
+
+        frames: List[Tuple[int | None, bytes]] = []
+        offset = 0
+        available = len(self._buffer)
+        while available - offset >= FRAME_HEADER_SIZE:
+            flags, length = FRAME_HEADER.unpack_from(self._buffer, offset)
+            if flags & ~_KNOWN_FLAGS:
+                raise FrameError(f"Unknown frame flags: {flags:#04x}")
+            if length > self.max_frame_size:
+                raise FrameError(
+                    f"Frame of {length} bytes exceeds {self.max_frame_size} bytes"
+                )
+            start = offset + FRAME_HEADER_SIZE
+            if flags & FLAG_SEQUENCED:
+                start += FRAME_SEQUENCE_SIZE
+            end = start + length
+            if end > available:
+                break
+            sequence = None
+            if flags & FLAG_SEQUENCED:
+                (sequence,) = FRAME_SEQUENCE.unpack_from(
+                    self._buffer, offset + FRAME_HEADER_SIZE
+                )
+            payload = bytes(self._buffer[start:end])
+            offset = end
+            if flags & FLAG_COMPRESSED:
+                try:
+                    payload = decompress_payload(payload, self.max_frame_size)
+                except CompressionError as e:
+                    raise FrameError(e)
+            frames.append((sequence, payload))
+
+        if offset > 0:
+            del self._buffer[:offset]
+
+        return frames
@@ -1,11 +1,15 @@
 import json
-from typing import Dict, List
+from typing import Any, Dict, Iterable, List
 from collections import namedtuple
 
+from .binary_codec import BinaryCodec
+from .schema import SchemaRegistry
+
 # Creating constants for client/server communication
 _message_types = namedtuple(
     "MESSAGE_TYPES",
     [
+        "ack",
         "chat",
         "blacklist",
         "blacklist_response",
@@ -18,22 +22,41 @@ _message_types = namedtuple(
         "login",
         "login_response",
         "logout",
+        "ping",
+        "pong",
         "register",
         "register_response",
+        "resend",
+        "resend_gap",
+        "resume",
+        "resume_response",
         "error",
+        "hello",
+        "hello_response",
+        "history",
+        "history_response",
         "unblock",
         "unblock_response",
     ],
 )
 
 MESSAGE_TYPE = "message_type"
+# Sent in the hello message. Peers that send no version speak version 1.
+PROTOCOL_VERSION = 2
+# Optional on every message. Responses echo the id of the request they answer.
+REQUEST_ID = "requestid"
 MESSAGE_TYPES = _message_types(
+    ack="ack",
     blacklist="blacklist",
     blacklist_response="blacklist_response",
     chat="message_chat",
     create_room="create_room",
     create_room_response="create_room_response",
     error="message_error",
+    hello="hello",
+    hello_response="hello_response",
+    history="history",
+    history_response="history_response",
     join_room="join_room",
     join_room_response="join_room_response",
     list_rooms="list_rooms",
@@ -41,12 +64,32 @@ MESSAGE_TYPES = _message_types(
     login="message_login",
     login_response="message_login_response",
     logout="message_logout",
+    ping="ping",
+    pong="pong",
     register="message_register",
     register_response="message_register_response",
+    resend="resend",
+    resend_gap="resend_gap",
+    resume="resume",
+    resume_response="resume_response",
     unblock="unblock",
     unblock_response="unblock_response",
 )
 
+# Wire encodings a connection can use
+_codecs = namedtuple("CODECS", ["json", "binary"])
+CODECS = _codecs(json="json", binary="binary")
+
+# Frame compression a connection can use
+_compressions = namedtuple("COMPRESSIONS", ["none", "deflate"])
+COMPRESSIONS = _compressions(none="none", deflate="deflate")
+
+# delta: only the messages after lastid follow the join response
+# full: the client was too far behind and must reload the room
+_resync_modes = namedtuple("RESYNC_MODES", ["delta", "full"])
+RESYNC_MODES = _resync_modes(delta="delta", full="full")
+
+_fields_ack_message = namedtuple("FIELDS_ACK_MESSAGE", ["sequence"])
 _fields_blacklist_message = namedtuple(
     "FIELDS_BLACKLIST_MESSAGE", ["userid", "blocked_username"]
 )
@@ -66,22 +109,55 @@ _fields_chat_message = namedtuple(
 )
 _fields_chat_messages = namedtuple("CHAT_MESSAGES", ["messages"])
 _fields_error_message = namedtuple("FIELDS_ERROR_MESSAGE", ["errortype", "message"])
+_fields_hello_message = namedtuple(
+    "FIELDS_HELLO_MESSAGE",
+    ["codecs", "compressions", "sequenced", "version", "max_frame_size", "batching"],
+)
+_fields_hello_response_message = namedtuple(
+    "FIELDS_HELLO_RESPONSE_MESSAGE",
+    ["codec", "compression", "sequenced", "version", "max_frame_size", "batching"],
+)
+_fields_history_message = namedtuple(
+    "FIELDS_HISTORY_MESSAGE", ["roomid", "before", "limit"]
+)
+_fields_history_response_message = namedtuple(
+    "FIELDS_HISTORY_RESPONSE_MESSAGE", ["roomid", "messages", "cursor", "more"]
+)
 _fields_join_room_message = namedtuple(
-    "FIELDS_JOIN_ROOM_MESSAGE", ["userid", "roomname", "roomid"]
+    "FIELDS_JOIN_ROOM_MESSAGE", ["userid", "roomname", "roomid", "lastid"]
+)
+_fields_join_room_response_message = namedtuple(
+    "FIELDS_JOIN_ROOM_RESPONSE_MESSAGE", ["userid", "roomname", "roomid", "resync"]
+)
+_fields_list_rooms_message = namedtuple(
+    "FIELDS_LIST_ROOMS_MESSAGE",
+    ["rooms", "prefix", "cursor", "limit", "version", "more"],
 )
-_fields_list_rooms_message = namedtuple("FIELDS_LIST_ROOMS_MESSAGE", ["rooms"])
 _fields_list_users_message = namedtuple(
-    "FIELDS_LIST_USERS_MESSAGE", ["roomname", "roomid", "users"]
+    "FIELDS_LIST_USERS_MESSAGE",
+    ["roomname", "roomid", "users", "prefix", "cursor", "limit", "version", "more"],
 )
 _fields_login_message = namedtuple("FIELDS_LOGIN_MESSAGE", ["username", "password"])
 _fields_login_response_message = namedtuple(
-    "FIELDS_LOGIN_RESPONSE_MESSAGE", ["username", "userid", "roomid", "roomname"]
+    "FIELDS_LOGIN_RESPONSE_MESSAGE",
+    ["username", "userid", "roomid", "roomname", "token"],
 )
 _fields_logout_message = namedtuple("FIELDS_LOGOUT_MESSAGE", ["username", "userid"])
+_fields_ping_message = namedtuple("FIELDS_PING_MESSAGE", ["nonce"])
+_fields_resend_message = namedtuple(
+    "FIELDS_RESEND_MESSAGE", ["first_sequence", "last_sequence"]
+)
+_fields_resume_message = namedtuple(
+    "FIELDS_RESUME_MESSAGE", ["token", "roomid", "lastid"]
+)
+_fields_resume_response_message = namedtuple(
+    "FIELDS_RESUME_RESPONSE_MESSAGE", ["username", "userid", "token"]
+)
 _fields_register_response_message = namedtuple(
     "FIELDS_REGISTER_RESPONSE_MESSAGE", ["username", "status"]
 )
 
+FIELDS_ACK_MESSAGE = _fields_ack_message(sequence="sequence")
 FIELDS_BLACKLIST_MESSAGE = _fields_blacklist_message(
     userid="userid", blocked_username="blocked_username"
 )
@@ -102,22 +178,78 @@ FIELDS_CHAT_MESSAGES = _fields_chat_messages(messages="messages")
 FIELDS_CREATE_ROOM_MESSAGE = _fields_create_room_message(name="name")
 FIELDS_CREATE_ROOM_RESPONSE_MESSAGE = _fields_create_room_message(name="name")
 FIELDS_ERROR_MESSAGE = _fields_error_message(errortype="errortype", message="message")
+# max_frame_size is the largest frame the sender accepts, batching is
+# whether it accepts writes being held back briefly to coalesce them
+FIELDS_HELLO_MESSAGE = _fields_hello_message(
+    codecs="codecs",
+    compressions="compressions",
+    sequenced="sequenced",
+    version="version",
+    max_frame_size="max_frame_size",
+    batching="batching",
+)
+FIELDS_HELLO_RESPONSE_MESSAGE = _fields_hello_response_message(
+    codec="codec",
+    compression="compression",
+    sequenced="sequenced",
+    version="version",
+    max_frame_size="max_frame_size",
+    batching="batching",
+)
+# before is the id of the oldest message the client has, empty for the latest
+FIELDS_HISTORY_MESSAGE = _fields_history_message(
+    roomid="roomid", before="before", limit="limit"
+)
+# cursor is the id of the oldest message in the response, more is False
+# once the start of the room's history is reached
+FIELDS_HISTORY_RESPONSE_MESSAGE = _fields_history_response_message(
+    roomid="roomid", messages="messages", cursor="cursor", more="more"
+)
+# lastid is the id of the newest message the client already has in the room
 FIELDS_JOIN_ROOM_MESSAGE = _fields_join_room_message(
-    userid="userid", roomname="roomname", roomid="roomid"
+    userid="userid", roomname="roomname", roomid="roomid", lastid="lastid"
+)
+# resync is one of RESYNC_MODES when the join carried a lastid
+FIELDS_JOIN_ROOM_RESPONSE_MESSAGE = _fields_join_room_response_message(
+    userid="userid", roomname="roomname", roomid="roomid", resync="resync"
 )
-FIELDS_JOIN_ROOM_RESPONSE_MESSAGE = _fields_join_room_message(
-    userid="userid", roomname="roomname", roomid="roomid"
+# Paged like list_users. A request may carry the version of the room list
+# the client holds, the response leaves rooms out when it is still current
+FIELDS_LIST_ROOMS_MESSAGE = _fields_list_rooms_message(
+    rooms="rooms",
+    prefix="prefix",
+    cursor="cursor",
+    limit="limit",
+    version="version",
+    more="more",
 )
-FIELDS_LIST_ROOMS_MESSAGE = _fields_list_rooms_message(rooms="rooms")
+# Requests may ask for the users whose name starts with prefix, limit at
+# a time, after the name in cursor. Responses carry the cursor of the next
+# page, whether there is one and the version of the room's membership
 FIELDS_LIST_USERS_MESSAGE = _fields_list_users_message(
-    roomid="roomid", roomname="roomname", users="users"
+    roomid="roomid",
+    roomname="roomname",
+    users="users",
+    prefix="prefix",
+    cursor="cursor",
+    limit="limit",
+    version="version",
+    more="more",
 )
 FIELDS_LOGIN_MESSAGE = _fields_login_message(username="username", password="password")
+# token lets the client resume the session after a reconnect
 FIELDS_LOGIN_RESPONSE_MESSAGE = _fields_login_response_message(
-    username="username", userid="id", roomid="roomid", roomname="roomname"
+    username="username",
+    userid="id",
+    roomid="roomid",
+    roomname="roomname",
+    token="token",
 )
 # logout message requires same fields as login response
 FIELDS_LOGOUT_MESSAGE = _fields_logout_message(username="username", userid="id")
+# a pong echoes the nonce of the ping it answers
+FIELDS_PING_MESSAGE = _fields_ping_message(nonce="nonce")
+FIELDS_PONG_MESSAGE = _fields_ping_message(nonce="nonce")
 # registration requires same fields as login
 FIELDS_REGISTER_MESSAGE = _fields_login_message(
     username="username", password="password"
@@ -125,6 +257,22 @@ FIELDS_REGISTER_MESSAGE = _fields_login_message(
 FIELDS_REGISTER_RESPONSE_MESSAGE = _fields_register_response_message(
     username="username", status="status"
 )
+FIELDS_RESEND_MESSAGE = _fields_resend_message(
+    first_sequence="first_sequence", last_sequence="last_sequence"
+)
+# a resend gap lists the frames the server can no longer resend
+FIELDS_RESEND_GAP_MESSAGE = _fields_resend_message(
+    first_sequence="first_sequence", last_sequence="last_sequence"
+)
+# resume restores a session from its token instead of the password. lastid
+# is the newest message the client has in roomid, as in join_room.
+FIELDS_RESUME_MESSAGE = _fields_resume_message(
+    token="token", roomid="roomid", lastid="lastid"
+)
+# the response carries a fresh token, the room follows in join_room_response
+FIELDS_RESUME_RESPONSE_MESSAGE = _fields_resume_response_message(
+    username="username", userid="id", token="token"
+)
 FIELDS_UNBLOCK_MESSAGE = _fields_blacklist_message(
     userid="userid", blocked_username="blocked_username"
 )
@@ -133,24 +281,170 @@ FIELDS_UNBLOCK_RESPONSE_MESSAGE = _fields_blacklist_message(
 )
 
 
-def serialize_blacklist_message(userid: str, blocked_username: str) -> str:
-    payload = {
-        MESSAGE_TYPE: MESSAGE_TYPES.blacklist,
-        FIELDS_BLACKLIST_MESSAGE.userid: userid,
-        FIELDS_BLACKLIST_MESSAGE.blocked_username: blocked_username,
-    }
+# Integer tags used in place of MESSAGE_TYPES by the binary codec.
+# Tags are part of the wire format, never reuse or renumber them.
+MESSAGE_TAGS: Dict[str, int] = {
+    MESSAGE_TYPES.chat: 1,
+    MESSAGE_TYPES.blacklist: 2,
+    MESSAGE_TYPES.blacklist_response: 3,
+    MESSAGE_TYPES.create_room: 4,
+    MESSAGE_TYPES.create_room_response: 5,
+    MESSAGE_TYPES.join_room: 6,
+    MESSAGE_TYPES.join_room_response: 7,
+    MESSAGE_TYPES.list_rooms: 8,
+    MESSAGE_TYPES.list_users: 9,
+    MESSAGE_TYPES.login: 10,
+    MESSAGE_TYPES.login_response: 11,
+    MESSAGE_TYPES.logout: 12,
+    MESSAGE_TYPES.register: 13,
+    MESSAGE_TYPES.register_response: 14,
+    MESSAGE_TYPES.error: 15,
+    MESSAGE_TYPES.unblock: 16,
+    MESSAGE_TYPES.unblock_response: 17,
+    MESSAGE_TYPES.hello: 18,
+    MESSAGE_TYPES.hello_response: 19,
+    MESSAGE_TYPES.ack: 20,
+    MESSAGE_TYPES.resend: 21,
+    MESSAGE_TYPES.resend_gap: 22,
+    MESSAGE_TYPES.history: 23,
+    MESSAGE_TYPES.history_response: 24,
+    MESSAGE_TYPES.ping: 25,
+    MESSAGE_TYPES.pong: 26,
+    MESSAGE_TYPES.resume: 27,
+    MESSAGE_TYPES.resume_response: 28,
+}
+
+# Field order of each message type for the binary codec.
+# New fields must be appended so older peers can skip them.
+_message_fields: Dict[str, tuple] = {
+    MESSAGE_TYPES.chat: tuple(FIELDS_CHAT_MESSAGES),
+    MESSAGE_TYPES.blacklist: tuple(FIELDS_BLACKLIST_MESSAGE),
+    MESSAGE_TYPES.blacklist_response: tuple(FIELDS_BLACKLIST_RESPONSE_MESSAGE),
+    MESSAGE_TYPES.create_room: tuple(FIELDS_CREATE_ROOM_MESSAGE),
+    MESSAGE_TYPES.create_room_response: tuple(FIELDS_CREATE_ROOM_RESPONSE_MESSAGE),
+    MESSAGE_TYPES.join_room: tuple(FIELDS_JOIN_ROOM_MESSAGE),
+    MESSAGE_TYPES.join_room_response: tuple(FIELDS_JOIN_ROOM_RESPONSE_MESSAGE),
+    MESSAGE_TYPES.list_rooms: tuple(FIELDS_LIST_ROOMS_MESSAGE),
+    MESSAGE_TYPES.list_users: tuple(FIELDS_LIST_USERS_MESSAGE),
+    MESSAGE_TYPES.login: tuple(FIELDS_LOGIN_MESSAGE),
+    MESSAGE_TYPES.login_response: tuple(FIELDS_LOGIN_RESPONSE_MESSAGE),
+    MESSAGE_TYPES.logout: tuple(FIELDS_LOGOUT_MESSAGE),
+    MESSAGE_TYPES.register: tuple(FIELDS_REGISTER_MESSAGE),
+    MESSAGE_TYPES.register_response: tuple(FIELDS_REGISTER_RESPONSE_MESSAGE),
+    MESSAGE_TYPES.error: tuple(FIELDS_ERROR_MESSAGE),
+    MESSAGE_TYPES.unblock: tuple(FIELDS_UNBLOCK_MESSAGE),
+    MESSAGE_TYPES.unblock_response: tuple(FIELDS_UNBLOCK_RESPONSE_MESSAGE),
+    MESSAGE_TYPES.hello: tuple(FIELDS_HELLO_MESSAGE),
+    MESSAGE_TYPES.hello_response: tuple(FIELDS_HELLO_RESPONSE_MESSAGE),
+    MESSAGE_TYPES.ack: tuple(FIELDS_ACK_MESSAGE),
+    MESSAGE_TYPES.resend: tuple(FIELDS_RESEND_MESSAGE),
+    MESSAGE_TYPES.resend_gap: tuple(FIELDS_RESEND_GAP_MESSAGE),
+    MESSAGE_TYPES.history: tuple(FIELDS_HISTORY_MESSAGE),
+    MESSAGE_TYPES.history_response: tuple(FIELDS_HISTORY_RESPONSE_MESSAGE),
+    MESSAGE_TYPES.ping: tuple(FIELDS_PING_MESSAGE),
+    MESSAGE_TYPES.pong: tuple(FIELDS_PONG_MESSAGE),
+    MESSAGE_TYPES.resume: tuple(FIELDS_RESUME_MESSAGE),
+    MESSAGE_TYPES.resume_response: tuple(FIELDS_RESUME_RESPONSE_MESSAGE),
+}
+# Every schema ends with the optional REQUEST_ID
+MESSAGE_SCHEMAS: Dict[str, tuple] = {
+    message_type: fields + (REQUEST_ID,)
+    for message_type, fields in _message_fields.items()
+}
+
+_binary_codec = BinaryCodec(
+    MESSAGE_TYPE, MESSAGE_TAGS, MESSAGE_SCHEMAS, tuple(FIELDS_CHAT_MESSAGE)
+)
+
+# Encoders and decoders generated once per message type. serialize_*
+# functions pass field values in MESSAGE_SCHEMAS order.
+MESSAGE_REGISTRY = SchemaRegistry(
+    MESSAGE_TYPE,
+    MESSAGE_TAGS,
+    MESSAGE_SCHEMAS,
+    _binary_codec,
+    optional=frozenset(
+        [
+            REQUEST_ID,
+            FIELDS_JOIN_ROOM_MESSAGE.lastid,
+            FIELDS_JOIN_ROOM_RESPONSE_MESSAGE.resync,
+            FIELDS_LOGIN_RESPONSE_MESSAGE.token,
+            FIELDS_RESUME_MESSAGE.lastid,
+            FIELDS_HELLO_MESSAGE.max_frame_size,
+            FIELDS_LIST_ROOMS_MESSAGE.rooms,
+            FIELDS_LIST_USERS_MESSAGE.prefix,
+            FIELDS_LIST_USERS_MESSAGE.cursor,
+            FIELDS_LIST_USERS_MESSAGE.limit,
+            FIELDS_LIST_USERS_MESSAGE.version,
+            FIELDS_LIST_USERS_MESSAGE.more,
+        ]
+    ),
+)
+_schema = MESSAGE_REGISTRY.get
+
+
+def encode_message(payload: Dict[str, Any], codec: str = CODECS.json) -> str | bytes:
+    """Encodes a message payload with the given codec
+
+    Args:
+        payload (Dict[str, Any]): Message to encode, must contain MESSAGE_TYPE
+        codec (str, optional): One of CODECS. Defaults to CODECS.json.
+
+    Returns:
+        str | bytes: JSON text, or bytes for the binary codec
+    """
+    if codec == CODECS.binary:
+        return _binary_codec.encode(payload)
     return json.dumps(payload)
 
 
+def decode_message(data: str | bytes) -> Dict[str, Any]:
+    """Decodes a message encoded by any codec
+
+    JSON messages always start with "{", binary messages start with their
+    type tag, so the codec does not need to be known in advance.
+    """
+    if isinstance(data, str):
+        return json.loads(data)
+    if len(data) > 0 and data[0] == ord("{"):
+        return json.loads(data)
+    return MESSAGE_REGISTRY.decode_binary(data)
+
+
+def transcode_message(data: str | bytes, codec: str) -> str | bytes:
+    """Re-encodes an already encoded message with another codec"""
+    is_binary = not isinstance(data, str) and (len(data) == 0 or data[0] != ord("{"))
+    if is_binary == (codec == CODECS.binary):
+        return data
+    return encode_message(decode_message(data), codec)
+
+
+def serialize_ack_message(
+    sequence: int, codec: str = CODECS.json, requestid: str | None = None
+) -> str | bytes:
+    return _schema(MESSAGE_TYPES.ack).encode(codec, sequence, requestid)
+
+
+def serialize_blacklist_message(
+    userid: str,
+    blocked_username: str,
+    codec: str = CODECS.json,
+    requestid: str | None = None,
+) -> str | bytes:
+    return _schema(MESSAGE_TYPES.blacklist).encode(
+        codec, userid, blocked_username, requestid
+    )
+
+
 def serialize_blacklist_response_message(
-    userid: str, blocked_username: str
-) -> str | None:
-    payload = {
-        MESSAGE_TYPE: MESSAGE_TYPES.blacklist_response,
-        FIELDS_BLACKLIST_RESPONSE_MESSAGE.userid: userid,
-        FIELDS_BLACKLIST_RESPONSE_MESSAGE.blocked_username: blocked_username,
-    }
-    return json.dumps(payload)
+    userid: str,
+    blocked_username: str,
+    codec: str = CODECS.json,
+    requestid: str | None = None,
+) -> str | bytes:
+    return _schema(MESSAGE_TYPES.blacklist_response).encode(
+        codec, userid, blocked_username, requestid
+    )
 
 
 def serialize_chat(
@@ -176,159 +470,284 @@ def serialize_chat(
     return payload
 
 
-def serialize_chat_messages(messages: List[Dict[str, str]] | None) -> str:
-    payload = {
-        MESSAGE_TYPE: MESSAGE_TYPES.chat,
-        FIELDS_CHAT_MESSAGES.messages: messages,
-    }
+def serialize_chat_messages(
+    messages: List[Dict[str, str]] | None,
+    codec: str = CODECS.json,
+    requestid: str | None = None,
+) -> str | bytes:
+    return _schema(MESSAGE_TYPES.chat).encode(codec, messages, requestid)
 
-    return json.dumps(payload)
-
-
-def serialize_create_room_message(name: str) -> str:
-    payload = {
-        MESSAGE_TYPE: MESSAGE_TYPES.create_room,
-        FIELDS_CREATE_ROOM_MESSAGE.name: name,
-    }
 
-    return json.dumps(payload)
+def serialize_create_room_message(
+    name: str, codec: str = CODECS.json, requestid: str | None = None
+) -> str | bytes:
+    return _schema(MESSAGE_TYPES.create_room).encode(codec, name, requestid)
 
 
-def serialzie_create_room_response_message(name: str) -> str:
+def serialzie_create_room_response_message(
+    name: str, codec: str = CODECS.json, requestid: str | None = None
+) -> str | bytes:
+    return _schema(MESSAGE_TYPES.create_room_response).encode(codec, name, requestid)
 
-    payload = {
-        MESSAGE_TYPE: MESSAGE_TYPES.create_room_response,
-        FIELDS_CREATE_ROOM_RESPONSE_MESSAGE.name: name,
-    }
 
-    return json.dumps(payload)
-
-
-def serialize_error_message(errortype: str, message: str) -> str:
-    payload = {
-        MESSAGE_TYPE: MESSAGE_TYPES.error,
-        FIELDS_ERROR_MESSAGE.errortype: errortype,
-        FIELDS_ERROR_MESSAGE.message: message,
-    }
-
-    return json.dumps(payload)
+def serialize_error_message(
+    errortype: str, message: str, codec: str = CODECS.json, requestid: str | None = None
+) -> str | bytes:
+    # Errors are almost always one of the constant ERRORS, so the encoded
+    # payloads are cached unless they answer a specific request
+    if requestid is None:
+        return _schema(MESSAGE_TYPES.error).encode_cached(codec, errortype, message)
+    return _schema(MESSAGE_TYPES.error).encode(codec, errortype, message, requestid)
 
 
-def serialize_join_room_message(userid: str, roomname: str = "Lobby") -> str:
-    payload = {
-        MESSAGE_TYPE: MESSAGE_TYPES.join_room,
-        FIELDS_JOIN_ROOM_MESSAGE.userid: userid,
-        FIELDS_JOIN_ROOM_MESSAGE.roomname: roomname,
-    }
-
-    return json.dumps(payload)
-
-
-def serialize_join_room_response_message(
-    userid: str, roomid: str, roomname: str = "Lobby"
+def serialize_hello_message(
+    codecs: List[str],
+    compressions: List[str] = [COMPRESSIONS.none],
+    sequenced: bool = False,
+    requestid: str | None = None,
+    version: int = PROTOCOL_VERSION,
+    max_frame_size: int | None = None,
+    batching: bool = True,
 ) -> str:
-    payload = {
-        MESSAGE_TYPE: MESSAGE_TYPES.join_room_response,
-        FIELDS_JOIN_ROOM_RESPONSE_MESSAGE.userid: userid,
-        FIELDS_JOIN_ROOM_RESPONSE_MESSAGE.roomname: roomname,
-        FIELDS_JOIN_ROOM_RESPONSE_MESSAGE.roomid: roomid,
-    }
-
-    return json.dumps(payload)
-
-
-def serialize_list_rooms_message(room_names: List[str] | None = []) -> str:
-
-    payload = {
-        MESSAGE_TYPE: MESSAGE_TYPES.list_rooms,
-        FIELDS_LIST_ROOMS_MESSAGE.rooms: room_names,
-    }
-
-    return json.dumps(payload)
-
-
-def serialize_list_users_message(
-    roomid: str, roomname: str, users: List[str] = []
+    # Sent before a codec is agreed on, so always JSON
+    return _schema(MESSAGE_TYPES.hello).encode_json(
+        codecs, compressions, sequenced, version, max_frame_size, batching, requestid
+    )
+
+
+def serialize_hello_response_message(
+    codec: str,
+    compression: str = COMPRESSIONS.none,
+    sequenced: bool = False,
+    requestid: str | None = None,
+    version: int = PROTOCOL_VERSION,
+    max_frame_size: int | None = None,
+    batching: bool = True,
 ) -> str:
-    payload = {
-        MESSAGE_TYPE: MESSAGE_TYPES.list_users,
-        FIELDS_LIST_USERS_MESSAGE.roomid: roomid,
-        FIELDS_LIST_USERS_MESSAGE.roomname: roomname,
-        FIELDS_LIST_USERS_MESSAGE.users: users,
-    }
+    return _schema(MESSAGE_TYPES.hello_response).encode_json(
+        codec, compression, sequenced, version, max_frame_size, batching, requestid
+    )
+
+
+def serialize_history_message(
+    roomid: str,
+    before: str = "",
+    limit: int = 30,
+    codec: str = CODECS.json,
+    requestid: str | None = None,
+) -> str | bytes:
+    return _schema(MESSAGE_TYPES.history).encode(
+        codec, roomid, before, limit, requestid
+    )
+
+
+def serialize_history_response_message(
+    roomid: str,
+    messages: List[Dict[str, str]],
+    cursor: str,
+    more: bool,
+    codec: str = CODECS.json,
+    requestid: str | None = None,
+) -> str | bytes:
+    return _schema(MESSAGE_TYPES.history_response).encode(
+        codec, roomid, messages, cursor, more, requestid
+    )
+
+
+def serialize_join_room_message(
+    userid: str,
+    roomname: str = "Lobby",
+    codec: str = CODECS.json,
+    requestid: str | None = None,
+    lastid: str | None = None,
+) -> str | bytes:
+    # The server looks rooms up by name, roomid is left empty
+    return _schema(MESSAGE_TYPES.join_room).encode(
+        codec, userid, roomname, "", lastid, requestid
+    )
 
-    return json.dumps(payload)
 
+def serialize_join_room_response_message(
+    userid: str,
+    roomid: str,
+    roomname: str = "Lobby",
+    codec: str = CODECS.json,
+    requestid: str | None = None,
+    resync: str | None = None,
+) -> str | bytes:
+    return _schema(MESSAGE_TYPES.join_room_response).encode(
+        codec, userid, roomname, roomid, resync, requestid
+    )
+
+
+def serialize_list_rooms_message(
+    room_names: List[str] | None = [],
+    codec: str = CODECS.json,
+    requestid: str | None = None,
+    prefix: str | None = None,
+    cursor: str | None = None,
+    limit: int | None = None,
+    version: int | None = None,
+    more: bool | None = None,
+) -> str | bytes:
+    return _schema(MESSAGE_TYPES.list_rooms).encode(
+        codec, room_names, prefix, cursor, limit, version, more, requestid
+    )
 
-def serialize_login_message(username: str, password: str) -> str:
-    payload = {
-        MESSAGE_TYPE: MESSAGE_TYPES.login,
-        FIELDS_LOGIN_MESSAGE.username: username,
-        FIELDS_LOGIN_MESSAGE.password: password,
-    }
 
-    return json.dumps(payload)
+def serialize_list_users_message(
+    roomid: str,
+    roomname: str,
+    users: List[str] = [],
+    codec: str = CODECS.json,
+    requestid: str | None = None,
+    prefix: str | None = None,
+    cursor: str | None = None,
+    limit: int | None = None,
+    version: int | None = None,
+    more: bool | None = None,
+) -> str | bytes:
+    return _schema(MESSAGE_TYPES.list_users).encode(
+        codec, roomname, roomid, users, prefix, cursor, limit, version, more, requestid
+    )
+
+
+def with_request_id(
+    message_type: str, payload: str | bytes, requestid: str | None
+) -> str | bytes:
+    """Adds a request id to a payload encoded without one, e.g. a cached one"""
+    if requestid is None:
+        return payload
+    return _schema(message_type).with_last(payload, requestid)
+
+
+def encode_list_item(
+    message_type: str, item: Any, codec: str = CODECS.json
+) -> str | bytes:
+    """Encodes one item of a message's list, e.g. one of a chat's messages"""
+    return _schema(message_type).encode_item(codec, item)
+
+
+def join_list_items(
+    message_type: str, items: Iterable[str | bytes], codec: str = CODECS.json
+) -> str | bytes:
+    """Encodes a message from list items encoded with encode_list_item"""
+    return _schema(message_type).join_items(codec, items)
+
+
+def serialize_login_message(
+    username: str, password: str, codec: str = CODECS.json, requestid: str | None = None
+) -> str | bytes:
+    return _schema(MESSAGE_TYPES.login).encode(codec, username, password, requestid)
 
 
 def serialize_login_response_message(
-    userid: str, username: str, roomid: str, roomname: str
-) -> str:
-    payload = {
-        MESSAGE_TYPE: MESSAGE_TYPES.login_response,
-        FIELDS_LOGIN_RESPONSE_MESSAGE.username: username,
-        FIELDS_LOGIN_RESPONSE_MESSAGE.userid: userid,
-        FIELDS_LOGIN_RESPONSE_MESSAGE.roomid: roomid,
-        FIELDS_LOGIN_RESPONSE_MESSAGE.roomname: roomname,
-    }
-
-    return json.dumps(payload)
-
-
-def serialize_logout_message(userid: str, username: str) -> str:
-    payload = {
-        MESSAGE_TYPE: MESSAGE_TYPES.logout,
-        FIELDS_LOGOUT_MESSAGE.username: username,
-        FIELDS_LOGOUT_MESSAGE.userid: userid,
-    }
-
-    return json.dumps(payload)
-
-
-def serialize_register_message(username: str, password: str) -> str:
-    payload = {
-        MESSAGE_TYPE: MESSAGE_TYPES.register,
-        FIELDS_REGISTER_MESSAGE.username: username,
-        FIELDS_REGISTER_MESSAGE.password: password,
-    }
-
-    return json.dumps(payload)
-
-
-def serialize_register_response_message(username: str, status: str) -> str:
-    payload = {
-        MESSAGE_TYPE: MESSAGE_TYPES.register_response,
-        FIELDS_REGISTER_RESPONSE_MESSAGE.username: username,
-        FIELDS_REGISTER_RESPONSE_MESSAGE.status: status,
-    }
-
-    return json.dumps(payload)
-
-
-def serialize_unblock_message(userid: str, blocked_username: str) -> str:
-    payload = {
-        MESSAGE_TYPE: MESSAGE_TYPES.unblock,
-        FIELDS_BLACKLIST_MESSAGE.userid: userid,
-        FIELDS_BLACKLIST_MESSAGE.blocked_username: blocked_username,
-    }
-    return json.dumps(payload)
+    userid: str,
+    username: str,
+    roomid: str,
+    roomname: str,
+    codec: str = CODECS.json,
+    requestid: str | None = None,
+    token: str | None = None,
+) -> str | bytes:
+    return _schema(MESSAGE_TYPES.login_response).encode(
+        codec, username, userid, roomid, roomname, token, requestid
+    )
+
+
+def serialize_logout_message(
+    userid: str, username: str, codec: str = CODECS.json, requestid: str | None = None
+) -> str | bytes:
+    return _schema(MESSAGE_TYPES.logout).encode(codec, username, userid, requestid)
+
+
+def serialize_ping_message(
+    nonce: int, codec: str = CODECS.json, requestid: str | None = None
+) -> str | bytes:
+    return _schema(MESSAGE_TYPES.ping).encode(codec, nonce, requestid)
+
+
+def serialize_pong_message(
+    nonce: int, codec: str = CODECS.json, requestid: str | None = None
+) -> str | bytes:
+    return _schema(MESSAGE_TYPES.pong).encode(codec, nonce, requestid)
+
+
+def serialize_register_message(
+    username: str, password: str, codec: str = CODECS.json, requestid: str | None = None
+) -> str | bytes:
+    return _schema(MESSAGE_TYPES.register).encode(codec, username, password, requestid)
+
+
+def serialize_register_response_message(
+    username: str, status: str, codec: str = CODECS.json, requestid: str | None = None
+) -> str | bytes:
+    return _schema(MESSAGE_TYPES.register_response).encode(
+        codec, username, status, requestid
+    )
+
+
+def serialize_resend_message(
+    first_sequence: int,
+    last_sequence: int,
+    codec: str = CODECS.json,
+    requestid: str | None = None,
+) -> str | bytes:
+    return _schema(MESSAGE_TYPES.resend).encode(
+        codec, first_sequence, last_sequence, requestid
+    )
+
+
+def serialize_resend_gap_message(
+    first_sequence: int,
+    last_sequence: int,
+    codec: str = CODECS.json,
+    requestid: str | None = None,
+) -> str | bytes:
+    return _schema(MESSAGE_TYPES.resend_gap).encode(
+        codec, first_sequence, last_sequence, requestid
+    )
+
+
+def serialize_resume_message(
+    token: str,
+    roomid: str = "",
+    lastid: str | None = None,
+    codec: str = CODECS.json,
+    requestid: str | None = None,
+) -> str | bytes:
+    return _schema(MESSAGE_TYPES.resume).encode(codec, token, roomid, lastid, requestid)
+
+
+def serialize_resume_response_message(
+    userid: str,
+    username: str,
+    token: str,
+    codec: str = CODECS.json,
+    requestid: str | None = None,
+) -> str | bytes:
+    return _schema(MESSAGE_TYPES.resume_response).encode(
+        codec, username, userid, token, requestid
+    )
+
+
+def serialize_unblock_message(
+    userid: str,
+    blocked_username: str,
+    codec: str = CODECS.json,
+    requestid: str | None = None,
+) -> str | bytes:
+    return _schema(MESSAGE_TYPES.unblock).encode(
+        codec, userid, blocked_username, requestid
+    )
 
 
 def serialize_unblock_response_message(
-    userid: str, blocked_username: str
-) -> str | None:
-    payload = {
-        MESSAGE_TYPE: MESSAGE_TYPES.unblock_response,
-        FIELDS_BLACKLIST_RESPONSE_MESSAGE.userid: userid,
-        FIELDS_BLACKLIST_RESPONSE_MESSAGE.blocked_username: blocked_username,
-    }
-    return json.dumps(payload)
+    userid: str,
+    blocked_username: str,
+    codec: str = CODECS.json,
+    requestid: str | None = None,
+) -> str | bytes:
+    return _schema(MESSAGE_TYPES.unblock_response).encode(
+        codec, userid, blocked_username, requestid
+    )
@@ -0,0 +1,257 @@
+from functools import lru_cache
+from json import dumps as _dumps
+from json.encoder import encode_basestring_ascii as _encode_str
+from typing import Any, Callable, Dict, FrozenSet, Iterable, Tuple
+
+from .binary_codec import (
+    _ABSENT,
+    VALUE_ABSENT,
+    BinaryCodec,
+    BinaryCodecError,
+    _read_varint,
+    _write_varint,
+)
+
+# Constant payloads kept per message type, e.g. the ERRORS responses
+CACHE_SIZE = 256
+
+
+class MessageSchema:
+    """Encoders and decoders generated for a single message type
+
+    The generated functions take field values positionally, in schema
+    order, so no intermediate dict is built and field names are baked
+    into the generated code instead of being looked up per message.
+    """
+
+    def __init__(
+        self,
+        type_field: str,
+        message_type: str,
+        tag: int,
+        fields: Tuple[str, ...],
+        codec: BinaryCodec,
+        optional: FrozenSet[str] = frozenset(),
+    ) -> None:
+        self.message_type = message_type
+        self.tag = tag
+        self.fields = fields
+        self._codec = codec
+        self._last_key = ", " + _dumps(fields[-1]) + ": " if len(fields) > 0 else ""
+        self._parts: Dict[str, Tuple[str | bytes, str | bytes]] = {}
+
+        self.encode_json: Callable[..., str] = _build_json_encoder(
+            type_field, message_type, fields, optional
+        )
+        self.encode_binary: Callable[..., bytes] = _build_binary_encoder(
+            tag, fields, codec, optional
+        )
+        self.decode_binary: Callable[[bytes, int], Dict[str, Any]] = (
+            _build_binary_decoder(type_field, message_type, fields, codec)
+        )
+        self.encode_cached = lru_cache(maxsize=CACHE_SIZE)(self.encode)
+
+    def encode(self, codec: str, *values: Any) -> str | bytes:
+        # codec is one of CODECS, anything but binary is JSON
+        if codec == "binary":
+            return self.encode_binary(*values)
+        return self.encode_json(*values)
+
+    def with_last(self, payload: str | bytes, value: Any) -> str | bytes:
+        """Fills in the last field of a payload encoded without it
+
+        The last field must be optional, e.g. the request id, so a cached
+        payload can be answered to every request without encoding it again.
+        """
+        if isinstance(payload, str):
+            value = _encode_str(value) if value.__class__ is str else _dumps(value)
+            return payload[:-1] + self._last_key + value + "}"
+        # The absent marker is the last byte, replace it with the value
+        out = bytearray(payload[:-1])
+        self._codec._write_value(out, value)
+        return bytes(out)
+
+    def encode_item(self, codec: str, item: Any) -> str | bytes:
+        """Encodes one item of the list in the first field, see join_items"""
+        if codec == "binary":
+            out = bytearray()
+            self._codec._write_value(out, item)
+            return bytes(out)
+        return _encode_str(item) if item.__class__ is str else _dumps(item)
+
+    def join_items(self, codec: str, items: Iterable[str | bytes]) -> str | bytes:
+        """Encodes a message from items encoded with encode_item
+
+        The items are the list in the first field, the fields after it
+        are left out, so they must be optional. Items are encoded once
+        and joined into any number of messages.
+        """
+        head, tail = self._list_parts(codec)
+        if codec == "binary":
+            items = list(items)
+            out = bytearray(head)
+            _write_varint(out, len(items))
+            out += b"".join(items)
+            out += tail
+            return bytes(out)
+        return head + ", ".join(items) + tail
+
+    def _list_parts(self, codec: str) -> Tuple[str | bytes, str | bytes]:
+        parts = self._parts.get(codec, None)
+        if parts is None:
+            # The message with an empty list, split where the items go
+            empty = self.encode(codec, [])
+            if codec == "binary":
+                # After the list marker, a zero count then a byte per field
+                start = len(empty) - len(self.fields)
+                parts = (empty[:start], empty[start + 1 :])
+            else:
+                start = empty.index("[]") + 1
+                parts = (empty[:start], empty[start:])
+            self._parts[codec] = parts
+        return parts
+
+
+class SchemaRegistry:
+    """Message schemas by message type and by integer tag
+
+    Fields listed in optional are left out of the encoded message when
+    their value is None. Optional fields at the end of a schema may be
+    omitted when calling the generated encoders.
+    """
+
+    def __init__(
+        self,
+        type_field: str,
+        tags: Dict[str, int],
+        schemas: Dict[str, Tuple[str, ...]],
+        codec: BinaryCodec,
+        optional: FrozenSet[str] = frozenset(),
+    ) -> None:
+        self.type_field = type_field
+        self._codec = codec
+        self._by_type: Dict[str, MessageSchema] = {}
+        self._by_tag: Dict[int, MessageSchema] = {}
+        for message_type, fields in schemas.items():
+            schema = MessageSchema(
+                type_field, message_type, tags[message_type], fields, codec, optional
+            )
+            self._by_type[message_type] = schema
+            self._by_tag[schema.tag] = schema
+
+    def get(self, message_type: str) -> MessageSchema:
+        return self._by_type[message_type]
+
+    def decode_binary(self, data: bytes) -> Dict[str, Any]:
+        tag, offset = _read_varint(data, 0)
+        schema = self._by_tag.get(tag, None)
+        if schema is None:
+            raise BinaryCodecError(f"Unknown message tag: {tag}")
+        return schema.decode_binary(data, offset)
+
+
+def _compile(source: str, name: str, namespace: Dict[str, Any]) -> Callable:
+    exec(source, namespace)
+    return namespace[name]
+
+
+def _signature(fields: Tuple[str, ...], optional: FrozenSet[str]) -> str:
+    # Trailing optional fields default to None
+    required = len(fields)
+    while required > 0 and fields[required - 1] in optional:
+        required -= 1
+    args = [f"_{i}" if i < required else f"_{i}=None" for i in range(len(fields))]
+    return ", ".join(args)
+
+
+def _build_json_encoder(
+    type_field: str,
+    message_type: str,
+    fields: Tuple[str, ...],
+    optional: FrozenSet[str],
+) -> Callable[..., str]:
+    # Produces the same text as json.dumps on the equivalent dict
+    parts = [repr("{" + _dumps(type_field) + ": " + _dumps(message_type))]
+    for i, field in enumerate(fields):
+        arg = f"_{i}"
+        value = f"(_s({arg}) if {arg}.__class__ is str else _d({arg}))"
+        key = repr(", " + _dumps(field) + ": ")
+        if field in optional:
+            parts.append(f"(({key} + {value}) if {arg} is not None else '')")
+        else:
+            parts.append(key)
+            parts.append(value)
+    parts.append(repr("}"))
+
+    lines = [
+        f"def encode({_signature(fields, optional)}):",
+        f"    return ''.join(({', '.join(parts)}))",
+    ]
+    namespace = {"_s": _encode_str, "_d": _dumps}
+    return _compile("\n".join(lines) + "\n", "encode", namespace)
+
+
+def _build_binary_encoder(
+    tag: int,
+    fields: Tuple[str, ...],
+    codec: BinaryCodec,
+    optional: FrozenSet[str],
+) -> Callable[..., bytes]:
+    prefix = bytearray()
+    _write_varint(prefix, tag)
+    _write_varint(prefix, len(fields))
+
+    lines = [
+        f"def encode({_signature(fields, optional)}):",
+        "    out = bytearray(_prefix)",
+    ]
+    for i, field in enumerate(fields):
+        if field in optional:
+            lines.append(f"    if _{i} is None:")
+            lines.append(f"        out.append({VALUE_ABSENT})")
+            lines.append("    else:")
+            lines.append(f"        _w(out, _{i})")
+        else:
+            lines.append(f"    _w(out, _{i})")
+    lines.append("    return bytes(out)")
+
+    namespace = {"_prefix": bytes(prefix), "_w": codec._write_value}
+    return _compile("\n".join(lines) + "\n", "encode", namespace)
+
+
+def _build_binary_decoder(
+    type_field: str,
+    message_type: str,
+    fields: Tuple[str, ...],
+    codec: BinaryCodec,
+) -> Callable[[bytes, int], Dict[str, Any]]:
+    lines = [
+        "def decode(data, offset):",
+        "    count, offset = _rv(data, offset)",
+        f"    payload = {{{type_field!r}: {message_type!r}}}",
+        f"    if count < {len(fields)}:",
+        "        return _slow(payload, data, offset, count)",
+    ]
+    for field in fields:
+        lines.append("    value, offset = _r(data, offset)")
+        lines.append("    if value is not _A:")
+        lines.append(f"        payload[{field!r}] = value")
+    # Fields added by newer peers are skipped
+    lines.append(f"    for _ in range(count - {len(fields)}):")
+    lines.append("        _, offset = _r(data, offset)")
+    lines.append("    return payload")
+
+    def _slow(payload, data, offset, count):
+        for i in range(count):
+            value, offset = codec._read_value(data, offset)
+            if value is not _ABSENT:
+                payload[fields[i]] = value
+        return payload
+
+    namespace = {
+        "_rv": _read_varint,
+        "_r": codec._read_value,
+        "_A": _ABSENT,
+        "_slow": _slow,
+    }
+    return _compile("\n".join(lines) + "\n", "decode", namespace)
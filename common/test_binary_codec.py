@@ -0,0 +1,44 @@
+import json
+
+from .message_factory import (
+    CODECS,
+    decode_message,
+    serialize_chat,
+    serialize_chat_messages,
+    serialize_list_users_message,
+    serialize_login_response_message,
+    transcode_message,
+)
+
+ROOMID = "11111111-2222-3333-4444-555555555555"
+USERID = "3f2b8a4e-1c2d-4e5f-9a8b-7c6d5e4f3a2b"
+
+
+def test_binary_round_trip():
+    chat = serialize_chat("Hello ünïcode", USERID, "User1", roomid=ROOMID)
+    encoded = serialize_chat_messages([chat, chat], codec=CODECS.binary)
+    assert isinstance(encoded, bytes)
+    assert decode_message(encoded) == json.loads(serialize_chat_messages([chat, chat]))
+
+
+def test_binary_is_smaller():
+    chat = serialize_chat("Hello", USERID, "User1", roomid=ROOMID)
+    binary = serialize_chat_messages([chat], codec=CODECS.binary)
+    text = serialize_chat_messages([chat])
+    assert len(binary) * 3 < len(text.encode("utf8"))
+
+
+def test_non_canonical_uuid_is_preserved():
+    upper = ROOMID.upper()
+    encoded = serialize_login_response_message(
+        USERID, "User1", upper, "Lobby", codec=CODECS.binary
+    )
+    assert decode_message(encoded)["roomid"] == upper
+
+
+def test_transcode():
+    text = serialize_list_users_message(ROOMID, "Lobby", ["a", "b"])
+    binary = transcode_message(text, CODECS.binary)
+    assert isinstance(binary, bytes)
+    assert transcode_message(binary, CODECS.binary) is binary
+    assert decode_message(transcode_message(binary, CODECS.json)) == json.loads(text)
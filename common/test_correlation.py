@@ -0,0 +1,57 @@
+import asyncio
+
+from .correlation import PendingRequests, RequestTimeoutError
+from .message_factory import REQUEST_ID, decode_message, serialize_list_rooms_message
+
+import pytest
+
+
+def test_responses_in_any_order():
+    async def _test():
+        pending = PendingRequests()
+        first = pending.add(pending.next_id())
+        second = pending.add(pending.next_id())
+        assert len(pending) == 2
+
+        assert pending.resolve(
+            decode_message(serialize_list_rooms_message([], requestid="2"))
+        )
+        assert second.result()[REQUEST_ID] == "2"
+        assert not first.done()
+
+        assert pending.resolve({REQUEST_ID: "1"})
+        assert first.result() == {REQUEST_ID: "1"}
+        assert len(pending) == 0
+
+        # Unsolicited and unknown responses are left to the caller
+        assert not pending.resolve({})
+        assert not pending.resolve({REQUEST_ID: "1"})
+
+    asyncio.run(_test())
+
+
+def test_timeout():
+    async def _test():
+        pending = PendingRequests(timeout=0.01)
+        future = pending.add("1")
+        with pytest.raises(RequestTimeoutError):
+            await future
+        assert "1" not in pending
+
+    asyncio.run(_test())
+
+
+def test_cancel():
+    async def _test():
+        pending = PendingRequests()
+        future = pending.add("1")
+        assert pending.cancel("1")
+        assert future.cancelled()
+        assert not pending.cancel("1")
+
+        futures = [pending.add(pending.next_id()) for _ in range(3)]
+        pending.cancel_all()
+        assert all(f.cancelled() for f in futures)
+        assert len(pending) == 0
+
+    asyncio.run(_test())
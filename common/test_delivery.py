@@ -0,0 +1,41 @@
+from .delivery import ReceiveWindow
+
+
+def test_in_order():
+    window = ReceiveWindow()
+    assert window.receive(1, b"1") == [b"1"]
+    assert window.receive(2, b"2") == [b"2"]
+    assert window.missing() is None
+    assert window.acknowledge() == 2
+    assert window.acknowledge() is None
+
+
+def test_gap_is_filled_by_resend():
+    window = ReceiveWindow()
+    assert window.receive(1, b"1") == [b"1"]
+    assert window.receive(3, b"3") == []
+    assert window.receive(4, b"4") == []
+    assert window.missing() == (2, 2)
+    # Only requested once
+    assert window.missing() is None
+
+    assert window.receive(2, b"2") == [b"2", b"3", b"4"]
+    assert window.receive(3, b"3") == []
+    assert window.acknowledge() == 4
+
+
+def test_skip_lost_frames():
+    window = ReceiveWindow()
+    window.receive(1, b"1")
+    window.receive(5, b"5")
+    assert window.missing() == (2, 4)
+    assert window.skip(2, 4) == [b"5"]
+    assert window.expected == 6
+    assert window.pending == 0
+
+
+def test_pending_is_bounded():
+    window = ReceiveWindow(max_pending=2)
+    window.receive(3, b"3")
+    window.receive(4, b"4")
+    assert window.receive(5, b"5") == [b"3", b"4", b"5"]
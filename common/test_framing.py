@@ -0,0 +1,110 @@
+import hashlib
+import json
+
+from .compression import COMPRESSION_DICTIONARY
+from .framing import (
+    FLAG_COMPRESSED,
+    FRAME_HEADER,
+    FRAME_HEADER_SIZE,
+    FrameDecoder,
+    FrameError,
+    encode_frame,
+    encode_frame_buffers,
+    sequence_frame_header,
+)
+from .message_factory import COMPRESSIONS, serialize_chat, serialize_chat_messages
+
+import pytest
+
+
+@pytest.fixture
+def decoder() -> FrameDecoder:
+    return FrameDecoder(max_frame_size=1024)
+
+
+def test_single_frame(decoder: FrameDecoder):
+    result = decoder.feed(encode_frame(b'{"a": 1}'))
+    assert result == [b'{"a": 1}']
+    assert decoder.buffered == 0
+
+
+def test_two_frames_in_one_read(decoder: FrameDecoder):
+    data = encode_frame(b"one") + encode_frame(b"two")
+    result = decoder.feed(data)
+    assert result == [b"one", b"two"]
+
+
+def test_frame_split_across_reads(decoder: FrameDecoder):
+    data = encode_frame(b"a longer payload")
+    assert decoder.feed(data[:3]) == []
+    assert decoder.feed(data[3 : FRAME_HEADER_SIZE + 4]) == []
+    assert decoder.feed(data[FRAME_HEADER_SIZE + 4 :]) == [b"a longer payload"]
+    assert decoder.buffered == 0
+
+
+def test_partial_frame_is_kept(decoder: FrameDecoder):
+    second = encode_frame(b"second")
+    result = decoder.feed(encode_frame(b"first") + second[:4])
+    assert result == [b"first"]
+    assert decoder.buffered == 4
+    assert decoder.feed(second[4:]) == [b"second"]
+
+
+def test_empty_payload(decoder: FrameDecoder):
+    assert decoder.feed(encode_frame(b"")) == [b""]
+
+
+def test_oversized_frame(decoder: FrameDecoder):
+    with pytest.raises(FrameError):
+        decoder.feed(encode_frame(b"x" * 2048))
+
+
+def test_compressed_frame():
+    history = [
+        serialize_chat(f"Message {i}", "1", "User1", roomid="2") for i in range(30)
+    ]
+    payload = serialize_chat_messages(history).encode("utf8")
+    header, compressed = encode_frame_buffers(payload, COMPRESSIONS.deflate)
+    flags, length = FRAME_HEADER.unpack(header)
+
+    assert flags & FLAG_COMPRESSED
+    assert length == len(compressed)
+    assert len(compressed) * 5 < len(payload)
+    assert FrameDecoder().feed(header + compressed) == [payload]
+
+
+def test_compression_dictionary_is_frozen():
+    # Changing it silently corrupts frames deflated by older peers
+    digest = hashlib.sha256(COMPRESSION_DICTIONARY).hexdigest()
+    assert digest == "7057ff9633c29b3d07e94bc3cb75ff090da6c57adcbf12e11ae45f2ad7e9a85a"
+
+
+def test_small_frame_is_not_compressed():
+    payload = json.dumps({"message_type": "list_rooms"}).encode("utf8")
+    header, body = encode_frame_buffers(payload, COMPRESSIONS.deflate)
+    assert FRAME_HEADER.unpack(header)[0] == 0
+    assert body == payload
+
+
+def test_compressed_frame_larger_than_limit():
+    header, body = encode_frame_buffers(b"a" * 4096, COMPRESSIONS.deflate)
+    with pytest.raises(FrameError):
+        FrameDecoder(max_frame_size=1024).feed(header + body)
+
+
+def test_sequenced_frames(decoder: FrameDecoder):
+    header, payload = encode_frame_buffers(b"second")
+    data = encode_frame(b"first") + sequence_frame_header(header, 7) + payload
+    # Split inside the sequence number
+    assert decoder.feed_sequenced(data[: len(data) - len(payload) - 2]) == [
+        (None, b"first")
+    ]
+    assert decoder.feed_sequenced(data[len(data) - len(payload) - 2 :]) == [
+        (7, b"second")
+    ]
+
+
+def test_sequenced_compressed_frame():
+    header, body = encode_frame_buffers(b"a" * 4096, COMPRESSIONS.deflate)
+    frames = FrameDecoder().feed_sequenced(sequence_frame_header(header, 1) + body)
+    assert frames == [(1, b"a" * 4096)]
@@ -0,0 +1,86 @@
+import json
+
+from .errors import ERRORS, ERROR_TYPES
+from .message_factory import (
+    CODECS,
+    MESSAGE_REGISTRY,
+    MESSAGE_SCHEMAS,
+    MESSAGE_TYPE,
+    MESSAGE_TYPES,
+    REQUEST_ID,
+    _binary_codec,
+    decode_message,
+    encode_message,
+    serialize_error_message,
+)
+
+
+def _sample(message_type):
+    payload = {MESSAGE_TYPE: message_type}
+    for i, field in enumerate(MESSAGE_SCHEMAS[message_type]):
+        payload[field] = [f"v{i}", None, 3] if i % 2 else f'välue "{i}"\n'
+    return payload
+
+
+def test_generated_encoders_match_generic_encoding():
+    for message_type, fields in MESSAGE_SCHEMAS.items():
+        payload = _sample(message_type)
+        values = [payload[field] for field in fields]
+        schema = MESSAGE_REGISTRY.get(message_type)
+
+        assert schema.encode_json(*values) == json.dumps(payload)
+        assert schema.encode_binary(*values) == _binary_codec.encode(payload)
+
+
+def test_generated_decoders_match_generic_decoding():
+    for message_type in MESSAGE_SCHEMAS:
+        encoded = encode_message(_sample(message_type), CODECS.binary)
+        assert decode_message(encoded) == _binary_codec.decode(encoded)
+
+
+def test_decoder_handles_absent_and_unknown_fields():
+    encoded = _binary_codec.encode({MESSAGE_TYPE: MESSAGE_TYPES.error, "message": "m"})
+    assert decode_message(encoded) == {
+        MESSAGE_TYPE: MESSAGE_TYPES.error,
+        "message": "m",
+    }
+
+    # A newer peer appending a field
+    extended = bytes([encoded[0], encoded[1] + 1]) + encoded[2:] + bytes([0])
+    assert decode_message(extended) == decode_message(encoded)
+
+
+def test_error_payloads_are_cached():
+    errortype = ERROR_TYPES.invalid_username_password
+    message = ERRORS.invalid_username_password
+    first = serialize_error_message(errortype, message, CODECS.binary)
+    second = serialize_error_message(errortype, message, CODECS.binary)
+    assert first is second
+
+
+def test_request_id_is_optional():
+    error = MESSAGE_REGISTRY.get(MESSAGE_TYPES.error)
+    assert REQUEST_ID not in json.loads(error.encode_json("t", "m"))
+    assert REQUEST_ID not in decode_message(error.encode_binary("t", "m"))
+
+    assert json.loads(error.encode_json("t", "m", "7"))[REQUEST_ID] == "7"
+    assert decode_message(error.encode_binary("t", "m", "7"))[REQUEST_ID] == "7"
+
+
+def test_request_id_added_to_encoded_payload():
+    for message_type, fields in MESSAGE_SCHEMAS.items():
+        payload = _sample(message_type)
+        values = [payload[field] for field in fields[:-1]]
+        schema = MESSAGE_REGISTRY.get(message_type)
+        for codec in CODECS:
+            expected = schema.encode(codec, *values, 'r"1')
+            assert schema.with_last(schema.encode(codec, *values), 'r"1') == expected
+
+
+def test_list_joined_from_encoded_items():
+    schema = MESSAGE_REGISTRY.get(MESSAGE_TYPES.chat)
+    messages = [{"id": "1", "message": 'hé "1"'}, {"id": "2", "message": "2"}]
+    for codec in CODECS:
+        for items in ([], messages):
+            encoded = [schema.encode_item(codec, m) for m in items]
+            assert schema.join_items(codec, encoded) == schema.encode(codec, items)
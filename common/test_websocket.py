@@ -0,0 +1,76 @@
+from .websocket import (
+    WEBSOCKET_OPCODES,
+    WebSocketDecoder,
+    WebSocketError,
+    accept_key,
+    encode_websocket_frame,
+    handshake_request,
+    handshake_response,
+    parse_handshake,
+)
+
+import pytest
+
+MASK = b"\x01\x02\x03\x04"
+
+
+def test_accept_key():
+    # Example from RFC 6455 section 1.3
+    assert accept_key("dGhlIHNhbXBsZSBub25jZQ==") == "s3pPLMBiTxaQ9kYGzzhZRbK+xOo="
+
+
+def test_handshake():
+    request, expected = handshake_request("localhost", 5002, "/chat")
+    headers = parse_handshake(request)
+    assert headers[""] == "GET /chat HTTP/1.1"
+
+    response = parse_handshake(handshake_response(headers))
+    assert response[""].startswith("HTTP/1.1 101")
+    assert response["sec-websocket-accept"] == expected
+
+    with pytest.raises(WebSocketError):
+        parse_handshake(b"GET / HTTP/1.1\r\nHost: localhost\r\n\r\n")
+    with pytest.raises(WebSocketError):
+        handshake_response(parse_handshake(b"GET / HTTP/1.1\r\nUpgrade: websocket\r\n"))
+
+
+@pytest.mark.parametrize("size", [0, 125, 126, 65535, 65536])
+def test_round_trip(size: int):
+    payload = bytes(i % 256 for i in range(size))
+    data = encode_websocket_frame(WEBSOCKET_OPCODES.binary, payload, MASK)
+
+    decoder = WebSocketDecoder(max_message_size=1 << 20)
+    # Split delivery must give the same result
+    assert decoder.feed(data[:3]) == []
+    assert decoder.feed(data[3:]) == [(WEBSOCKET_OPCODES.binary, payload)]
+
+    server_frame = encode_websocket_frame(WEBSOCKET_OPCODES.binary, payload)
+    decoder = WebSocketDecoder(require_mask=False, max_message_size=1 << 20)
+    assert decoder.feed(server_frame) == [(WEBSOCKET_OPCODES.binary, payload)]
+
+
+def test_fragmented_message_with_control_frame():
+    first = encode_websocket_frame(WEBSOCKET_OPCODES.text, b"hello ", MASK)
+    # Clear the FIN bit of the first fragment
+    first = bytes([first[0] & 0x7F]) + first[1:]
+    ping = encode_websocket_frame(WEBSOCKET_OPCODES.ping, b"1", MASK)
+    last = encode_websocket_frame(WEBSOCKET_OPCODES.continuation, b"world", MASK)
+
+    decoder = WebSocketDecoder()
+    assert decoder.feed(first + ping + last) == [
+        (WEBSOCKET_OPCODES.ping, b"1"),
+        (WEBSOCKET_OPCODES.text, b"hello world"),
+    ]
+
+
+def test_invalid_frames():
+    with pytest.raises(WebSocketError):
+        WebSocketDecoder().feed(encode_websocket_frame(WEBSOCKET_OPCODES.text, b"x"))
+    with pytest.raises(WebSocketError):
+        WebSocketDecoder(max_message_size=4).feed(
+            encode_websocket_frame(WEBSOCKET_OPCODES.text, b"x" * 5, MASK)
+        )
+    with pytest.raises(WebSocketError):
+        WebSocketDecoder().feed(
+            encode_websocket_frame(WEBSOCKET_OPCODES.continuation, b"x", MASK)
+        )
@@ -0,0 +1,262 @@
+"""Minimal RFC 6455 WebSocket support built on the standard library
+
+Only what the chat gateway needs: the opening handshake, framing and
+masking. Extensions such as permessage-deflate are not negotiated.
+"""
+
+import base64
+import hashlib
+import os
+import struct
+from collections import namedtuple
+from typing import Dict, List, Tuple
+
+from .framing import MAX_FRAME_SIZE
+
+WEBSOCKET_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+_opcodes = namedtuple(
+    "WEBSOCKET_OPCODES", ["continuation", "text", "binary", "close", "ping", "pong"]
+)
+WEBSOCKET_OPCODES = _opcodes(
+    continuation=0x0, text=0x1, binary=0x2, close=0x8, ping=0x9, pong=0xA
+)
+
+_FIN = 0x80
+_MASKED = 0x80
+_LENGTH_16 = struct.Struct("!H")
+_LENGTH_64 = struct.Struct("!Q")
+# Longest handshake request accepted before the connection is dropped
+MAX_HANDSHAKE_SIZE = 8 * 1024
+
+
+class WebSocketError(Exception):
+    def __init__(self, *args: object) -> None:
+        super().__init__(*args)
+
+
+def accept_key(key: str) -> str:
+    digest = hashlib.sha1((key + WEBSOCKET_GUID).encode("ascii")).digest()
+    return base64.b64encode(digest).decode("ascii")
+
+
+def parse_handshake(data: bytes) -> Dict[str, str]:
+    """Parses an HTTP upgrade request or response head
+
+    Args:
+        data (bytes): Everything up to and including the blank line
+
+    Raises:
+        WebSocketError: Not a WebSocket upgrade
+
+    Returns:
+        Dict[str, str]: Headers with lower case names. The request or
+            status line is stored under ""
+    """
+    try:
+        lines = data.decode("latin-1").split("\r\n")
+    except UnicodeDecodeError as e:
+        raise WebSocketError("Invalid handshake") from e
+    headers = {"": lines[0]}
+    for line in lines[1:]:
+        if len(line) == 0:
+            continue
+        name, sep, value = line.partition(":")
+        if len(sep) == 0:
+            raise WebSocketError(f"Invalid handshake header: {line}")
+        headers[name.strip().lower()] = value.strip()
+
+    if headers.get("upgrade", "").lower() != "websocket":
+        raise WebSocketError("Not a WebSocket upgrade")
+    return headers
+
+
+def handshake_response(headers: Dict[str, str]) -> bytes:
+    """Builds the server's response to a parsed upgrade request
+
+    Raises:
+        WebSocketError: The request is not a valid WebSocket upgrade
+    """
+    if not headers[""].startswith("GET "):
+        raise WebSocketError("WebSocket upgrade must be a GET request")
+    key = headers.get("sec-websocket-key", "")
+    if len(key) == 0:
+        raise WebSocketError("Missing Sec-WebSocket-Key")
+    return (
+        "HTTP/1.1 101 Switching Protocols\r\n"
+        "Upgrade: websocket\r\n"
+        "Connection: Upgrade\r\n"
+        f"Sec-WebSocket-Accept: {accept_key(key)}\r\n"
+        "\r\n"
+    ).encode("ascii")
+
+
+def handshake_request(host: str, port: int, path: str = "/") -> Tuple[bytes, str]:
+    """Builds a client upgrade request
+
+    Returns:
+        Tuple[bytes, str]: The request and the Sec-WebSocket-Accept value
+            the server must answer with
+    """
+    key = base64.b64encode(os.urandom(16)).decode("ascii")
+    request = (
+        f"GET {path} HTTP/1.1\r\n"
+        f"Host: {host}:{port}\r\n"
+        "Upgrade: websocket\r\n"
+        "Connection: Upgrade\r\n"
+        f"Sec-WebSocket-Key: {key}\r\n"
+        "Sec-WebSocket-Version: 13\r\n"
+        "\r\n"
+    ).encode("ascii")
+    return request, accept_key(key)
+
+
+def mask_payload(payload: bytes, mask: bytes) -> bytes:
+    """XORs payload with the 4 byte mask, in both directions"""
+    length = len(payload)
+    if length == 0:
+        return b""
+    # One big integer XOR is much faster than a Python loop per byte
+    key = (mask * (length // 4 + 1))[:length]
+    value = int.from_bytes(payload, "big") ^ int.from_bytes(key, "big")
+    return value.to_bytes(length, "big")
+
+
+def encode_websocket_header(
+    opcode: int, length: int, mask: bytes | None = None
+) -> bytes:
+    """Builds the header of a single, final frame
+
+    Servers send unmasked frames, clients pass the mask they will apply
+    to the payload.
+    """
+    masked = _MASKED if mask is not None else 0
+    if length < 126:
+        header = bytes((_FIN | opcode, masked | length))
+    elif length < 1 << 16:
+        header = bytes((_FIN | opcode, masked | 126)) + _LENGTH_16.pack(length)
+    else:
+        header = bytes((_FIN | opcode, masked | 127)) + _LENGTH_64.pack(length)
+    return header + mask if mask is not None else header
+
+
+def encode_websocket_frame(
+    opcode: int, payload: bytes, mask: bytes | None = None
+) -> bytes:
+    header = encode_websocket_header(opcode, len(payload), mask)
+    return header + (mask_payload(payload, mask) if mask is not None else payload)
+
+
+class WebSocketDecoder:
+    """Incremental decoder for WebSocket frames
+
+    Fragmented messages are put back together. Control frames are
+    returned as they arrive, even in the middle of a fragmented message.
+
+    Args:
+        require_mask (bool): Reject unmasked frames. Clients must mask
+            every frame they send to a server.
+        max_message_size (int): Largest message accepted.
+    """
+
+    def __init__(
+        self, require_mask: bool = True, max_message_size: int = MAX_FRAME_SIZE
+    ) -> None:
+        self.require_mask = require_mask
+        self.max_message_size = max_message_size
+        self._buffer = bytearray()
+        self._fragments: List[bytes] = []
+        self._fragments_size = 0
+        self._fragments_opcode: int | None = None
+
+    def feed(self, data: bytes) -> List[Tuple[int, bytes]]:
+        """Adds data to the buffer and returns every complete message
+
+        Raises:
+            WebSocketError: The stream breaks the protocol
+
+        Returns:
+            List[Tuple[int, bytes]]: (opcode, payload) of each message
+        """
+        self._buffer.extend(data)
+        messages: List[Tuple[int, bytes]] = []
+        offset = 0
+        available = len(self._buffer)
+        while available - offset >= 2:
+            first, second = self._buffer[offset], self._buffer[offset + 1]
+            fin = first & _FIN
+            opcode = first & 0x0F
+            masked = second & _MASKED
+            length = second & 0x7F
+            start = offset + 2
+            if length == 126:
+                if available - start < 2:
+                    break
+                (length,) = _LENGTH_16.unpack_from(self._buffer, start)
+                start += 2
+            elif length == 127:
+                if available - start < 8:
+                    break
+                (length,) = _LENGTH_64.unpack_from(self._buffer, start)
+                start += 8
+            if length > self.max_message_size:
+                raise WebSocketError(
+                    f"Frame of {length} bytes exceeds {self.max_message_size} bytes"
+                )
+            if self.require_mask and not masked:
+                raise WebSocketError("Client frames must be masked")
+
+            mask = None
+            if masked:
+                if available - start < 4:
+                    break
+                mask = bytes(self._buffer[start : start + 4])
+                start += 4
+            end = start + length
+            if end > available:
+                break
+
+            payload = bytes(self._buffer[start:end])
+            if mask is not None:
+                payload = mask_payload(payload, mask)
+            offset = end
+            message = self._assemble(fin, opcode, payload)
+            if message is not None:
+                messages.append(message)
+
+        if offset > 0:
+            del self._buffer[:offset]
+        return messages
+
+    def _assemble(
+        self, fin: int, opcode: int, payload: bytes
+    ) -> Tuple[int, bytes] | None:
+        if opcode >= WEBSOCKET_OPCODES.close:
+            if not fin:
+                raise WebSocketError("Control frames can not be fragmented")
+            return opcode, payload
+
+        if opcode == WEBSOCKET_OPCODES.continuation:
+            if self._fragments_opcode is None:
+                raise WebSocketError("Continuation without a message to continue")
+        elif self._fragments_opcode is not None:
+            raise WebSocketError("New message before the last one finished")
+        elif opcode not in (WEBSOCKET_OPCODES.text, WEBSOCKET_OPCODES.binary):
+            raise WebSocketError(f"Unknown opcode: {opcode:#x}")
+        elif fin:
+            return opcode, payload
+        else:
+            self._fragments_opcode = opcode
+
+        self._fragments.append(payload)
+        self._fragments_size += len(payload)
+        if self._fragments_size > self.max_message_size:
+            raise WebSocketError(f"Message exceeds {self.max_message_size} bytes")
+        if not fin:
+            return None
+
+        message = (self._fragments_opcode, b"".join(self._fragments))
+        self._fragments = []
+        self._fragments_size = 0
+        self._fragments_opcode = None
+        return message
@@ -1,22 +1,68 @@
 import argparse
+import os
 from os import chdir, path
 import sys
 
-from server import run_server
+from server import (
+    ServerConfig,
+    run_broker,
+    run_cluster_node,
+    run_multiprocess_server,
+    run_server,
+)
 from client import run_client
 
+# Environment variable holding the secret shared by the broker and nodes
+CLUSTER_SECRET_VARIABLE = "CHAT_CLUSTER_SECRET"
+
 
 def main(args: argparse.Namespace):
     host = args.host if args.host else "127.0.0.1"
     port = args.port if args.port else 5001
     test = args.test
     protocol = args.protocol
+    codec = args.codec
+    compression = "deflate" if args.compress else "none"
     server = args.server
-    if server:
+    if args.broker or args.cluster is not None:
+        # Nodes prove to the broker that they know the secret
+        cluster_secret = os.environ.get(CLUSTER_SECRET_VARIABLE, "").encode()
+        if len(cluster_secret) == 0:
+            sys.exit(f"Set {CLUSTER_SECRET_VARIABLE} to run a broker or cluster node")
+    if args.broker:
+        print("Start broker")
+        run_broker(cluster_secret, host=host, port=args.port if args.port else 5100)
+    elif server:
         print("Start server")
-        run_server(host=host, port=port)
+        if args.cluster is not None:
+            broker_host, _, broker_port = args.cluster.rpartition(":")
+            run_cluster_node(
+                host=host,
+                port=port,
+                broker_host=broker_host if broker_host else "127.0.0.1",
+                broker_port=int(broker_port),
+                websocket_port=args.websocket_port,
+                config=ServerConfig(cluster_secret=cluster_secret),
+            )
+        elif args.workers is not None or args.shards is not None:
+            run_multiprocess_server(
+                host=host,
+                port=port,
+                workers=args.workers,
+                websocket_port=args.websocket_port,
+                shards=args.shards if args.shards is not None else 1,
+            )
+        else:
+            run_server(host=host, port=port, websocket_port=args.websocket_port)
     else:
-        run_client(host=host, port=port, test=test, protocol_type=protocol)
+        run_client(
+            host=host,
+            port=port,
+            test=test,
+            protocol_type=protocol,
+            codec=codec,
+            compression=compression,
+        )
 
 
 if __name__ == "__main__":
@@ -34,6 +80,46 @@ if __name__ == "__main__":
     )
     parser.add_argument("--host", type=str, help="Specify hostname of client/server")
     parser.add_argument("--port", "-p", type=int, help="Specify port for server/client")
+    parser.add_argument(
+        "--websocket-port",
+        type=int,
+        help="Also accept WebSocket clients on this port (server only)",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        help="Serve clients from this many frontend processes (server only)",
+    )
+    parser.add_argument(
+        "--shards",
+        type=int,
+        help="Partition rooms across this many core processes (server only)",
+    )
+    parser.add_argument(
+        "--broker",
+        default=False,
+        action="store_true",
+        help="Start the broker that cluster nodes connect to (default port 5100), "
+        f"with the secret in {CLUSTER_SECRET_VARIABLE}",
+    )
+    parser.add_argument(
+        "--cluster",
+        metavar="HOST:PORT",
+        help="Run the server as a cluster node of the broker at HOST:PORT, "
+        f"with the secret in {CLUSTER_SECRET_VARIABLE}",
+    )
     parser.add_argument("--protocol", default="basic")
+    parser.add_argument(
+        "--codec",
+        default="json",
+        choices=["json", "binary"],
+        help="Wire encoding used by the chat client",
+    )
+    parser.add_argument(
+        "--compress",
+        default=False,
+        action="store_true",
+        help="Ask the server to compress large frames",
+    )
     arguments = parser.parse_args(sys.argv[1:])
     main(args=arguments)
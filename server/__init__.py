@@ -1,3 +1,16 @@
 from .chat_server import run_server
+from .cluster import run_broker, run_cluster_node
+from .frontends import run_multiprocess_server
+from .metrics import METRICS, ServerMetrics
+from .server_config import OVERFLOW_POLICIES, ServerConfig
 
-__all__ = ["run_server"]
+__all__ = [
+    "run_server",
+    "run_multiprocess_server",
+    "run_broker",
+    "run_cluster_node",
+    "METRICS",
+    "OVERFLOW_POLICIES",
+    "ServerConfig",
+    "ServerMetrics",
+]
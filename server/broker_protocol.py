@@ -0,0 +1,49 @@
+from abc import ABC, abstractmethod
+
+
+class AbstractBroker(ABC):
+    """Pub/sub and a user directory shared by the nodes of a cluster
+
+    A node subscribes to the rooms it has members in and publishes the
+    messages sent to them. A published message reaches every other
+    subscribed node, never the publisher, which delivers to its own
+    members itself. A node locates the users whose connections it holds,
+    so direct messages and kicks for them are routed to it.
+
+    Messages from other nodes are handed to the node's deliver_to_room,
+    deliver_to_user and kick_user.
+    """
+
+    @abstractmethod
+    def subscribe(self, roomid: str) -> None:
+        pass
+
+    @abstractmethod
+    def unsubscribe(self, roomid: str) -> None:
+        pass
+
+    @abstractmethod
+    def publish(self, roomid: str, message: str | bytes) -> None:
+        pass
+
+    @abstractmethod
+    def locate(self, userid: str) -> None:
+        """Routes the user's direct messages to this node"""
+        pass
+
+    @abstractmethod
+    def forget(self, userid: str) -> None:
+        pass
+
+    @abstractmethod
+    def send_to_user(self, userid: str, message: str | bytes) -> None:
+        pass
+
+    @abstractmethod
+    def kick(self, userid: str) -> None:
+        """Closes the user's connection if another node holds it"""
+        pass
+
+    @abstractmethod
+    def close(self) -> None:
+        pass
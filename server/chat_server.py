@@ -2,46 +2,139 @@ from __future__ import annotations
 import asyncio
 import json
 import logging
-import bcrypt
-from typing import Dict, List
+import struct
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Tuple
 
 from .chat_server_protocol import (
+    FRAME_KINDS,
     AbstractChatServer,
     AbstractChatConnection,
     Chatroom,
+    RoomDirectory,
+    RoomHistory,
+    SharedFrame,
 )
 from .database_protocol import AbstractDatabase, ConstraintError, DBConnectionError
+from .handlers import (
+    HandlerRegistry,
+    _request_id,
+    authorize,
+    rate_limit,
+    timing,
+    validate,
+)
+from .metrics import METRICS, ServerMetrics
+from .password_hasher import PasswordHasher, ServerBusyError
+from .rate_limit import RateLimiter
+from .server_config import OVERFLOW_POLICIES, ServerConfig
+from .session_tokens import InvalidTokenError, SessionTokens
 from .sqlite_database import SqliteDatabase
 from common import (
+    CODECS,
+    COMPRESSIONS,
+    RESYNC_MODES,
     ENCODING,
     ERRORS,
     ERROR_TYPES,
+    BinaryCodecError,
+    FrameDecoder,
+    FrameError,
+    MAX_HANDSHAKE_SIZE,
+    WEBSOCKET_OPCODES,
     User,
+    WebSocketDecoder,
+    WebSocketError,
+    encode_websocket_header,
+    handshake_response,
+    parse_handshake,
+    encode_frame_buffers,
+    sequence_frame_header,
     MESSAGE_TYPE,
     MESSAGE_TYPES,
+    MAX_FRAME_SIZE,
+    PROTOCOL_VERSION,
+    FIELDS_ACK_MESSAGE,
     FIELDS_BLACKLIST_MESSAGE,
     FIELDS_CREATE_ROOM_MESSAGE,
     FIELDS_CHAT_MESSAGE,
     FIELDS_CHAT_MESSAGES,
+    FIELDS_HELLO_MESSAGE,
+    FIELDS_HISTORY_MESSAGE,
     FIELDS_JOIN_ROOM_MESSAGE,
+    FIELDS_LIST_ROOMS_MESSAGE,
     FIELDS_LIST_USERS_MESSAGE,
+    FIELDS_LOGIN_MESSAGE,
     FIELDS_LOGOUT_MESSAGE,
+    FIELDS_PING_MESSAGE,
+    FIELDS_RESUME_MESSAGE,
     FIELDS_REGISTER_MESSAGE,
+    FIELDS_RESEND_MESSAGE,
     FIELDS_UNBLOCK_MESSAGE,
     # message_factory,
+    decode_message,
     serialzie_create_room_response_message,
     serialize_register_response_message,
+    serialize_resend_gap_message,
     serialize_blacklist_response_message,
     serialize_chat,
     serialize_chat_messages,
     serialize_error_message,
+    serialize_hello_response_message,
+    serialize_history_response_message,
     serialize_join_room_response_message,
     serialize_list_rooms_message,
     serialize_list_users_message,
     serialize_login_response_message,
+    serialize_ping_message,
+    serialize_pong_message,
+    serialize_resume_response_message,
     serialize_unblock_response_message,
+    with_request_id,
 )
 
+# Seconds a WebSocket client has to complete the upgrade request
+WEBSOCKET_HANDSHAKE_TIMEOUT = 10.0
+WEBSOCKET_CLOSE_CODE = struct.Struct("!H")
+WEBSOCKET_CLOSE_NORMAL = 1000
+WEBSOCKET_CLOSE_PROTOCOL_ERROR = 1002
+WEBSOCKET_CLOSE_INVALID_DATA = 1007
+
+# Field holding the sender's userid, checked against the signed-in user
+USERID_FIELDS: Dict[str, str] = {
+    MESSAGE_TYPES.blacklist: FIELDS_BLACKLIST_MESSAGE.userid,
+    MESSAGE_TYPES.join_room: FIELDS_JOIN_ROOM_MESSAGE.userid,
+    MESSAGE_TYPES.logout: FIELDS_LOGOUT_MESSAGE.userid,
+    MESSAGE_TYPES.unblock: FIELDS_UNBLOCK_MESSAGE.userid,
+}
+
+# Fields that must not be blank and the error sent when one is, if any
+REQUIRED_FIELDS: Dict[str, Tuple[Tuple[str, ...], str | None]] = {
+    MESSAGE_TYPES.blacklist: (
+        (FIELDS_BLACKLIST_MESSAGE.userid, FIELDS_BLACKLIST_MESSAGE.blocked_username),
+        ERROR_TYPES.invalid_blacklist,
+    ),
+    MESSAGE_TYPES.create_room: ((FIELDS_CREATE_ROOM_MESSAGE.name,), None),
+    MESSAGE_TYPES.join_room: (
+        (FIELDS_JOIN_ROOM_MESSAGE.roomname, FIELDS_JOIN_ROOM_MESSAGE.userid),
+        None,
+    ),
+    MESSAGE_TYPES.login: (
+        (FIELDS_LOGIN_MESSAGE.username, FIELDS_LOGIN_MESSAGE.password),
+        ERROR_TYPES.invalid_username_password,
+    ),
+    MESSAGE_TYPES.logout: ((FIELDS_LOGOUT_MESSAGE.userid,), None),
+    MESSAGE_TYPES.register: (
+        (FIELDS_REGISTER_MESSAGE.username, FIELDS_REGISTER_MESSAGE.password),
+        ERROR_TYPES.invalid_username_password,
+    ),
+    MESSAGE_TYPES.unblock: (
+        (FIELDS_UNBLOCK_MESSAGE.userid, FIELDS_UNBLOCK_MESSAGE.blocked_username),
+        ERROR_TYPES.invalid_blacklist,
+    ),
+}
+
 
 class ChatServerConnection(AbstractChatConnection, asyncio.Protocol):
     parent: ChatServer | None = None
@@ -50,29 +143,82 @@ class ChatServerConnection(AbstractChatConnection, asyncio.Protocol):
         super().__init__(None, None)
         self.parent = parent
         self.conn: asyncio.WriteTransport = None
+        self._decoder = FrameDecoder()
+        # Frames waiting to be written with a single writelines call,
+        # stored as (kind, header, payload)
+        self._outbound: Deque[Tuple[str, bytes, bytes]] = deque()
+        self._outbound_bytes: int = 0
+        self._flush_handle: asyncio.Handle | None = None
+        self._writing_paused: bool = False
+        self.dropped_frames: int = 0
+        # Sequenced frames the client has not acknowledged yet, stored as
+        # (sequence, header, payload)
+        self._next_sequence: int = 1
+        self._resend_window: Deque[Tuple[int, bytes, bytes]] = deque()
+        self._resend_bytes: int = 0
+
+    @property
+    def queued_frames(self) -> int:
+        return len(self._outbound)
+
+    @property
+    def queued_bytes(self) -> int:
+        return self._outbound_bytes
 
     # Called when we accept a new connection
     def connection_made(self, transport: asyncio.WriteTransport):
         peername = transport.get_extra_info("peername")
         logging.info(f"Connection from {peername}")
         self.conn = transport
+        self.last_received = time.monotonic()
         self.parent.add_connection(self)
 
     # Called when new data is incoming
     def data_received(self, data: bytes) -> None:
-        message = json.loads(data.decode(ENCODING))
-        logging.debug(f"Data received: {message}")
+        # Any traffic, not only pongs, shows the client is alive
+        self.last_received = time.monotonic()
+        try:
+            payloads = self._decoder.feed(data)
+        except FrameError as e:
+            logging.error("Invalid frame, closing connection: %s", e)
+            return self.close()
+
+        for payload in payloads:
+            try:
+                message = decode_message(payload)
+            except (ValueError, BinaryCodecError) as e:
+                logging.error("Invalid message, closing connection: %s", e)
+                return self.close()
+            logging.debug(f"Data received: {message}")
 
-        asyncio.create_task(self.parent.handle_message(message, self))
+            asyncio.create_task(self.parent.handle_message(message, self))
 
     # Called when a connection is closed or there is an error
     def connection_lost(self, exc: Exception):
-        self.parent.remove_connection(self)
+        self._cancel_flush()
+        self._outbound.clear()
+        self._outbound_bytes = 0
+        self._resend_window.clear()
+        self._resend_bytes = 0
+        # Closed or aborted here already removed it
+        if not self.closed:
+            self._is_closed = True
+            self.parent.remove_connection(self)
         peername = self.conn.get_extra_info("peername")
         logging.info(f"Lost connection from {peername}.")
         return super().connection_lost(exc)
 
-    async def send(self, payload: str) -> None:
+    # Called by the transport when its write buffer is over the high-water mark
+    def pause_writing(self) -> None:
+        self._writing_paused = True
+        self._cancel_flush()
+
+    # Called by the transport when its write buffer has drained
+    def resume_writing(self) -> None:
+        self._writing_paused = False
+        self.flush()
+
+    async def send(self, payload: str | bytes, kind: str = FRAME_KINDS.control) -> None:
         if payload is None:
             return
         if self.closed:
@@ -80,7 +226,202 @@ class ChatServerConnection(AbstractChatConnection, asyncio.Protocol):
 
         try:
             logging.debug("Sending payload: \n%s", payload)
-            self.conn.write(payload.encode(ENCODING))
+            if isinstance(payload, str):
+                payload = payload.encode(ENCODING)
+            header, payload = encode_frame_buffers(
+                payload, self.compression, self.parent.config.compression_min_size
+            )
+            self._queue(kind, header, payload)
+        except Exception as e:
+            logging.error("Error sending message: %s", e)
+
+    async def send_shared(
+        self, frame: SharedFrame, kind: str = FRAME_KINDS.control
+    ) -> None:
+        if self.closed:
+            return
+
+        header, payload = frame.frame(
+            self.codec, self.compression, self.parent.config.compression_min_size
+        )
+        self._queue(kind, header, payload)
+
+    def _queue(
+        self, kind: str, header: bytes, payload: bytes, sequence: bool = True
+    ) -> None:
+        if len(payload) > self.max_frame_size:
+            # The client would close the connection on a frame this large
+            logging.error("Dropping frame of %s bytes, too large", len(payload))
+            self.parent.metrics.increment(METRICS.frames_oversized)
+            return
+
+        if sequence and self.sequenced:
+            header = sequence_frame_header(header, self._next_sequence)
+            self._remember(self._next_sequence, header, payload)
+            self._next_sequence += 1
+
+        self._outbound.append((kind, header, payload))
+        self._outbound_bytes += len(header) + len(payload)
+
+        config = self.parent.config
+        if self._writing_paused:
+            # Nothing is written until resume_writing, keep the queue bounded
+            if self._is_over_limit():
+                self._handle_overflow()
+            return
+
+        if self._outbound_bytes >= config.flush_max_bytes:
+            return self.flush()
+
+        if self._flush_handle is None:
+            loop = asyncio.get_running_loop()
+            if config.flush_max_delay > 0 and self.batching:
+                self._flush_handle = loop.call_later(config.flush_max_delay, self.flush)
+            else:
+                self._flush_handle = loop.call_soon(self.flush)
+
+    def _remember(self, sequence: int, header: bytes, payload: bytes) -> None:
+        config = self.parent.config
+        self._resend_window.append((sequence, header, payload))
+        self._resend_bytes += len(header) + len(payload)
+        while len(self._resend_window) > 0 and (
+            len(self._resend_window) > config.resend_window_frames
+            or self._resend_bytes > config.resend_window_bytes
+        ):
+            _, old_header, old_payload = self._resend_window.popleft()
+            self._resend_bytes -= len(old_header) + len(old_payload)
+
+    def acknowledge(self, sequence: int) -> None:
+        while len(self._resend_window) > 0 and self._resend_window[0][0] <= sequence:
+            _, header, payload = self._resend_window.popleft()
+            self._resend_bytes -= len(header) + len(payload)
+
+    def resend(self, first_sequence: int, last_sequence: int) -> None:
+        if self.closed or not self.sequenced:
+            return
+        last_sequence = min(last_sequence, self._next_sequence - 1)
+        if first_sequence > last_sequence:
+            return
+
+        oldest = (
+            self._resend_window[0][0]
+            if len(self._resend_window) > 0
+            else self._next_sequence
+        )
+        if first_sequence < oldest:
+            # Already released or pushed out of the window. The notice is
+            # not sequenced so the client acts on it straight away.
+            gap_end = min(last_sequence, oldest - 1)
+            self.parent.metrics.increment(METRICS.resend_gaps)
+            self._send_unsequenced(
+                serialize_resend_gap_message(first_sequence, gap_end, self.codec)
+            )
+
+        resent = 0
+        for sequence, header, payload in self._resend_window:
+            if sequence > last_sequence:
+                break
+            if sequence >= first_sequence:
+                self._queue(FRAME_KINDS.control, header, payload, sequence=False)
+                resent += 1
+        if resent > 0:
+            self.parent.metrics.increment(METRICS.frames_resent, resent)
+
+    def ping(self, nonce: int) -> None:
+        if self.closed:
+            return
+        # Heartbeats are not sequenced, they are never worth resending
+        self._send_unsequenced(serialize_ping_message(nonce, self.codec))
+
+    def reap(self) -> None:
+        logging.info(
+            "Reaping silent connection: %s", self.conn.get_extra_info("peername")
+        )
+        self.parent.metrics.increment(METRICS.connections_reaped)
+        self._abort()
+
+    def _send_unsequenced(self, message: str | bytes) -> None:
+        if isinstance(message, str):
+            message = message.encode(ENCODING)
+        header, payload = encode_frame_buffers(message)
+        self._queue(FRAME_KINDS.control, header, payload, sequence=False)
+
+    def _cancel_flush(self) -> None:
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+
+    def _is_over_limit(self, frames: int | None = None) -> bool:
+        config = self.parent.config
+        frames = len(self._outbound) if frames is None else frames
+        return (
+            frames > config.outbound_max_frames
+            or self._outbound_bytes > config.outbound_max_bytes
+        )
+
+    def _handle_overflow(self) -> None:
+        policy = self.parent.config.overflow_policy
+        if policy == OVERFLOW_POLICIES.disconnect:
+            return self._disconnect_slow_consumer()
+
+        dropped = 0
+        if policy == OVERFLOW_POLICIES.drop_oldest:
+            while len(self._outbound) > 0 and self._is_over_limit():
+                _, header, payload = self._outbound.popleft()
+                self._outbound_bytes -= len(header) + len(payload)
+                dropped += 1
+        else:
+            # Shed the oldest room traffic, keep direct and control messages
+            kept: Deque[Tuple[str, bytes, bytes]] = deque()
+            for entry in self._outbound:
+                remaining = len(self._outbound) - dropped
+                if entry[0] == FRAME_KINDS.room and self._is_over_limit(remaining):
+                    self._outbound_bytes -= len(entry[1]) + len(entry[2])
+                    dropped += 1
+                else:
+                    kept.append(entry)
+            self._outbound = kept
+
+        if dropped > 0:
+            self.dropped_frames += dropped
+            self.parent.metrics.increment(METRICS.frames_dropped, dropped)
+            logging.debug("Dropped %s frames for slow consumer", dropped)
+
+        if self._is_over_limit():
+            self._disconnect_slow_consumer()
+
+    def _disconnect_slow_consumer(self) -> None:
+        logging.info("Disconnecting slow consumer: %s", self.queued_frames)
+        self.parent.metrics.increment(METRICS.slow_consumers_disconnected)
+        self._abort()
+
+    def _abort(self) -> None:
+        self._cancel_flush()
+        self._outbound.clear()
+        self._outbound_bytes = 0
+        try:
+            # Discard whatever the transport is still holding
+            self.conn.abort()
+        except Exception as e:
+            logging.error("Error closing connection: %s", e)
+        finally:
+            self.parent.remove_connection(self)
+            self._is_closed = True
+
+    def flush(self) -> None:
+        """Writes every queued frame to the transport in one call"""
+        self._cancel_flush()
+        if len(self._outbound) == 0 or self._writing_paused:
+            return
+
+        buffers: List[bytes] = []
+        for _, header, payload in self._outbound:
+            buffers.append(header)
+            buffers.append(payload)
+        self._outbound.clear()
+        self._outbound_bytes = 0
+        try:
+            self.conn.writelines(buffers)
         except Exception as e:
             logging.error("Error sending message: %s", e)
 
@@ -89,6 +430,7 @@ class ChatServerConnection(AbstractChatConnection, asyncio.Protocol):
             return
 
         try:
+            self.flush()
             self.conn.close()
         except Exception as e:
             logging.error("Error closing connection: %s", e)
@@ -97,63 +439,417 @@ class ChatServerConnection(AbstractChatConnection, asyncio.Protocol):
             self._is_closed = True
 
 
-class ChatServer(AbstractChatServer):
-    def __init__(self, db: AbstractDatabase) -> None:
+class WebSocketConnection(ChatServerConnection):
+    """A connection from a WebSocket client
+
+    Each WebSocket message carries one chat message in place of a chat
+    frame, as text for the json codec and binary for the binary codec.
+    Rooms, users, outbound queueing and heartbeats are shared with TCP
+    connections.
+    """
+
+    framed = False
+
+    def __init__(self, parent: ChatServer):
+        super().__init__(parent)
+        # Upgrade request bytes, None once the handshake is done
+        self._handshake: bytearray | None = bytearray()
+        self._handshake_timer: asyncio.TimerHandle | None = None
+        self._websocket_decoder = WebSocketDecoder()
+
+    def connection_made(self, transport: asyncio.WriteTransport):
+        peername = transport.get_extra_info("peername")
+        logging.info(f"WebSocket connection from {peername}")
+        self.conn = transport
+        self.last_received = time.monotonic()
+        # Not a chat connection until the upgrade completes
+        loop = asyncio.get_running_loop()
+        self._handshake_timer = loop.call_later(
+            WEBSOCKET_HANDSHAKE_TIMEOUT, self._abort
+        )
+
+    def data_received(self, data: bytes) -> None:
+        self.last_received = time.monotonic()
+        if self._handshake is not None:
+            data = self._upgrade(data)
+            if data is None:
+                return
+
+        try:
+            messages = self._websocket_decoder.feed(data)
+        except WebSocketError as e:
+            logging.error("Invalid WebSocket frame, closing connection: %s", e)
+            return self._close_websocket(WEBSOCKET_CLOSE_PROTOCOL_ERROR)
+
+        for opcode, payload in messages:
+            if opcode == WEBSOCKET_OPCODES.ping:
+                self._queue_websocket(WEBSOCKET_OPCODES.pong, payload)
+            elif opcode == WEBSOCKET_OPCODES.close:
+                return self._close_websocket(WEBSOCKET_CLOSE_NORMAL)
+            elif opcode != WEBSOCKET_OPCODES.pong:
+                try:
+                    message = decode_message(payload)
+                except (ValueError, BinaryCodecError) as e:
+                    logging.error("Invalid message, closing connection: %s", e)
+                    return self._close_websocket(WEBSOCKET_CLOSE_INVALID_DATA)
+                asyncio.create_task(self.parent.handle_message(message, self))
+
+    def connection_lost(self, exc: Exception):
+        if self._handshake_timer is not None:
+            self._handshake_timer.cancel()
+            self._handshake_timer = None
+        return super().connection_lost(exc)
+
+    def _upgrade(self, data: bytes) -> bytes | None:
+        """Buffers the upgrade request and answers it once complete
+
+        Returns:
+            bytes | None: Data received after the request, None while the
+                handshake is incomplete or failed
+        """
+        self._handshake.extend(data)
+        end = self._handshake.find(b"\r\n\r\n")
+        if end < 0:
+            if len(self._handshake) > MAX_HANDSHAKE_SIZE:
+                logging.error("WebSocket handshake too large, closing connection")
+                self._abort()
+            return None
+
+        head = bytes(self._handshake[: end + 4])
+        rest = bytes(self._handshake[end + 4 :])
+        self._handshake = None
+        self._handshake_timer.cancel()
+        self._handshake_timer = None
+        try:
+            response = handshake_response(parse_handshake(head))
+        except WebSocketError as e:
+            logging.error("Invalid WebSocket handshake: %s", e)
+            self.conn.write(b"HTTP/1.1 400 Bad Request\r\n\r\n")
+            self.conn.close()
+            self._is_closed = True
+            return None
+
+        self.conn.write(response)
+        self.parent.add_connection(self)
+        return rest
+
+    async def send(self, payload: str | bytes, kind: str = FRAME_KINDS.control) -> None:
+        if payload is None or self.closed:
+            return
+        if isinstance(payload, str):
+            payload = payload.encode(ENCODING)
+        self._queue_message(payload, kind)
+
+    async def send_shared(
+        self, frame: SharedFrame, kind: str = FRAME_KINDS.control
+    ) -> None:
+        if self.closed:
+            return
+        # The payload is encoded once per codec and shared by every member
+        self._queue_message(frame.payload(self.codec), kind)
+
+    def ping(self, nonce: int) -> None:
+        if self.closed or self._handshake is not None:
+            return
+        # Browsers answer WebSocket pings on their own
+        self._queue_websocket(WEBSOCKET_OPCODES.ping, str(nonce).encode(ENCODING))
+
+    def close(self):
+        self._close_websocket(WEBSOCKET_CLOSE_NORMAL)
+
+    def _close_websocket(self, code: int) -> None:
+        if self.closed:
+            return
+        if self._handshake is None:
+            self._queue_websocket(
+                WEBSOCKET_OPCODES.close, WEBSOCKET_CLOSE_CODE.pack(code)
+            )
+        super().close()
+
+    def _queue_message(self, payload: bytes, kind: str) -> None:
+        opcode = (
+            WEBSOCKET_OPCODES.text
+            if self.codec == CODECS.json
+            else WEBSOCKET_OPCODES.binary
+        )
+        header = encode_websocket_header(opcode, len(payload))
+        self._queue(kind, header, payload, sequence=False)
+
+    def _queue_websocket(self, opcode: int, payload: bytes) -> None:
+        header = encode_websocket_header(opcode, len(payload))
+        self._queue(FRAME_KINDS.control, header, payload, sequence=False)
+
+
+def _limiter(rate: float, burst: float) -> RateLimiter | None:
+    return RateLimiter(rate, burst) if rate > 0 else None
+
+
+def _page_request(
+    message: Dict[str, Any], fields: Any, page_size: int, max_page: int
+) -> Tuple[str, str, int]:
+    """Returns the prefix, cursor and limit a list request asks for"""
+    prefix = message.get(fields.prefix, None)
+    prefix = prefix if isinstance(prefix, str) else ""
+    cursor = message.get(fields.cursor, None)
+    cursor = cursor if isinstance(cursor, str) else ""
+    limit = message.get(fields.limit, None)
+    if not isinstance(limit, int) or limit <= 0:
+        limit = page_size
+    return prefix, cursor, min(limit, max_page)
+
+
+class ConnectionHandlers:
+    """Handlers and upkeep that only concern a connection, not chat state
+
+    Shared by ChatServer and the frontends of the multi-process server,
+    which answer these messages without forwarding them to the core.
+    Expects config, metrics, connections and _ping_nonce on the instance.
+    """
+
+    def get_metrics(self) -> Dict[str, int]:
+        """Returns server counters along with current outbound queue depths"""
+        frames = [c.queued_frames for c in self.connections]
+        self.metrics.set(METRICS.outbound_queue_frames, sum(frames))
+        self.metrics.set(METRICS.outbound_queue_max_frames, max(frames, default=0))
+        self.metrics.set(
+            METRICS.outbound_queue_bytes,
+            sum(c.queued_bytes for c in self.connections),
+        )
+        return self.metrics.snapshot()
+
+    def check_heartbeats(self, now: float | None = None) -> None:
+        """Pings connections that have gone quiet and reaps the ones that
+        have been silent for longer than config.heartbeat_timeout
+
+        Args:
+            now (float | None, optional): time.monotonic() value to compare
+                against. Defaults to the current time.
+        """
+        config = self.config
+        now = time.monotonic() if now is None else now
+        self._ping_nonce += 1
+        pinged = 0
+        for connection in list(self.connections):
+            silent = now - connection.last_received
+            if silent >= config.heartbeat_timeout:
+                connection.reap()
+            elif silent >= config.heartbeat_interval:
+                connection.ping(self._ping_nonce)
+                pinged += 1
+        if pinged > 0:
+            self.metrics.increment(METRICS.pings_sent, pinged)
+
+    async def _heartbeat(self) -> None:
+        while True:
+            await asyncio.sleep(self.config.heartbeat_interval)
+            self.check_heartbeats()
+
+    async def handle_ack(
+        self, message: Dict[str, Any], source: AbstractChatConnection
+    ) -> None:
+        sequence = message.get(FIELDS_ACK_MESSAGE.sequence, None)
+        if isinstance(sequence, int):
+            source.acknowledge(sequence)
+
+    async def handle_hello(
+        self, message: Dict[str, str], source: AbstractChatConnection
+    ) -> None:
+        # Client lists the codecs it accepts, most preferred first
+        codecs: List[str] = message.get(FIELDS_HELLO_MESSAGE.codecs, None) or []
+        codec = next((c for c in codecs if c in CODECS), CODECS.json)
+        compressions: List[str] = (
+            message.get(FIELDS_HELLO_MESSAGE.compressions, None) or []
+        )
+        compression = next(
+            (c for c in compressions if c in COMPRESSIONS), COMPRESSIONS.none
+        )
+
+        sequenced = message.get(FIELDS_HELLO_MESSAGE.sequenced, None) is True
+        if not source.framed:
+            # Compression and sequence numbers are chat frame header flags
+            compression = COMPRESSIONS.none
+            sequenced = False
+
+        # Clients from before versioning send none of the fields below
+        version = message.get(FIELDS_HELLO_MESSAGE.version, 1)
+        version = min(version, PROTOCOL_VERSION) if isinstance(version, int) else 1
+        max_frame_size = message.get(FIELDS_HELLO_MESSAGE.max_frame_size, None)
+        if not isinstance(max_frame_size, int) or max_frame_size <= 0:
+            max_frame_size = MAX_FRAME_SIZE
+        batching = message.get(FIELDS_HELLO_MESSAGE.batching, True) is not False
+        # Applies straight away, so the response is not held back either
+        source.version = version
+        source.batching = batching
+
+        # The response itself still uses the codec and framing of the hello
+        payload = serialize_hello_response_message(
+            codec,
+            compression,
+            sequenced,
+            requestid=_request_id.get(),
+            version=version,
+            max_frame_size=MAX_FRAME_SIZE,
+            batching=batching,
+        )
+        await source.send(payload)
+        source.codec = codec
+        source.compression = compression
+        source.sequenced = sequenced
+        source.max_frame_size = min(max_frame_size, MAX_FRAME_SIZE)
+
+    async def handle_ping(
+        self, message: Dict[str, Any], source: AbstractChatConnection
+    ) -> None:
+        nonce = message.get(FIELDS_PING_MESSAGE.nonce, 0)
+        await source.send(serialize_pong_message(nonce, source.codec))
+
+    async def handle_pong(
+        self, message: Dict[str, Any], source: AbstractChatConnection
+    ) -> None:
+        # Nothing to do, data_received already marked the connection alive
+        pass
+
+    async def handle_resend(
+        self, message: Dict[str, Any], source: AbstractChatConnection
+    ) -> None:
+        first = message.get(FIELDS_RESEND_MESSAGE.first_sequence, None)
+        last = message.get(FIELDS_RESEND_MESSAGE.last_sequence, None)
+        if isinstance(first, int) and isinstance(last, int):
+            source.resend(first, last)
+
+
+class ChatServer(ConnectionHandlers, AbstractChatServer):
+    def __init__(
+        self, db: AbstractDatabase, config: ServerConfig | None = None
+    ) -> None:
         super().__init__(db)
+        self.config = config if config is not None else ServerConfig()
+        self.metrics = ServerMetrics()
+        self.sessions = SessionTokens(
+            self.config.session_secret, self.config.session_token_ttl
+        )
+        self.passwords = PasswordHasher(
+            self.config.password_workers, self.config.password_max_pending
+        )
+        self.handlers = HandlerRegistry()
+        if self.config.handler_timing:
+            self.handlers.use(timing(self.metrics))
+        # Chat budgets, None when disabled
+        config = self.config
+        self._connection_limiter = _limiter(
+            config.chat_rate_connection, config.chat_burst_connection
+        )
+        self._user_limiter = _limiter(config.chat_rate_user, config.chat_burst_user)
+        self._room_limiter = _limiter(config.chat_rate_room, config.chat_burst_room)
+        limiters = [self._connection_limiter, self._user_limiter, self._room_limiter]
+        if any(limiter is not None for limiter in limiters):
+            self.handlers.use(
+                rate_limit({MESSAGE_TYPES.chat: self._chat_charges}, self.metrics)
+            )
+        self.handlers.use(authorize(USERID_FIELDS))
+        self.handlers.use(validate(REQUIRED_FIELDS))
+        for message_type, handler in [
+            (MESSAGE_TYPES.ack, self.handle_ack),
+            (MESSAGE_TYPES.blacklist, self.handle_blacklist),
+            (MESSAGE_TYPES.create_room, self.handle_create_room),
+            (MESSAGE_TYPES.chat, self.handle_chat),
+            (MESSAGE_TYPES.hello, self.handle_hello),
+            (MESSAGE_TYPES.history, self.handle_history),
+            (MESSAGE_TYPES.join_room, self.handle_join_room),
+            (MESSAGE_TYPES.list_rooms, self.handle_list_rooms),
+            (MESSAGE_TYPES.list_users, self.handle_list_users),
+            (MESSAGE_TYPES.login, self.handle_login),
+            (MESSAGE_TYPES.logout, self.handle_logout),
+            (MESSAGE_TYPES.ping, self.handle_ping),
+            (MESSAGE_TYPES.pong, self.handle_pong),
+            (MESSAGE_TYPES.register, self.handle_register),
+            (MESSAGE_TYPES.resend, self.handle_resend),
+            (MESSAGE_TYPES.resume, self.handle_resume),
+            (MESSAGE_TYPES.unblock, self.handle_unblock),
+        ]:
+            self.handlers.register(message_type, handler)
+        self._ping_nonce: int = 0
+        # Every room's name, so list_rooms does not query the database
+        self.room_directory = RoomDirectory([self.lobby.name])
+        self._rooms_loaded: float = 0.0
+        self._refresh_room_directory(force=True)
+
+    def _chat_charges(
+        self, message: Dict[str, Any], source: AbstractChatConnection
+    ) -> List[Tuple[RateLimiter, Any, float]]:
+        """Buckets a chat frame takes one token per message from"""
+        messages = message.get(FIELDS_CHAT_MESSAGES.messages, None)
+        if not isinstance(messages, list) or len(messages) == 0:
+            messages = [{}]
+
+        charges: List[Tuple[RateLimiter, Any, float]] = []
+        if self._connection_limiter is not None:
+            charges.append((self._connection_limiter, source, len(messages)))
+        if self._user_limiter is not None and source.user is not None:
+            charges.append((self._user_limiter, source.user.userid, len(messages)))
+        if self._room_limiter is not None:
+            rooms: Dict[str, int] = {}
+            for chat in messages:
+                if not isinstance(chat, dict):
+                    continue
+                roomid = chat.get(FIELDS_CHAT_MESSAGE.roomid, None)
+                # Direct messages have no room
+                if isinstance(roomid, str) and len(roomid) > 0:
+                    rooms[roomid] = rooms.get(roomid, 0) + 1
+            for roomid, count in rooms.items():
+                charges.append((self._room_limiter, roomid, count))
+        return charges
 
     async def handle_message(
         self, message: Dict[str, str], source: AbstractChatConnection
     ) -> None:
         logging.info("Handling message: %s", message)
+        await self.handlers.dispatch(message, source)
 
-        match message[MESSAGE_TYPE]:
-            case MESSAGE_TYPES.blacklist:
-                await self.handle_blacklist(message, source)
-            case MESSAGE_TYPES.create_room:
-                await self.handle_create_room(message, source)
-            case MESSAGE_TYPES.chat:
-                await self.handle_chat(message, source)
-            case MESSAGE_TYPES.join_room:
-                await self.handle_join_room(message, source)
-            case MESSAGE_TYPES.list_rooms:
-                await self.handle_list_rooms(message, source)
-            case MESSAGE_TYPES.list_users:
-                await self.handle_list_users(message, source)
-            case MESSAGE_TYPES.login:
-                await self.handle_login(message, source)
-            case MESSAGE_TYPES.logout:
-                await self.handle_logout(message, source)
-            case MESSAGE_TYPES.register:
-                await self.handle_register(message, source)
-            case MESSAGE_TYPES.unblock:
-                await self.handle_unblock(message, source)
-            case _:
-                pass
-
-    async def forward_to_room(self, message: Dict[str, str], roomid: str) -> None:
+    async def forward_to_room(
+        self,
+        message: str | bytes | SharedFrame,
+        roomid: str,
+        messages: List[Dict[str, Any]] | None = None,
+    ) -> None:
+        """Sends a message to every member of a room
+
+        Args:
+            message (str | bytes | SharedFrame): The serialized message
+            roomid (str): The room to send it to
+            messages (List[Dict[str, Any]] | None): The chats serialized
+                in message, kept in the room history. None if it is not a
+                chat message.
+        """
         room = self.rooms.get(roomid, None)
         if room is None:
             return
 
+        if messages is not None and room.history is not None:
+            room.history.append(messages)
         await room.forward_to_room(message)
 
-    async def forward_to_user(self, message: Dict[str, str], userid: str) -> None:
+    async def forward_to_user(
+        self, message: str | bytes | SharedFrame, userid: str
+    ) -> None:
         user = self.user_connections.get(userid, None)
         if user is None:
             return
 
-        await user.send(message)
+        frame = message if isinstance(message, SharedFrame) else SharedFrame(message)
+        await user.send_shared(frame, FRAME_KINDS.direct)
+
+    async def broadcast(self, message: str | bytes | SharedFrame) -> None:
+        """Sends a server-wide announcement to every connection"""
+        frame = message if isinstance(message, SharedFrame) else SharedFrame(message)
+        for connection in list(self.connections):
+            await connection.send_shared(frame, FRAME_KINDS.control)
 
     async def handle_blacklist(
         self, message: Dict[str, str], source: AbstractChatConnection
     ) -> None:
-        userid = message.get(FIELDS_BLACKLIST_MESSAGE.userid, "").strip()
-        username = message.get(FIELDS_BLACKLIST_MESSAGE.blocked_username, "").strip()
-
-        if len(userid) == 0 or len(username) == 0:
-            return await self.handle_error(
-                ERROR_TYPES.invalid_blacklist, ERRORS.invalid_blacklist, source
-            )
+        userid = message[FIELDS_BLACKLIST_MESSAGE.userid].strip()
+        username = message[FIELDS_BLACKLIST_MESSAGE.blocked_username].strip()
 
         # get userid
         blocked_user: Dict[str, str] | None = None
@@ -186,7 +882,9 @@ class ChatServer(AbstractChatServer):
         if result is None:
             return
 
-        payload = serialize_blacklist_response_message(userid, username)
+        payload = serialize_blacklist_response_message(
+            userid, username, codec=source.codec, requestid=_request_id.get()
+        )
         await source.send(payload)
 
     async def handle_create_room(
@@ -254,22 +952,85 @@ class ChatServer(AbstractChatServer):
     async def handle_error(
         self, errortype: str, error: str, source: AbstractChatConnection
     ):
-        message = serialize_error_message(errortype, error)
+        message = serialize_error_message(
+            errortype, error, codec=source.codec, requestid=_request_id.get()
+        )
         await source.send(message)
 
+    async def _handle_busy(
+        self, error: ServerBusyError, source: AbstractChatConnection
+    ) -> None:
+        logging.info("Rejecting password check: %s", error)
+        self.metrics.increment(METRICS.password_jobs_rejected)
+        await self.handle_error(ERROR_TYPES.server_busy, ERRORS.server_busy, source)
+
+    async def handle_history(
+        self, message: Dict[str, Any], source: AbstractChatConnection
+    ) -> None:
+        roomid = message.get(FIELDS_HISTORY_MESSAGE.roomid, "")
+        before = message.get(FIELDS_HISTORY_MESSAGE.before, "") or None
+        limit = message.get(FIELDS_HISTORY_MESSAGE.limit, None)
+        if not isinstance(limit, int) or limit <= 0:
+            limit = self.config.history_page_size
+        limit = min(limit, self.config.history_max_page)
+
+        # Only the history of the room the user is in
+        if source.room is None or source.room.id != roomid:
+            return await self.handle_error(
+                ERROR_TYPES.room_not_found, ERRORS.room_not_found, source
+            )
+
+        messages: List[Dict[str, str]] | None = None
+        try:
+            # One extra row tells whether there is more history
+            messages = self._db.get_room_messages_before(roomid, before, limit + 1)
+        except ConstraintError:
+            # before is not a message in this room
+            return await self.handle_error(
+                ERROR_TYPES.message_not_found, ERRORS.message_not_found, source
+            )
+        except (DBConnectionError, ValueError) as e:
+            logging.error("Error selecting room history: %s", e)
+        if messages is None:
+            return await self.handle_error(
+                ERROR_TYPES.server_error, ERRORS.server_error, source
+            )
+
+        more = len(messages) > limit
+        if more:
+            messages = messages[1:]
+
+        requestid = _request_id.get()
+        if len(messages) == 0:
+            payload = serialize_history_response_message(
+                roomid, [], before or "", False, source.codec, requestid
+            )
+            return await source.send(payload)
+
+        # Newest chunk first, so the client can prepend each one as it arrives
+        chunk_size = self.config.history_chunk_size
+        end = len(messages)
+        while end > 0:
+            start = max(0, end - chunk_size)
+            chunk = messages[start:end]
+            payload = serialize_history_response_message(
+                roomid,
+                chunk,
+                chunk[0][FIELDS_CHAT_MESSAGE.id],
+                more or start > 0,
+                source.codec,
+                requestid,
+            )
+            await source.send(payload)
+            end = start
+
     async def handle_join_room(
         self, message: Dict[str, str], source: AbstractChatConnection
     ) -> None:
         if message is None:
             return
 
-        name = message.get(FIELDS_JOIN_ROOM_MESSAGE.roomname, "").strip()
-        userid = message.get(FIELDS_JOIN_ROOM_MESSAGE.userid, "").strip()
-        if len(name) == 0 or len(userid) == 0:
-            return
-
-        if source.user is not None and source.user.userid != userid:
-            return
+        name = message[FIELDS_JOIN_ROOM_MESSAGE.roomname].strip()
 
         room: Chatroom | None = None
 
@@ -278,7 +1039,7 @@ class ChatServer(AbstractChatServer):
             room = self.lobby
         # Otherwise check rooms already in memory
         if room is None:
-            room = self.rooms.get(name, None)
+            room = self.rooms.by_name(name)
         # Finally look up room in DB
         if room is None:
             # ******************************
@@ -294,30 +1055,69 @@ class ChatServer(AbstractChatServer):
             # ******************************
             pass
 
-        await self._join_room(room, source)
-
-    async def _join_room(self, room: Chatroom, source: AbstractChatConnection):
+        lastid = message.get(FIELDS_JOIN_ROOM_MESSAGE.lastid, None)
+        await self._join_room(room, source, lastid)
 
+    async def _join_room(
+        self,
+        room: Chatroom,
+        source: AbstractChatConnection,
+        lastid: str | None = None,
+    ):
+        # Created here, or by another process since the directory was read
+        self.room_directory.add(room.name)
         room.join_room(source)
-        # Send join room message
-        payload = serialize_join_room_response_message(
-            source.user.userid, room.id, room.name
-        )
-        await source.send(payload)
-        # Weird thing to do, but messages can be sent together if there is not enough time between
-        await asyncio.sleep(0.05)
 
-        # Now get recent messages in room and send those
+        # A client that says which message it saw last only gets the
+        # messages it missed, unless it is too far behind
         messages: List[Dict[str, str]] | None = None
+        # Encoded chat frames when the room's history is kept in memory
+        frames: List[str | bytes] | None = None
+        resync: str | None = None
         try:
-            messages = self._db.get_room_messages(room.id)
+            history = self._room_history(room)
+            if lastid is not None and len(lastid) > 0:
+                if history is not None:
+                    frames = self._missed_frames(history, lastid, source.codec)
+                if frames is None:
+                    messages = self._missed_messages(room, lastid)
+                missed = frames is not None or messages is not None
+                resync = RESYNC_MODES.delta if missed else RESYNC_MODES.full
+            if frames is None and messages is None:
+                if history is not None:
+                    frames = history.frames(source.codec)
+                else:
+                    messages = self._db.get_room_messages_before(
+                        room.id, None, self.config.history_page_size
+                    )
         except DBConnectionError as e:
             logging.error("Error selecting recent messages: %s", e)
-            return await self.handle_error(
-                ERROR_TYPES.server_error, ERRORS.server_error, source
-            )
+            messages = None
         except ValueError as e:
             logging.error("Error selecting recent messages: %s", e)
+            messages = []
+
+        if resync is not None:
+            self.metrics.increment(
+                METRICS.resyncs_delta
+                if resync == RESYNC_MODES.delta
+                else METRICS.resyncs_full
+            )
+
+        # Send join room message
+        payload = serialize_join_room_response_message(
+            source.user.userid,
+            room.id,
+            room.name,
+            codec=source.codec,
+            requestid=_request_id.get(),
+            resync=resync,
+        )
+        await source.send(payload)
+
+        if frames is not None:
+            for payload in frames:
+                await source.send(payload)
             return
 
         if messages is None:
@@ -325,23 +1125,140 @@ class ChatServer(AbstractChatServer):
                 ERROR_TYPES.server_error, ERRORS.server_error, source
             )
 
-        if len(messages) == 0:
-            return
-
-        payload = serialize_chat_messages(messages)
-        await source.send(payload)
+        # Now send the recent or missed messages in the room
+        chunk_size = self.config.history_chunk_size
+        for start in range(0, len(messages), chunk_size):
+            payload = serialize_chat_messages(
+                messages[start : start + chunk_size], codec=source.codec
+            )
+            await source.send(payload)
+
+    def _room_history(self, room: Chatroom) -> RoomHistory | None:
+        """Returns the room's latest messages, read from the database once
+
+        Returns:
+            RoomHistory | None: None if config.room_history is off or the
+                database could not be read
+        """
+        if not self.config.room_history:
+            return None
+        history = room.history
+        if history is None:
+            history = RoomHistory(
+                self.config.history_page_size, self.config.history_chunk_size
+            )
+            room.history = history
+        if not history.loaded:
+            messages = self._db.get_room_messages_before(
+                room.id, None, self.config.history_page_size
+            )
+            if messages is None:
+                return None
+            history.load(messages)
+        return history
+
+    def _missed_frames(
+        self, history: RoomHistory, lastid: str, codec: str
+    ) -> List[str | bytes] | None:
+        """Returns chat frames of the kept messages after lastid
+
+        Returns:
+            List[str | bytes] | None: None if lastid is not kept or more
+                than config.resync_max_messages messages were missed
+        """
+        start = history.index_after(lastid)
+        if start is None or len(history) - start > self.config.resync_max_messages:
+            return None
+        self.metrics.increment(METRICS.resync_messages, len(history) - start)
+        return history.frames(codec, start)
+
+    def _missed_messages(
+        self, room: Chatroom, lastid: str
+    ) -> List[Dict[str, str]] | None:
+        """Returns the messages in room after lastid
+
+        Returns:
+            List[Dict[str, str]] | None: None if lastid is unknown or more
+                than config.resync_max_messages messages were missed
+        """
+        limit = self.config.resync_max_messages
+        try:
+            messages = self._db.get_room_messages_after(room.id, lastid, limit + 1)
+        except ConstraintError:
+            # Not a message in this room, e.g. the client switched servers
+            return None
+        if messages is None or len(messages) > limit:
+            return None
+        self.metrics.increment(METRICS.resync_messages, len(messages))
+        return messages
 
     async def handle_list_rooms(
         self, message: Dict[str, str], source: AbstractChatConnection
     ) -> None:
-        rooms: List[str] | None = None
-        rooms = self._db.get_room_list()
-        room_names: List[str] = ["Lobby"]
-        if rooms is not None and len(rooms) > 0:
-            room_names = [r.get("name") for r in rooms if r.get("name", None) != None]
+        self._refresh_room_directory()
+        directory = self.room_directory
+        codec = source.codec
+
+        # The client already has the current list, only the version is sent
+        if message.get(FIELDS_LIST_ROOMS_MESSAGE.version, None) == directory.version:
+            payload = directory.payload(
+                (codec, None),
+                lambda: serialize_list_rooms_message(
+                    None, codec=codec, version=directory.version
+                ),
+            )
+            return await source.send(
+                with_request_id(MESSAGE_TYPES.list_rooms, payload, _request_id.get())
+            )
 
-        payload = serialize_list_rooms_message(room_names)
-        await source.send(payload)
+        prefix, cursor, limit = _page_request(
+            message,
+            FIELDS_LIST_ROOMS_MESSAGE,
+            self.config.rooms_page_size,
+            self.config.rooms_max_page,
+        )
+
+        def encode() -> str | bytes:
+            # One extra name tells whether there is another page
+            names = directory.page(prefix, cursor, limit)
+            more = len(names) > limit
+            names = names[:limit]
+            return serialize_list_rooms_message(
+                names,
+                codec=codec,
+                cursor=names[-1] if len(names) > 0 else cursor,
+                version=directory.version,
+                more=more,
+            )
+
+        if len(cursor) == 0:
+            payload = directory.payload((codec, prefix, limit), encode)
+        else:
+            payload = encode()
+        await source.send(
+            with_request_id(MESSAGE_TYPES.list_rooms, payload, _request_id.get())
+        )
+
+    def _refresh_room_directory(self, force: bool = False) -> None:
+        """Adds rooms other processes created to the room directory
+
+        Other cores and cluster nodes create rooms in the shared database,
+        it is read again at most every config.rooms_refresh_interval.
+        """
+        interval = self.config.rooms_refresh_interval
+        now = time.monotonic()
+        if not force and (interval <= 0 or now - self._rooms_loaded < interval):
+            return
+        self._rooms_loaded = now
+        try:
+            rooms = self._db.get_room_list()
+        except DBConnectionError as e:
+            logging.error("Could not load the room list: %s", e)
+            return
+        for room in rooms or []:
+            name = room.get("name", None)
+            if name is not None:
+                self.room_directory.add(name)
 
     async def handle_list_users(
         self, message: Dict[str, str], source: AbstractChatConnection
@@ -358,24 +1275,46 @@ class ChatServer(AbstractChatServer):
                 ERROR_TYPES.room_not_found, f"Empty room", source
             )
 
-        usernames = [c.user.username for c in room.connections if c.user is not None]
-        payload = serialize_list_users_message(room.id, room.name, usernames)
-        await source.send(payload)
+        prefix, cursor, limit = _page_request(
+            message,
+            FIELDS_LIST_USERS_MESSAGE,
+            self.config.users_page_size,
+            self.config.users_max_page,
+        )
+
+        presence = room.presence
+        codec = source.codec
+
+        def encode() -> str | bytes:
+            # One extra name tells whether there is another page
+            usernames = presence.page(prefix, cursor, limit)
+            more = len(usernames) > limit
+            usernames = usernames[:limit]
+            return serialize_list_users_message(
+                room.id,
+                room.name,
+                usernames,
+                codec=codec,
+                cursor=usernames[-1] if len(usernames) > 0 else cursor,
+                version=presence.version,
+                more=more,
+            )
+
+        # The first pages are asked for most, keep them until members change
+        if len(cursor) == 0:
+            payload = presence.payload((codec, prefix, limit), encode)
+        else:
+            payload = encode()
+        await source.send(
+            with_request_id(MESSAGE_TYPES.list_users, payload, _request_id.get())
+        )
 
     async def handle_login(
         self, message: Dict[str, str], source: AbstractChatConnection
     ) -> None:
 
-        username = message.get(FIELDS_REGISTER_MESSAGE.username, "").strip()
-        password = message.get(FIELDS_REGISTER_MESSAGE.password, "").strip()
-
-        if len(username) == 0 or len(password) == 0:
-            logging.error("Missing field in register message: %s", e)
-            return await self.handle_error(
-                ERROR_TYPES.invalid_username_password,
-                ERRORS.invalid_username_password,
-                source,
-            )
+        username = message[FIELDS_REGISTER_MESSAGE.username].strip()
+        password = message[FIELDS_REGISTER_MESSAGE.password].strip()
 
         user: Dict[str, str] | None = None
 
@@ -398,13 +1337,21 @@ class ChatServer(AbstractChatServer):
 
         # Validate password
         pwhash = user["password"]
-        if not bcrypt.checkpw(password.encode(ENCODING), pwhash):
+        try:
+            valid = await self.passwords.check(password, pwhash)
+        except ServerBusyError as e:
+            return await self._handle_busy(e, source)
+        if not valid:
             return await self.handle_error(
                 ERROR_TYPES.invalid_username_password,
                 ERRORS.invalid_username_password,
                 source,
             )
 
+        # Lets the client resume the session after a reconnect without
+        # another password check, see handle_resume
+        token = self.sessions.issue(user["id"], user["username"])
+
         # ******************************
         # ******************************
         # ******************************
@@ -413,15 +1360,13 @@ class ChatServer(AbstractChatServer):
         # You may need to read the signature to know what to send
         # The room id and room name are for the lobby
         # Use the self.lobby object to find those
+        # Pass the session token above as token
         # ******************************
         # ******************************
         # ******************************
 
         await source.send(payload)
 
-        # Weird thing to do but messages can be batched together if sent too close in time
-        await asyncio.sleep(0.05)
-
         # put user in lobby
         await self._join_room(self.lobby, source)
 
@@ -431,13 +1376,6 @@ class ChatServer(AbstractChatServer):
         if message is None:
             return
 
-        userid = message.get(FIELDS_LOGOUT_MESSAGE.userid, "").strip()
-        if len(userid) == 0:
-            return
-
-        if source.user is not None and userid != source.user.userid:
-            return
-
         source.close()
         self.remove_connection(source)
 
@@ -445,19 +1383,15 @@ class ChatServer(AbstractChatServer):
         self, message: Dict[str, str], source: AbstractChatConnection
     ) -> None:
 
-        username = message.get(FIELDS_REGISTER_MESSAGE.username, "").strip()
-        password = message.get(FIELDS_REGISTER_MESSAGE.password, "").strip()
+        username = message[FIELDS_REGISTER_MESSAGE.username].strip()
+        password = message[FIELDS_REGISTER_MESSAGE.password].strip()
+        try:
+            pwhash = await self.passwords.hash(password)
+        except ServerBusyError as e:
+            return await self._handle_busy(e, source)
 
-        if len(username) == 0 or len(password) == 0:
-            logging.error("Missing field in register message: %s", e)
-            return await self.handle_error(
-                ERROR_TYPES.invalid_username_password,
-                ERRORS.invalid_username_password,
-                source,
-            )
         user: Dict[str, str] | None = None
         try:
-            pwhash = bcrypt.hashpw(password.encode(ENCODING), bcrypt.gensalt())
             user = self._db.insert_user(username, pwhash)
         except ConstraintError as e:
             logging.error("Error registering user: %s", e)
@@ -470,20 +1404,61 @@ class ChatServer(AbstractChatServer):
                 ERROR_TYPES.server_error, ERRORS.server_error, source
             )
 
-        payload = serialize_register_response_message(user["username"], "registered")
+        payload = serialize_register_response_message(
+            user["username"],
+            "registered",
+            codec=source.codec,
+            requestid=_request_id.get(),
+        )
+        await source.send(payload)
+
+    async def handle_resume(
+        self, message: Dict[str, Any], source: AbstractChatConnection
+    ) -> None:
+        token = message.get(FIELDS_RESUME_MESSAGE.token, "")
+        try:
+            userid, username = self.sessions.verify(token)
+        except InvalidTokenError as e:
+            logging.info("Rejected session resume: %s", e)
+            self.metrics.increment(METRICS.session_resumes_rejected)
+            return await self.handle_error(
+                ERROR_TYPES.invalid_session, ERRORS.invalid_session, source
+            )
+
+        # Rooms are dropped from memory once empty, the lobby always exists
+        roomid = message.get(FIELDS_RESUME_MESSAGE.roomid, "")
+        room = self.rooms.get(roomid, None)
+        lastid = message.get(FIELDS_RESUME_MESSAGE.lastid, None)
+        if room is None:
+            room, lastid = self.lobby, None
+
+        # A connection the user left behind is most likely half-open
+        previous = self.user_connections.get(userid, None)
+        if previous is not None and previous is not source:
+            previous.close()
+            # Closing it may have emptied the room and dropped it
+            self.rooms.setdefault(room.id, room)
+        source.user = User(userid=userid, username=username)
+        self.user_connections[userid] = source
+        self.metrics.increment(METRICS.sessions_resumed)
+
+        payload = serialize_resume_response_message(
+            userid,
+            username,
+            self.sessions.issue(userid, username),
+            codec=source.codec,
+            requestid=_request_id.get(),
+        )
         await source.send(payload)
 
+        await self._join_room(room, source, lastid)
+
     async def handle_unblock(self, message: Dict[str, str], source):
         if message is None:
             return
 
-        userid = message.get(FIELDS_UNBLOCK_MESSAGE.userid, "").strip()
-        username = message.get(FIELDS_UNBLOCK_MESSAGE.blocked_username, "").strip()
-
-        if len(userid) == 0 or len(username) == 0:
-            return await self.handle_error(
-                ERROR_TYPES.invalid_blacklist, ERRORS.invalid_blacklist, source
-            )
+        userid = message[FIELDS_UNBLOCK_MESSAGE.userid].strip()
+        username = message[FIELDS_UNBLOCK_MESSAGE.blocked_username].strip()
 
         # get userid
         blocked_user: Dict[str, str] | None = None
@@ -517,63 +1492,83 @@ class ChatServer(AbstractChatServer):
                 ERROR_TYPES.server_error, ERRORS.server_error, source
             )
 
-        payload = serialize_unblock_response_message(userid, username)
+        payload = serialize_unblock_response_message(
+            userid, username, codec=source.codec, requestid=_request_id.get()
+        )
         await source.send(payload)
 
     def add_connection(self, conn: ChatServerConnection) -> None:
         if conn not in self.connections:
-            self.connections.append(conn)
+            self.connections[conn] = None
 
     def remove_connection(self, conn: ChatServerConnection) -> None:
         # Removes from any room they are in and sets it to None
         conn.room = None
 
-        # remove from self.user_connections
-        if conn.user is not None and conn.user.userid is not None:
-            self.user_connections.pop(conn.user.userid, None)
+        # remove from self.user_connections, unless the user has resumed
+        # on another connection since
+        user = conn.user
+        if user is not None and self.user_connections.get(user.userid, None) is conn:
+            del self.user_connections[user.userid]
 
         # remove from connections
-        if conn in self.connections:
-            self.connections.remove(conn)
+        self.connections.pop(conn, None)
 
         self._cleanup_rooms()
 
-    def _cleanup_rooms(self) -> None:
-        removable: List[str] = []
-        for item in self.rooms.items():
-            id = item[0]
-            room = item[1]
-            if room.id == self.lobby.id:
-                continue
-            if len(room.connections) == 0:
-                removable.append(id)
+    def _cleanup_rooms(self) -> List[str]:
+        """Drops rooms left without members, the lobby is kept
 
-        for r in removable:
-            self.rooms.pop(r)
+        Returns:
+            List[str]: Ids of the rooms dropped
+        """
+        return self.rooms.drop_empty()
 
     def _create_proto(self) -> asyncio.BaseProtocol:
         proto = ChatServerConnection(parent=self)
         return proto
 
-    def start(self, host: str, port: int):
+    def _create_websocket_proto(self) -> asyncio.BaseProtocol:
+        return WebSocketConnection(parent=self)
+
+    def start(self, host: str, port: int, websocket_port: int | None = None):
         async def _run_server():
             loop = asyncio.get_event_loop()
 
             server = await loop.create_server(lambda: self._create_proto(), host, port)
             logging.info("Starting server at %s:%s", host, port)
 
+            # WebSocket clients share the rooms and users of TCP clients
+            websocket_server: asyncio.AbstractServer | None = None
+            if websocket_port is not None:
+                websocket_server = await loop.create_server(
+                    lambda: self._create_websocket_proto(), host, websocket_port
+                )
+                logging.info("Accepting WebSockets at %s:%s", host, websocket_port)
+
+            heartbeat: asyncio.Task | None = None
+            if self.config.heartbeat_interval > 0:
+                heartbeat = asyncio.create_task(self._heartbeat())
+
             async with server:
                 try:
                     await server.serve_forever()
                 except Exception as e:
                     logging.debug("Error: %s", e)
                 finally:
+                    if heartbeat is not None:
+                        heartbeat.cancel()
+                    if websocket_server is not None:
+                        websocket_server.close()
+                    self.passwords.close()
                     logging.info("Exiting server")
 
         asyncio.run(_run_server())
 
 
-def run_server(host: str = "127.0.0.1", port: int = 5001):
+def run_server(
+    host: str = "127.0.0.1", port: int = 5001, websocket_port: int | None = None
+):
     # Setup logger
     logging.basicConfig(filename="server.log", level=logging.DEBUG, filemode="w")
 
@@ -581,7 +1576,7 @@ def run_server(host: str = "127.0.0.1", port: int = 5001):
     db._initialize_database(drop=False)
     server = ChatServer(db=db)
     try:
-        server.start(host=host, port=port)
+        server.start(host=host, port=port, websocket_port=websocket_port)
     except KeyboardInterrupt as e:
         logging.debug("ctrl+c: %s", e)
 
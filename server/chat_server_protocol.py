@@ -1,16 +1,113 @@
 from __future__ import annotations
 from abc import ABC, abstractmethod
+from collections import deque, namedtuple
+from bisect import bisect_left, bisect_right, insort
+from collections.abc import MutableMapping
 import logging
-from typing import Any, Dict, List
-from common import User, ENCODING
+import time
+from typing import (
+    Any,
+    Callable,
+    Deque,
+    Dict,
+    Hashable,
+    Iterable,
+    Iterator,
+    List,
+    Set,
+    Tuple,
+)
+from common import (
+    CODECS,
+    COMPRESSIONS,
+    COMPRESSION_MIN_SIZE,
+    FIELDS_CHAT_MESSAGE,
+    MAX_FRAME_SIZE,
+    MESSAGE_TYPES,
+    User,
+    ENCODING,
+    encode_frame_buffers,
+    encode_list_item,
+    join_list_items,
+    transcode_message,
+)
 from .database_protocol import AbstractDatabase
 
+# Outbound frames are tagged with a kind so slow consumers can shed
+# room traffic before direct messages and control messages
+_frame_kinds = namedtuple("FRAME_KINDS", ["control", "direct", "room"])
+
+FRAME_KINDS = _frame_kinds(control="control", direct="direct", room="room")
+
+# Encoded list_users and list_rooms pages kept until the names change
+PRESENCE_CACHE_SIZE = 32
+# Sorts after every name starting with a prefix
+_PREFIX_END = chr(0x10FFFF)
+
+
+class SharedFrame:
+    """A message framed once per codec and shared by every recipient
+
+    Fan-out hands the same immutable header and payload buffers to every
+    member, so encoding cost does not grow with the number of members.
+    """
+
+    def __init__(self, message: str | bytes) -> None:
+        self._message = message
+        self._payloads: Dict[str, bytes] = {}
+        self._frames: Dict[Tuple[str, str], Tuple[bytes, bytes]] = {}
+
+    @property
+    def message(self) -> str | bytes:
+        """The message as it was given, in whatever codec it was encoded"""
+        return self._message
+
+    def frame(
+        self,
+        codec: str,
+        compression: str = COMPRESSIONS.none,
+        min_size: int = COMPRESSION_MIN_SIZE,
+    ) -> Tuple[bytes, bytes]:
+        """Returns the (header, payload) buffers for a codec and compression"""
+        key = (codec, compression)
+        frame = self._frames.get(key, None)
+        if frame is None:
+            frame = encode_frame_buffers(self.payload(codec), compression, min_size)
+            self._frames[key] = frame
+        return frame
+
+    def payload(self, codec: str) -> bytes:
+        """Returns the uncompressed payload for a codec"""
+        payload = self._payloads.get(codec, None)
+        if payload is None:
+            payload = transcode_message(self._message, codec)
+            if isinstance(payload, str):
+                payload = payload.encode(ENCODING)
+            self._payloads[codec] = payload
+        return payload
+
 
 class AbstractChatConnection(ABC):
     _is_closed: bool = False
     _room: Chatroom | None
     user: User | None
     conn: Any | None
+    # Codec and compression used for messages sent to this connection,
+    # chosen by the client in its hello message
+    codec: str = CODECS.json
+    compression: str = COMPRESSIONS.none
+    # Whether frames sent to this connection carry sequence numbers
+    sequenced: bool = False
+    # Protocol version both sides speak, the largest frame the client
+    # accepts and whether writes to it may be held back to coalesce them
+    version: int = 1
+    max_frame_size: int = MAX_FRAME_SIZE
+    batching: bool = True
+    # False when messages are not wrapped in chat frames, e.g. WebSocket
+    # messages, so frame features such as compression are not available
+    framed: bool = True
+    # time.monotonic() when data last arrived, heartbeats reap silent peers
+    last_received: float = 0.0
 
     def __init__(self, user: User | None, conn: Any) -> None:
         self.user = user
@@ -21,10 +118,40 @@ class AbstractChatConnection(ABC):
     def closed(self) -> bool:
         return self._is_closed
 
+    @property
+    def queued_frames(self) -> int:
+        return 0
+
+    @property
+    def queued_bytes(self) -> int:
+        return 0
+
     @abstractmethod
-    async def send(self, message: str) -> None:
+    async def send(self, message: str | bytes, kind: str = FRAME_KINDS.control) -> None:
+        pass
+
+    async def send_shared(
+        self, frame: SharedFrame, kind: str = FRAME_KINDS.control
+    ) -> None:
+        """Sends a frame that is shared with other connections"""
+        await self.send(frame.payload(self.codec), kind)
+
+    def acknowledge(self, sequence: int) -> None:
+        """Releases sequenced frames up to and including sequence"""
+        pass
+
+    def resend(self, first_sequence: int, last_sequence: int) -> None:
+        """Sends sequenced frames again after the client reported a gap"""
         pass
 
+    def ping(self, nonce: int) -> None:
+        """Sends a heartbeat the client answers with a pong"""
+        pass
+
+    def reap(self) -> None:
+        """Drops a connection that stopped answering heartbeats"""
+        self.close()
+
     @abstractmethod
     def close(self):
         pass
@@ -40,21 +167,224 @@ class AbstractChatConnection(ABC):
         self._room = room
 
 
+class NameIndex(ABC):
+    """Names kept in sorted order, paged by prefix and cursor
+
+    version changes whenever the names do, encoded pages are kept until
+    then.
+    """
+
+    def __init__(self, version: int = 0) -> None:
+        self.version: int = version
+        self._sorted: List[str] | None = None
+        self._payloads: Dict[Hashable, str | bytes] = {}
+
+    @property
+    def names(self) -> List[str]:
+        """The names in sorted order"""
+        if self._sorted is None:
+            self._sorted = sorted(self._names())
+        return self._sorted
+
+    def page(self, prefix: str = "", cursor: str = "", limit: int = 0) -> List[str]:
+        """Returns up to limit names starting with prefix, after cursor
+
+        Returns:
+            List[str]: One name more than limit when there are more
+        """
+        names = self.names
+        start = bisect_left(names, prefix) if len(prefix) > 0 else 0
+        if len(cursor) > 0:
+            start = max(start, bisect_right(names, cursor))
+        end = len(names)
+        if len(prefix) > 0:
+            end = bisect_left(names, prefix + _PREFIX_END, start)
+        return names[start : min(end, start + limit + 1)]
+
+    def payload(self, key: Hashable, encode: Callable[[], str | bytes]) -> str | bytes:
+        """Returns the payload kept under key, encoding it if there is none"""
+        payload = self._payloads.get(key, None)
+        if payload is None:
+            payload = encode()
+            if len(self._payloads) < PRESENCE_CACHE_SIZE:
+                self._payloads[key] = payload
+        return payload
+
+    @abstractmethod
+    def _names(self) -> Iterable[str]:
+        pass
+
+    def _changed(self) -> None:
+        self.version += 1
+        self._payloads = {}
+
+
+class Presence(NameIndex):
+    """Names of the signed in members of a room, updated as they come and go"""
+
+    def __init__(self) -> None:
+        super().__init__()
+        # Connections per name, a user may be in the room more than once
+        self._counts: Dict[str, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._counts)
+
+    def __contains__(self, username: object) -> bool:
+        return username in self._counts
+
+    @property
+    def usernames(self) -> List[str]:
+        return self.names
+
+    def add(self, username: str) -> None:
+        count = self._counts.get(username, 0)
+        self._counts[username] = count + 1
+        if count == 0:
+            if self._sorted is not None:
+                insort(self._sorted, username)
+            self._changed()
+
+    def remove(self, username: str) -> None:
+        count = self._counts.get(username, 0)
+        if count > 1:
+            self._counts[username] = count - 1
+        elif count == 1:
+            del self._counts[username]
+            if self._sorted is not None:
+                del self._sorted[bisect_left(self._sorted, username)]
+            self._changed()
+
+    def _names(self) -> Iterable[str]:
+        return self._counts
+
+
+class RoomDirectory(NameIndex):
+    """Names of every room, loaded once and added to as rooms are created
+
+    The version starts from the clock, so a version a client kept from
+    before a restart is not taken for the current one.
+    """
+
+    def __init__(self, names: Iterable[str] = ()) -> None:
+        super().__init__(version=time.time_ns() // 1_000_000)
+        self._set: Set[str] = set(names)
+
+    def __len__(self) -> int:
+        return len(self._set)
+
+    def __contains__(self, name: object) -> bool:
+        return name in self._set
+
+    def add(self, name: str) -> None:
+        if name in self._set:
+            return
+        self._set.add(name)
+        if self._sorted is not None:
+            insort(self._sorted, name)
+        self._changed()
+
+    def _names(self) -> Iterable[str]:
+        return self._set
+
+
+class RoomHistory:
+    """A room's latest messages, a bounded ring kept as messages arrive
+
+    Each message is encoded once per codec a member asked for, history
+    frames are joined from the encoded messages and kept until the next
+    message, so joining a warm room neither reads the database nor
+    encodes anything.
+    """
+
+    def __init__(self, capacity: int, chunk_size: int) -> None:
+        self.capacity = capacity
+        self.chunk_size = chunk_size
+        # False until filled from the database, new messages are only
+        # kept once it is, the database has them until then
+        self.loaded: bool = False
+        self._messages: Deque[Dict[str, Any]] = deque(maxlen=capacity)
+        self._encoded: Dict[str, Deque[str | bytes]] = {}
+        self._frames: Dict[str, List[str | bytes]] = {}
+
+    def __len__(self) -> int:
+        return len(self._messages)
+
+    def load(self, messages: List[Dict[str, Any]]) -> None:
+        """Replaces the messages kept with the latest page, oldest first"""
+        self._messages = deque(messages, maxlen=self.capacity)
+        self._encoded = {}
+        self._frames = {}
+        self.loaded = True
+
+    def append(self, messages: List[Dict[str, Any]]) -> None:
+        if not self.loaded:
+            return
+        self._messages.extend(messages)
+        for codec, encoded in self._encoded.items():
+            encoded.extend(
+                encode_list_item(MESSAGE_TYPES.chat, m, codec) for m in messages
+            )
+        self._frames = {}
+
+    def index_after(self, messageid: str) -> int | None:
+        """Returns the position after a message, None if it is not kept"""
+        for i, message in enumerate(reversed(self._messages)):
+            if message.get(FIELDS_CHAT_MESSAGE.id, None) == messageid:
+                return len(self._messages) - i
+        return None
+
+    def frames(self, codec: str, start: int = 0) -> List[str | bytes]:
+        """Returns chat frames of at most chunk_size messages, from start"""
+        if start == 0:
+            frames = self._frames.get(codec, None)
+            if frames is not None:
+                return frames
+        encoded = self._encoded.get(codec, None)
+        if encoded is None:
+            encoded = deque(
+                (
+                    encode_list_item(MESSAGE_TYPES.chat, m, codec)
+                    for m in self._messages
+                ),
+                maxlen=self.capacity,
+            )
+            self._encoded[codec] = encoded
+        items = list(encoded)[start:]
+        frames = [
+            join_list_items(MESSAGE_TYPES.chat, items[i : i + self.chunk_size], codec)
+            for i in range(0, len(items), self.chunk_size)
+        ]
+        if start == 0:
+            self._frames[codec] = frames
+        return frames
+
+
 class Chatroom:
-    connections: List[AbstractChatConnection]
+    # Members in the order they joined, with the name each joined as. A
+    # dict so membership is O(1)
+    connections: Dict[AbstractChatConnection, str | None]
+    presence: Presence
+    # Latest messages, None until the server keeps them for the room
+    history: RoomHistory | None = None
     id: str
     name: str
+    # Registry the room is in, told when the room empties or fills
+    registry: RoomRegistry | None = None
 
     def __init__(self, roomid: str, roomname: str) -> None:
         if roomid is None:
             raise ValueError("roomid can not be None")
         self.id = roomid
         self.name = roomname
-        self.connections = []
+        self.connections = {}
+        self.presence = Presence()
 
-    async def forward_to_room(self, message: str) -> None:
-        for connection in self.connections:
-            await connection.send(message)
+    async def forward_to_room(self, message: str | bytes | SharedFrame) -> None:
+        frame = message if isinstance(message, SharedFrame) else SharedFrame(message)
+        # Sending may close a slow member and remove it from the room
+        for connection in list(self.connections):
+            await connection.send_shared(frame, FRAME_KINDS.room)
 
     def join_room(self, conn: AbstractChatConnection) -> None:
         if conn.room is None or conn.room.id != self.id:
@@ -63,20 +393,107 @@ class Chatroom:
         if conn in self.connections:
             return
 
-        self.connections.append(conn)
+        username = conn.user.username if conn.user is not None else None
+        self.connections[conn] = username
+        if username is not None:
+            self.presence.add(username)
+        if len(self.connections) == 1 and self.registry is not None:
+            self.registry.occupied(self)
 
     def leave_room(self, conn: AbstractChatConnection) -> None:
         if conn not in self.connections:
             return
-        self.connections.remove(conn)
+        # The name it joined as, the user may have changed since
+        username = self.connections.pop(conn)
+        if username is not None:
+            self.presence.remove(username)
         conn.room = None
+        if len(self.connections) == 0 and self.registry is not None:
+            self.registry.emptied(self)
+
+
+class RoomRegistry(MutableMapping):
+    """Rooms in memory keyed by id, also found by name
+
+    Keeps the ids of rooms without members as they empty, so dropping
+    them does not walk every room.
+    """
+
+    def __init__(self) -> None:
+        self._by_id: Dict[str, Chatroom] = {}
+        self._by_name: Dict[str, Chatroom] = {}
+        self._empty: Set[str] = set()
+        # Rooms kept in memory while empty, e.g. the lobby
+        self._kept: Set[str] = set()
+
+    def __getitem__(self, roomid: str) -> Chatroom:
+        return self._by_id[roomid]
+
+    def __setitem__(self, roomid: str, room: Chatroom) -> None:
+        previous = self._by_id.get(roomid, None)
+        if previous is not None and previous is not room:
+            previous.registry = None
+            if self._by_name.get(previous.name, None) is previous:
+                del self._by_name[previous.name]
+        self._by_id[roomid] = room
+        self._by_name[room.name] = room
+        room.registry = self
+        if len(room.connections) == 0:
+            self.emptied(room)
+
+    def __delitem__(self, roomid: str) -> None:
+        room = self._by_id.pop(roomid)
+        if self._by_name.get(room.name, None) is room:
+            del self._by_name[room.name]
+        self._empty.discard(roomid)
+        self._kept.discard(roomid)
+        room.registry = None
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._by_id)
+
+    def __len__(self) -> int:
+        return len(self._by_id)
+
+    def __contains__(self, roomid: object) -> bool:
+        return roomid in self._by_id
+
+    def by_name(self, name: str) -> Chatroom | None:
+        return self._by_name.get(name, None)
+
+    def keep(self, roomid: str) -> None:
+        """Keeps a room in memory while it has no members"""
+        self._kept.add(roomid)
+        self._empty.discard(roomid)
+
+    def occupied(self, room: Chatroom) -> None:
+        self._empty.discard(room.id)
+
+    def emptied(self, room: Chatroom) -> None:
+        if room.id not in self._kept and self._by_id.get(room.id, None) is room:
+            self._empty.add(room.id)
+
+    def drop_empty(self) -> List[str]:
+        """Removes the rooms that have no members
+
+        Returns:
+            List[str]: Ids of the rooms removed
+        """
+        if len(self._empty) == 0:
+            return []
+        # A fresh set, a drained one keeps its size and is slow to walk
+        dropped, self._empty = list(self._empty), set()
+        for roomid in dropped:
+            del self[roomid]
+        return dropped
 
 
 class AbstractChatServer(ABC):
 
-    connections: List[AbstractChatConnection] | None = None
+    # Connections in the order they arrived, a dict so membership is O(1)
+    connections: Dict[AbstractChatConnection, None] | None = None
     user_connections: Dict[str, AbstractChatConnection] | None = None
-    rooms: Dict[str, Chatroom] | None = None
+    rooms: RoomRegistry | None = None
     lobby: Chatroom | None = None
     _db: AbstractDatabase | None = None
 
@@ -84,9 +501,9 @@ class AbstractChatServer(ABC):
         if db is None:
             raise ValueError("Database can not be None")
         self._db = db
-        self.rooms = {}
+        self.rooms = RoomRegistry()
         self.user_connections = {}
-        self.connections = []
+        self.connections = {}
 
         lobby_data: Dict[str, str] | None = None
 
@@ -101,6 +518,7 @@ class AbstractChatServer(ABC):
 
         self.lobby = Chatroom(lobby_data["id"], lobby_data["name"])
         self.rooms[lobby_data["id"]] = self.lobby
+        self.rooms.keep(self.lobby.id)
 
         super().__init__()
 
@@ -111,7 +529,12 @@ class AbstractChatServer(ABC):
         pass
 
     @abstractmethod
-    async def forward_to_room(self, message: Dict[str, str], roomid: str) -> None:
+    async def forward_to_room(
+        self,
+        message: Dict[str, str],
+        roomid: str,
+        messages: List[Dict[str, Any]] | None = None,
+    ) -> None:
         pass
 
     @abstractmethod
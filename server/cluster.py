@@ -0,0 +1,496 @@
+"""Cluster mode: several ChatServer nodes serving the same rooms
+
+Every node accepts clients and runs the handlers itself. Room messages are
+delivered to the node's own members and published to a broker, which
+passes them to the other nodes with members in the room. The broker also
+knows the node holding each signed in user, so direct messages reach users
+connected elsewhere.
+
+The broker process here is the reference AbstractBroker. Its operations
+are JSON arrays in chat frames over TCP. A node must first answer the
+broker's challenge with an HMAC of it keyed with the cluster secret, the
+broker closes links that do not. Nodes are expected to share one
+database, and a session_secret so a client can resume on any node.
+"""
+
+from __future__ import annotations
+import asyncio
+import hashlib
+import hmac
+import json
+import logging
+import os
+from collections import namedtuple
+from typing import Any, Dict, List, Set, Tuple
+
+from .broker_protocol import AbstractBroker
+from .chat_server import (
+    ChatServer,
+    ChatServerConnection,
+    WebSocketConnection,
+)
+from .chat_server_protocol import AbstractChatConnection, Chatroom, SharedFrame
+from .database_protocol import AbstractDatabase
+from .frontends import LinkProtocol
+from .server_config import ServerConfig
+from .session_tokens import InvalidTokenError
+from .sqlite_database import SqliteDatabase
+from common import (
+    CODECS,
+    ENCODING,
+    FIELDS_CHAT_MESSAGES,
+    FIELDS_RESUME_MESSAGE,
+    MESSAGE_TYPE,
+    MESSAGE_TYPES,
+    decode_message,
+    encode_frame,
+)
+
+# Operations between a node and the broker. Node to broker: auth (mac),
+# subscribe (roomid), unsubscribe (roomid), publish (roomid, message),
+# locate (userid), forget (userid), direct (userid, message) and kick
+# (userid). Broker to node: challenge (nonce), then publish, direct and
+# kick with the same arguments. Messages are JSON text.
+_broker_ops = namedtuple(
+    "BROKER_OPS",
+    [
+        "subscribe",
+        "unsubscribe",
+        "publish",
+        "locate",
+        "forget",
+        "direct",
+        "kick",
+        "challenge",
+        "auth",
+    ],
+)
+
+BROKER_OPS = _broker_ops(
+    subscribe=0,
+    unsubscribe=1,
+    publish=2,
+    locate=3,
+    forget=4,
+    direct=5,
+    kick=6,
+    challenge=7,
+    auth=8,
+)
+
+# Random bytes in the broker's challenge
+CHALLENGE_SIZE = 32
+
+# How a chat message published as JSON starts, the type is encoded first
+_CHAT_PREFIX = json.dumps({MESSAGE_TYPE: MESSAGE_TYPES.chat})[:-1] + ","
+
+
+def encode_broker_op(op: int, *args: Any) -> bytes:
+    """Packs an operation once, to send it to several nodes"""
+    return encode_frame(json.dumps([op, *args]).encode(ENCODING))
+
+
+def sign_challenge(secret: bytes, nonce: str) -> str:
+    return hmac.new(secret, nonce.encode(ENCODING), hashlib.sha256).hexdigest()
+
+
+def _broker_message(message: str | bytes | SharedFrame) -> str:
+    # Binary messages are sent on as JSON, the broker only carries text
+    frame = message if isinstance(message, SharedFrame) else SharedFrame(message)
+    return frame.payload(CODECS.json).decode(ENCODING)
+
+
+def _chat_messages(message: str | bytes) -> List[Dict[str, Any]] | None:
+    # Only chat messages are decoded, for the room history. Messages from
+    # the broker are JSON text
+    if not isinstance(message, str) or not message.startswith(_CHAT_PREFIX):
+        return None
+    try:
+        messages = decode_message(message).get(FIELDS_CHAT_MESSAGES.messages, None)
+    except ValueError:
+        return None
+    return messages if isinstance(messages, list) else None
+
+
+class BrokerProtocol(LinkProtocol):
+    """A link between a node and the broker, with JSON operations"""
+
+    def encode_op(self, op: int, *args: Any) -> bytes:
+        return encode_broker_op(op, *args)
+
+    def decode_op(self, payload: bytes) -> Tuple[Any, ...]:
+        op = json.loads(payload)
+        if not isinstance(op, list) or len(op) == 0:
+            raise ValueError("Broker operations are JSON arrays")
+        return tuple(op)
+
+
+class Broker:
+    """The rooms each node subscribed to and the node holding each user
+
+    Args:
+        secret (bytes): Key nodes prove they have before they are served.
+    """
+
+    def __init__(self, secret: bytes) -> None:
+        if not secret:
+            raise ValueError("secret can not be empty")
+        self.secret = secret
+        self.subscribers: Dict[str, Set[BrokerLink]] = {}
+        self.directory: Dict[str, BrokerLink] = {}
+
+    def link(self) -> BrokerLink:
+        return BrokerLink(self)
+
+
+class BrokerLink(BrokerProtocol):
+    """The broker's end of the link to one node"""
+
+    def __init__(self, broker: Broker) -> None:
+        super().__init__()
+        self.broker = broker
+        self.rooms: Set[str] = set()
+        self.authenticated = False
+        self._challenge = os.urandom(CHALLENGE_SIZE).hex()
+
+    def connection_made(self, transport: asyncio.Transport) -> None:
+        super().connection_made(transport)
+        self.send_op(BROKER_OPS.challenge, self._challenge)
+
+    def handle_op(self, op: int, *args: Any) -> None:
+        if not self.authenticated:
+            return self._authenticate(op, *args)
+        # Keys of the broker's dicts and sets
+        if len(args) == 0 or not isinstance(args[0], str):
+            raise ValueError(f"Invalid arguments for broker operation {op}")
+
+        broker = self.broker
+        if op == BROKER_OPS.publish:
+            roomid, _ = args
+            # Packed once however many nodes have members in the room
+            frame = encode_broker_op(BROKER_OPS.publish, *args)
+            for link in broker.subscribers.get(roomid, ()):
+                if link is not self:
+                    link.send_frame(frame)
+        elif op == BROKER_OPS.subscribe:
+            (roomid,) = args
+            broker.subscribers.setdefault(roomid, set()).add(self)
+            self.rooms.add(roomid)
+        elif op == BROKER_OPS.unsubscribe:
+            (roomid,) = args
+            self._unsubscribe(roomid)
+        elif op == BROKER_OPS.locate:
+            (userid,) = args
+            broker.directory[userid] = self
+        elif op == BROKER_OPS.forget:
+            # The user may already be located at the node it moved to
+            (userid,) = args
+            if broker.directory.get(userid, None) is self:
+                del broker.directory[userid]
+        elif op == BROKER_OPS.direct:
+            userid, _ = args
+            link = broker.directory.get(userid, None)
+            if link is not None:
+                link.send_op(BROKER_OPS.direct, *args)
+        elif op == BROKER_OPS.kick:
+            (userid,) = args
+            link = broker.directory.get(userid, None)
+            if link is not None and link is not self:
+                link.send_op(BROKER_OPS.kick, userid)
+
+    def _authenticate(self, op: int, *args: Any) -> None:
+        expected = sign_challenge(self.broker.secret, self._challenge)
+        if (
+            op == BROKER_OPS.auth
+            and len(args) == 1
+            and isinstance(args[0], str)
+            and hmac.compare_digest(args[0].encode(ENCODING), expected.encode())
+        ):
+            self.authenticated = True
+            return
+        peername = self.transport.get_extra_info("peername")
+        logging.error("Node %s failed to authenticate, closing link", peername)
+        self.transport.close()
+
+    def _unsubscribe(self, roomid: str) -> None:
+        self.rooms.discard(roomid)
+        links = self.broker.subscribers.get(roomid, None)
+        if links is None:
+            return
+        links.discard(self)
+        if len(links) == 0:
+            del self.broker.subscribers[roomid]
+
+    def connection_lost(self, exc: Exception | None) -> None:
+        # The node's members and users went with it
+        logging.info("Lost node with %s rooms: %s", len(self.rooms), exc)
+        for roomid in list(self.rooms):
+            self._unsubscribe(roomid)
+        directory = self.broker.directory
+        for userid in [u for u, link in directory.items() if link is self]:
+            del directory[userid]
+
+
+class BrokerClient(BrokerProtocol, AbstractBroker):
+    """A node's link to the broker process
+
+    Operations are held back until the broker's challenge is answered.
+    """
+
+    def __init__(self, node: ClusterServer) -> None:
+        super().__init__()
+        self.node = node
+        self.lost: asyncio.Future = asyncio.get_running_loop().create_future()
+        self._secret: bytes = node.config.cluster_secret
+        self._held: List[bytes] | None = []
+
+    def send_frame(self, frame: bytes) -> None:
+        if self._held is not None:
+            self._held.append(frame)
+        else:
+            super().send_frame(frame)
+
+    def subscribe(self, roomid: str) -> None:
+        self.send_op(BROKER_OPS.subscribe, roomid)
+
+    def unsubscribe(self, roomid: str) -> None:
+        self.send_op(BROKER_OPS.unsubscribe, roomid)
+
+    def publish(self, roomid: str, message: str | bytes) -> None:
+        self.send_op(BROKER_OPS.publish, roomid, message)
+
+    def locate(self, userid: str) -> None:
+        self.send_op(BROKER_OPS.locate, userid)
+
+    def forget(self, userid: str) -> None:
+        self.send_op(BROKER_OPS.forget, userid)
+
+    def send_to_user(self, userid: str, message: str | bytes) -> None:
+        self.send_op(BROKER_OPS.direct, userid, message)
+
+    def kick(self, userid: str) -> None:
+        self.send_op(BROKER_OPS.kick, userid)
+
+    def close(self) -> None:
+        if self.transport is not None:
+            self.transport.close()
+
+    def handle_op(self, op: int, *args: Any) -> None:
+        if op == BROKER_OPS.challenge:
+            (nonce,) = args
+            if self._held is None or not isinstance(nonce, str):
+                raise ValueError("Unexpected challenge from the broker")
+            held, self._held = self._held, None
+            self.send_op(BROKER_OPS.auth, sign_challenge(self._secret, nonce))
+            for frame in held:
+                self.send_frame(frame)
+        elif op == BROKER_OPS.publish:
+            roomid, message = args
+            asyncio.create_task(self.node.deliver_to_room(message, roomid))
+        elif op == BROKER_OPS.direct:
+            userid, message = args
+            asyncio.create_task(self.node.deliver_to_user(message, userid))
+        elif op == BROKER_OPS.kick:
+            (userid,) = args
+            self.node.kick_user(userid)
+
+    def connection_lost(self, exc: Exception | None) -> None:
+        logging.error("Lost connection to the broker: %s", exc)
+        if not self.lost.done():
+            self.lost.set_result(None)
+
+
+class ClusterServer(ChatServer):
+    """ChatServer that shares its rooms and users with other nodes
+
+    Rooms are subscribed to while they have members here and users
+    located while their connection is held here.
+    """
+
+    def __init__(
+        self, db: AbstractDatabase, config: ServerConfig | None = None
+    ) -> None:
+        super().__init__(db=db, config=config)
+        if not self.config.cluster_secret:
+            raise ValueError("config.cluster_secret is required for a cluster node")
+        self.broker: AbstractBroker | None = None
+        self._subscribed: Set[str] = set()
+        self._located: Set[str] = set()
+
+    async def forward_to_room(
+        self,
+        message: str | bytes | SharedFrame,
+        roomid: str,
+        messages: List[Dict[str, Any]] | None = None,
+    ) -> None:
+        if self.broker is not None:
+            frame = (
+                message if isinstance(message, SharedFrame) else SharedFrame(message)
+            )
+            self.broker.publish(roomid, _broker_message(frame))
+            message = frame
+        await super().forward_to_room(message, roomid, messages)
+
+    async def forward_to_user(
+        self, message: str | bytes | SharedFrame, userid: str
+    ) -> None:
+        if self.broker is None or userid in self.user_connections:
+            return await super().forward_to_user(message, userid)
+        self.broker.send_to_user(userid, _broker_message(message))
+
+    async def deliver_to_room(self, message: str | bytes, roomid: str) -> None:
+        """Sends a message published by another node to members held here"""
+        messages: List[Dict[str, Any]] | None = None
+        room = self.rooms.get(roomid, None)
+        if room is not None and room.history is not None and room.history.loaded:
+            messages = _chat_messages(message)
+        await super().forward_to_room(message, roomid, messages)
+
+    async def deliver_to_user(self, message: str | bytes, userid: str) -> None:
+        """Sends a direct message from another node to a user held here"""
+        await super().forward_to_user(message, userid)
+
+    def kick_user(self, userid: str) -> None:
+        """Closes a user's connection after they resumed on another node"""
+        connection = self.user_connections.get(userid, None)
+        if connection is not None:
+            connection.close()
+
+    async def handle_resume(
+        self, message: Dict[str, Any], source: AbstractChatConnection
+    ) -> None:
+        # The connection left behind may be held by another node
+        if self.broker is not None:
+            try:
+                userid, _ = self.sessions.verify(
+                    message.get(FIELDS_RESUME_MESSAGE.token, "")
+                )
+            except InvalidTokenError:
+                userid = None
+            if userid is not None and userid not in self.user_connections:
+                self.broker.kick(userid)
+        await super().handle_resume(message, source)
+
+    async def _join_room(
+        self,
+        room: Chatroom,
+        source: AbstractChatConnection,
+        lastid: str | None = None,
+    ):
+        # Signing in always ends with joining a room
+        if self.broker is not None:
+            if room.id not in self._subscribed:
+                self._subscribed.add(room.id)
+                self.broker.subscribe(room.id)
+            user = source.user
+            if user is not None and user.userid not in self._located:
+                self._located.add(user.userid)
+                self.broker.locate(user.userid)
+        await super()._join_room(room, source, lastid)
+
+    def remove_connection(self, conn: ChatServerConnection) -> None:
+        user = conn.user
+        if (
+            self.broker is not None
+            and user is not None
+            and self.user_connections.get(user.userid, None) is conn
+        ):
+            self._located.discard(user.userid)
+            self.broker.forget(user.userid)
+        super().remove_connection(conn)
+
+    def _cleanup_rooms(self) -> List[str]:
+        dropped = super()._cleanup_rooms()
+        if self.broker is None:
+            return dropped
+        for roomid in dropped:
+            if roomid in self._subscribed:
+                self._subscribed.discard(roomid)
+                self.broker.unsubscribe(roomid)
+        # The lobby stays in memory without members
+        lobby = self.lobby
+        if lobby.id in self._subscribed and len(lobby.connections) == 0:
+            self._subscribed.discard(lobby.id)
+            self.broker.unsubscribe(lobby.id)
+        return dropped
+
+
+async def serve_broker(host: str, port: int, secret: bytes) -> None:
+    broker = Broker(secret)
+    loop = asyncio.get_running_loop()
+    server = await loop.create_server(broker.link, host, port)
+    logging.info("Broker listening on %s:%s", host, port)
+    async with server:
+        await server.serve_forever()
+
+
+async def serve_node(
+    host: str,
+    port: int,
+    broker_host: str,
+    broker_port: int,
+    websocket_port: int | None = None,
+    db_name: str | None = None,
+    config: ServerConfig | None = None,
+) -> None:
+    db = SqliteDatabase() if db_name is None else SqliteDatabase(db_name=db_name)
+    db._initialize_database(drop=False)
+    node = ClusterServer(db=db, config=config)
+    loop = asyncio.get_running_loop()
+    _, node.broker = await loop.create_connection(
+        lambda: BrokerClient(node), broker_host, broker_port
+    )
+
+    servers = [await loop.create_server(node._create_proto, host, port)]
+    if websocket_port is not None:
+        servers.append(
+            await loop.create_server(
+                lambda: WebSocketConnection(parent=node), host, websocket_port
+            )
+        )
+    logging.info("Node serving %s:%s", host, port)
+
+    heartbeat: asyncio.Task | None = None
+    if node.config.heartbeat_interval > 0:
+        heartbeat = asyncio.create_task(node._heartbeat())
+    try:
+        # Without the broker this node would hold a split of every room
+        await node.broker.lost
+    finally:
+        if heartbeat is not None:
+            heartbeat.cancel()
+        for server in servers:
+            server.close()
+        for connection in list(node.connections):
+            connection.close()
+        node.passwords.close()
+
+
+def run_broker(secret: bytes, host: str = "127.0.0.1", port: int = 5100):
+    """Runs the broker until interrupted, nodes must know secret"""
+    logging.basicConfig(filename="broker.log", level=logging.DEBUG, filemode="w")
+    try:
+        asyncio.run(serve_broker(host, port, secret))
+    except KeyboardInterrupt as e:
+        logging.debug("ctrl+c: %s", e)
+
+
+def run_cluster_node(
+    host: str = "127.0.0.1",
+    port: int = 5001,
+    broker_host: str = "127.0.0.1",
+    broker_port: int = 5100,
+    websocket_port: int | None = None,
+    db_name: str | None = None,
+    config: ServerConfig | None = None,
+):
+    """Runs a node of a cluster until interrupted or the broker goes away"""
+    logging.basicConfig(filename="server.log", level=logging.DEBUG, filemode="w")
+    try:
+        asyncio.run(
+            serve_node(
+                host, port, broker_host, broker_port, websocket_port, db_name, config
+            )
+        )
+    except KeyboardInterrupt as e:
+        logging.debug("ctrl+c: %s", e)
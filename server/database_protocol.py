@@ -55,6 +55,25 @@ class AbstractDatabase(ABC):
     ) -> List[Dict[str, str]] | None:
         pass
 
+    @abstractmethod
+    def get_room_messages_before(
+        self, roomid: str, before: str | None = None, limit: int = 30
+    ) -> List[Dict[str, str]] | None:
+        """Returns up to limit messages older than the message with id before,
+        or the latest messages if before is None, oldest first. Raises
+        ConstraintError if before is not in the room.
+        """
+        pass
+
+    @abstractmethod
+    def get_room_messages_after(
+        self, roomid: str, after: str, limit: int = 30
+    ) -> List[Dict[str, str]] | None:
+        """Returns up to limit messages newer than the message with id after,
+        oldest first. Raises ConstraintError if after is not in the room.
+        """
+        pass
+
     @abstractmethod
     def get_user_by_username(self, username: str) -> Dict[str, str] | None:
         pass
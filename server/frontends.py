@@ -0,0 +1,860 @@
+"""Multi-process server: frontend workers own the sockets, cores own state
+
+Frontends accept clients on a port shared with SO_REUSEPORT. They do the
+per-connection work: framing, compression, message decoding, sequencing,
+write batching and heartbeats. Every other message is forwarded, already
+decoded, over a Unix socket to a core process, which runs the ChatServer
+handlers. A supervisor restarts workers that exit.
+
+With one core, rooms and user_connections stay in one process. With
+several, rooms are partitioned across the cores by shard_for_room and
+each core has its own event loop and database connection. Frontends send
+every message to the core owning the room it is about, moving the
+connection between cores as the user changes rooms. A bus process keeps
+the core each signed in user is held by, so direct messages and session
+resumes reach users on another core.
+"""
+
+from __future__ import annotations
+import asyncio
+import copy
+import logging
+import marshal
+import multiprocessing
+import os
+import signal
+import tempfile
+import time
+import zlib
+from collections import namedtuple
+from multiprocessing.connection import wait
+from typing import Any, Callable, Dict, List, Set, Tuple
+
+from .chat_server import (
+    ChatServer,
+    ChatServerConnection,
+    ConnectionHandlers,
+    WebSocketConnection,
+)
+from .handlers import HandlerRegistry
+from .chat_server_protocol import (
+    FRAME_KINDS,
+    AbstractChatConnection,
+    Chatroom,
+    SharedFrame,
+)
+from .database_protocol import AbstractDatabase
+from .metrics import ServerMetrics
+from .server_config import ServerConfig
+from .session_tokens import InvalidTokenError
+from .sqlite_database import SqliteDatabase
+from common import (
+    ENCODING,
+    FIELDS_CREATE_ROOM_MESSAGE,
+    FIELDS_HISTORY_MESSAGE,
+    FIELDS_JOIN_ROOM_MESSAGE,
+    FIELDS_LIST_USERS_MESSAGE,
+    FIELDS_RESUME_MESSAGE,
+    MESSAGE_TYPE,
+    MESSAGE_TYPES,
+    FrameDecoder,
+    FrameError,
+    User,
+    encode_frame,
+)
+
+# Operations sent over the Unix socket between a frontend and a core.
+# Frontend to core: message (connid, codec, user, message) and closed
+# (connid), where user is (userid, username) for a connection that signed
+# in on another core. Core to frontend: send (connid, kind, payload),
+# shared (kind, connids, message), close (connid), user (connid, (userid,
+# username) or None) and room (roomid, in_memory). shared carries a
+# message sent to several connections of the frontend, e.g. room fan-out.
+_link_ops = namedtuple(
+    "LINK_OPS", ["message", "closed", "send", "close", "user", "room", "shared"]
+)
+
+LINK_OPS = _link_ops(message=0, closed=1, send=2, close=3, user=4, room=5, shared=6)
+
+# Operations sent over the Unix socket between a core and the bus.
+# Core to bus: hello (shard), online (userid, shard), offline (userid,
+# shard), direct (userid, message) and kick (userid, shard). Bus to core:
+# direct (userid, message) and kick (userid).
+_bus_ops = namedtuple("BUS_OPS", ["hello", "online", "offline", "direct", "kick"])
+
+BUS_OPS = _bus_ops(hello=0, online=1, offline=2, direct=3, kick=4)
+
+# A history page for a whole room can be larger than a client frame
+LINK_MAX_FRAME_SIZE = 64 * 1024 * 1024
+# Seconds a process waits for the socket of a core or the bus to appear
+CORE_CONNECT_TIMEOUT = 10.0
+# Seconds the supervisor waits before restarting a worker that exited
+RESTART_DELAY = 1.0
+# Room users land in after signing in
+LOBBY_NAME = "Lobby"
+
+
+def shard_for_room(roomname: str, shards: int) -> int:
+    """The core that owns a room, the same in every process"""
+    if shards == 1:
+        return 0
+    return zlib.crc32(roomname.encode(ENCODING)) % shards
+
+
+def encode_link_op(op: int, *args: Any) -> bytes:
+    """Packs an operation once, to send it over several links"""
+    return encode_frame(marshal.dumps((op, *args)))
+
+
+class LinkProtocol(asyncio.Protocol):
+    """One end of a Unix socket between the server's processes
+
+    Operations are tuples packed with marshal, which is not safe for
+    untrusted input, so it is only used on Unix sockets between processes
+    of the same server. Links reachable over a network override encode_op
+    and decode_op. Operations sent in the same event loop tick go out in
+    one write.
+    """
+
+    def __init__(self) -> None:
+        self.transport: asyncio.Transport | None = None
+        self._decoder = FrameDecoder(max_frame_size=LINK_MAX_FRAME_SIZE)
+        self._pending: List[bytes] = []
+        self._flush_handle: asyncio.Handle | None = None
+
+    def connection_made(self, transport: asyncio.Transport) -> None:
+        self.transport = transport
+
+    def data_received(self, data: bytes) -> None:
+        try:
+            payloads = self._decoder.feed(data)
+        except FrameError as e:
+            logging.error("Invalid link frame, closing link: %s", e)
+            return self.transport.close()
+
+        for payload in payloads:
+            try:
+                op, *args = self.decode_op(payload)
+                self.handle_op(op, *args)
+            except (EOFError, TypeError, ValueError) as e:
+                logging.error("Invalid link operation, closing link: %s", e)
+                return self.transport.close()
+
+    def handle_op(self, op: int, *args: Any) -> None:
+        pass
+
+    def encode_op(self, op: int, *args: Any) -> bytes:
+        return encode_link_op(op, *args)
+
+    def decode_op(self, payload: bytes) -> Tuple[Any, ...]:
+        return marshal.loads(payload)
+
+    def send_op(self, op: int, *args: Any) -> None:
+        self.send_frame(self.encode_op(op, *args))
+
+    def send_frame(self, frame: bytes) -> None:
+        """Sends an operation already packed by encode_op"""
+        if self.transport is None or self.transport.is_closing():
+            return
+        self._pending.append(frame)
+        if self._flush_handle is None:
+            self._flush_handle = asyncio.get_running_loop().call_soon(self.flush)
+
+    def flush(self) -> None:
+        self._flush_handle = None
+        if len(self._pending) == 0 or self.transport.is_closing():
+            return
+        self.transport.writelines(self._pending)
+        self._pending = []
+
+
+class ShardServer(ChatServer):
+    """ChatServer run by a core, owning every room or one shard of them
+
+    Tells frontends which rooms it holds, and the bus which users, so
+    direct messages and session resumes reach users held by another core.
+
+    Args:
+        shard (int): Index of this core among the cores.
+    """
+
+    def __init__(
+        self, db: AbstractDatabase, config: ServerConfig | None = None, shard: int = 0
+    ) -> None:
+        super().__init__(db=db, config=config)
+        self.shard = shard
+        self.bus: BusClient | None = None
+        self.links: List[CoreLink] = []
+        # Rooms in memory that frontends were told about
+        self._announced: Set[str] = set()
+
+    def announce(self, roomid: str) -> None:
+        """Tells every frontend that a room is in memory on this core"""
+        if roomid in self._announced:
+            return
+        self._announced.add(roomid)
+        for link in self.links:
+            link.send_op(LINK_OPS.room, roomid, True)
+
+    def user_online(self, userid: str) -> None:
+        if self.bus is not None:
+            self.bus.send_op(BUS_OPS.online, userid, self.shard)
+
+    def user_offline(self, userid: str) -> None:
+        if self.bus is not None:
+            self.bus.send_op(BUS_OPS.offline, userid, self.shard)
+
+    async def forward_to_user(
+        self, message: str | bytes | SharedFrame, userid: str
+    ) -> None:
+        if self.bus is None or userid in self.user_connections:
+            return await super().forward_to_user(message, userid)
+        if isinstance(message, SharedFrame):
+            message = message.message
+        self.bus.send_op(BUS_OPS.direct, userid, message)
+
+    async def deliver(self, message: str | bytes, userid: str) -> None:
+        """Sends a direct message from another core to a user held here"""
+        await super().forward_to_user(message, userid)
+
+    async def handle_resume(
+        self, message: Dict[str, Any], source: AbstractChatConnection
+    ) -> None:
+        # The connection left behind may be held by another core
+        if self.bus is not None:
+            try:
+                userid, _ = self.sessions.verify(
+                    message.get(FIELDS_RESUME_MESSAGE.token, "")
+                )
+            except InvalidTokenError:
+                userid = None
+            if userid is not None and userid not in self.user_connections:
+                self.bus.send_op(BUS_OPS.kick, userid, self.shard)
+        await super().handle_resume(message, source)
+
+    def _cleanup_rooms(self) -> List[str]:
+        dropped = super()._cleanup_rooms()
+        for roomid in dropped:
+            if roomid not in self._announced:
+                continue
+            self._announced.discard(roomid)
+            for link in self.links:
+                link.send_op(LINK_OPS.room, roomid, False)
+        return dropped
+
+
+class ProxyConnection(AbstractChatConnection):
+    """The core's stand-in for a client connection held by a frontend"""
+
+    def __init__(self, link: CoreLink, connid: int, user: User | None = None) -> None:
+        self.link = link
+        self.connid = connid
+        self._user = user
+        super().__init__(user, None)
+
+    @property
+    def user(self) -> User | None:
+        return self._user
+
+    @user.setter
+    def user(self, user: User | None):
+        if user is self._user:
+            return
+        previous, self._user = self._user, user
+        self.link.user_changed(self, previous)
+
+    @AbstractChatConnection.room.setter
+    def room(self, room: Chatroom | None):
+        AbstractChatConnection.room.fset(self, room)
+        if room is not None:
+            self.link.server.announce(room.id)
+
+    async def send(self, payload: str | bytes, kind: str = FRAME_KINDS.control) -> None:
+        if payload is None or self.closed:
+            return
+        self.link.send_op(LINK_OPS.send, self.connid, kind, payload)
+
+    async def send_shared(
+        self, frame: SharedFrame, kind: str = FRAME_KINDS.control
+    ) -> None:
+        if self.closed:
+            return
+        self.link.send_shared(frame, kind, self.connid)
+
+    def close(self):
+        if self.closed:
+            return
+        self.link.send_op(LINK_OPS.close, self.connid)
+        self.link.drop(self)
+
+
+class CoreLink(LinkProtocol):
+    """The core's end of the link to one frontend"""
+
+    def __init__(self, server: ShardServer) -> None:
+        super().__init__()
+        self.server = server
+        self._proxies: Dict[int, ProxyConnection] = {}
+        # Frames shared this tick, with their place among the pending ops
+        self._shared: Dict[SharedFrame, Tuple[int, str, List[int]]] = {}
+
+    def connection_made(self, transport: asyncio.Transport) -> None:
+        super().connection_made(transport)
+        self.server.links.append(self)
+        for roomid in self.server._announced:
+            self.send_op(LINK_OPS.room, roomid, True)
+
+    def handle_op(self, op: int, *args: Any) -> None:
+        if op == LINK_OPS.message:
+            connid, codec, user, message = args
+            proxy = self._proxies.get(connid, None)
+            if proxy is None:
+                proxy = self._open(connid, user)
+            # Replies are encoded with the codec the frontend negotiated
+            proxy.codec = codec
+            asyncio.create_task(self.server.handle_message(message, proxy))
+        elif op == LINK_OPS.closed:
+            (connid,) = args
+            proxy = self._proxies.get(connid, None)
+            if proxy is not None:
+                self.drop(proxy)
+
+    def send_shared(self, frame: SharedFrame, kind: str, connid: int) -> None:
+        """Sends a frame to a connection, once per tick for all of them
+
+        The frontend frames and compresses it once for every connection of
+        the frontend it was sent to.
+        """
+        if self.transport is None or self.transport.is_closing():
+            return
+        shared = self._shared.get(frame, None)
+        if shared is None:
+            # Packed on flush, once every member has been added
+            shared = (len(self._pending), kind, [])
+            self._shared[frame] = shared
+            self.send_frame(b"")
+        shared[2].append(connid)
+
+    def flush(self) -> None:
+        for frame, (index, kind, connids) in self._shared.items():
+            self._pending[index] = encode_link_op(
+                LINK_OPS.shared, kind, connids, frame.message
+            )
+        self._shared = {}
+        super().flush()
+
+    def _open(self, connid: int, user: Tuple[str, str] | None) -> ProxyConnection:
+        # A connection moving over from another core brings its user along
+        user = User(*user) if user is not None else None
+        proxy = ProxyConnection(self, connid, user)
+        self._proxies[connid] = proxy
+        self.server.add_connection(proxy)
+        if user is not None:
+            self.server.user_connections[user.userid] = proxy
+            self.server.user_online(user.userid)
+        return proxy
+
+    def user_changed(self, proxy: ProxyConnection, previous: User | None) -> None:
+        if previous is not None:
+            self.server.user_offline(previous.userid)
+        user = proxy.user
+        if user is not None:
+            self.server.user_online(user.userid)
+            self.send_op(LINK_OPS.user, proxy.connid, (user.userid, user.username))
+        else:
+            self.send_op(LINK_OPS.user, proxy.connid, None)
+
+    def drop(self, proxy: ProxyConnection) -> None:
+        self._proxies.pop(proxy.connid, None)
+        self.server.remove_connection(proxy)
+        proxy._is_closed = True
+        if proxy.user is not None:
+            self.server.user_offline(proxy.user.userid)
+
+    def connection_lost(self, exc: Exception | None) -> None:
+        # The frontend is gone and so are all of its clients
+        logging.info("Lost frontend with %s connections", len(self._proxies))
+        self.server.links.remove(self)
+        for proxy in list(self._proxies.values()):
+            self.drop(proxy)
+
+
+class BusClient(LinkProtocol):
+    """A core's end of the link to the bus"""
+
+    def __init__(self, server: ShardServer) -> None:
+        super().__init__()
+        self.server = server
+        self.lost: asyncio.Future = asyncio.get_running_loop().create_future()
+
+    def connection_made(self, transport: asyncio.Transport) -> None:
+        super().connection_made(transport)
+        self.send_op(BUS_OPS.hello, self.server.shard)
+
+    def handle_op(self, op: int, *args: Any) -> None:
+        if op == BUS_OPS.direct:
+            userid, message = args
+            asyncio.create_task(self.server.deliver(message, userid))
+        elif op == BUS_OPS.kick:
+            (userid,) = args
+            connection = self.server.user_connections.get(userid, None)
+            if connection is not None:
+                connection.close()
+
+    def connection_lost(self, exc: Exception | None) -> None:
+        logging.error("Lost connection to the bus: %s", exc)
+        if not self.lost.done():
+            self.lost.set_result(None)
+
+
+class Bus:
+    """Knows the core holding each signed in user and routes between cores"""
+
+    def __init__(self) -> None:
+        self.links: Dict[int, BusLink] = {}
+        self.directory: Dict[str, int] = {}
+
+    def link(self) -> BusLink:
+        return BusLink(self)
+
+    def send(self, shard: int | None, op: int, *args: Any) -> None:
+        link = self.links.get(shard, None)
+        if link is not None:
+            link.send_op(op, *args)
+
+
+class BusLink(LinkProtocol):
+    """The bus's end of the link to one core"""
+
+    def __init__(self, bus: Bus) -> None:
+        super().__init__()
+        self.bus = bus
+        self.shard: int | None = None
+
+    def handle_op(self, op: int, *args: Any) -> None:
+        directory = self.bus.directory
+        if op == BUS_OPS.hello:
+            (self.shard,) = args
+            self.bus.links[self.shard] = self
+        elif op == BUS_OPS.online:
+            userid, shard = args
+            directory[userid] = shard
+        elif op == BUS_OPS.offline:
+            # The user may already be online on the core it moved to
+            userid, shard = args
+            if directory.get(userid, None) == shard:
+                del directory[userid]
+        elif op == BUS_OPS.direct:
+            userid, message = args
+            self.bus.send(directory.get(userid, None), BUS_OPS.direct, userid, message)
+        elif op == BUS_OPS.kick:
+            userid, shard = args
+            target = directory.get(userid, None)
+            if target is not None and target != shard:
+                self.bus.send(target, BUS_OPS.kick, userid)
+
+    def connection_lost(self, exc: Exception | None) -> None:
+        # Users held by the core went with it
+        logging.error("Lost core %s: %s", self.shard, exc)
+        if self.bus.links.get(self.shard, None) is self:
+            del self.bus.links[self.shard]
+            directory = self.bus.directory
+            for userid in [u for u, s in directory.items() if s == self.shard]:
+                del directory[userid]
+
+
+class FrontendLink(LinkProtocol):
+    """A frontend's end of the link to one core"""
+
+    def __init__(self, frontend: Frontend, shard: int) -> None:
+        super().__init__()
+        self.frontend = frontend
+        self.shard = shard
+
+    def handle_op(self, op: int, *args: Any) -> None:
+        self.frontend.handle_op(self.shard, op, *args)
+
+    def connection_lost(self, exc: Exception | None) -> None:
+        logging.error("Lost connection to core %s: %s", self.shard, exc)
+        self.frontend.core_lost()
+
+
+class Frontend(ConnectionHandlers):
+    """Parent of the client connections in one frontend process
+
+    Stands in for ChatServer as the connections' parent: it answers
+    connection level messages itself and forwards the rest to a core.
+    With several cores a connection is attached to one core at a time,
+    and moves with its user when a message belongs to another core.
+
+    Args:
+        shards (int): Cores to connect to, one link each.
+    """
+
+    def __init__(self, config: ServerConfig | None = None, shards: int = 1) -> None:
+        self.config = config if config is not None else ServerConfig()
+        self.metrics = ServerMetrics()
+        self.connections: Dict[ChatServerConnection, None] = {}
+        self.links = [FrontendLink(self, shard) for shard in range(shards)]
+        self.lost: asyncio.Future = asyncio.get_running_loop().create_future()
+        self._ping_nonce: int = 0
+        # Messages the frontend answers without a core
+        self.handlers = HandlerRegistry()
+        self.handlers.register(MESSAGE_TYPES.ack, self.handle_ack)
+        self.handlers.register(MESSAGE_TYPES.hello, self.handle_hello)
+        self.handlers.register(MESSAGE_TYPES.ping, self.handle_ping)
+        self.handlers.register(MESSAGE_TYPES.pong, self.handle_pong)
+        self.handlers.register(MESSAGE_TYPES.resend, self.handle_resend)
+        self._next_id: int = 1
+        self._ids: Dict[ChatServerConnection, int] = {}
+        self._by_id: Dict[int, ChatServerConnection] = {}
+        # Core each connection is attached to and the user it signed in as
+        self._shards: Dict[ChatServerConnection, int] = {}
+        self._users: Dict[ChatServerConnection, Tuple[str, str]] = {}
+        # Core holding each room that is in memory
+        self._rooms: Dict[str, int] = {}
+        self._lobby_shard = shard_for_room(LOBBY_NAME, shards)
+
+    @property
+    def shards(self) -> int:
+        return len(self.links)
+
+    def core_lost(self) -> None:
+        # Without every core there is no complete chat state, drop every client
+        for connection in list(self.connections):
+            connection.close()
+        if not self.lost.done():
+            self.lost.set_result(None)
+
+    def add_connection(self, conn: ChatServerConnection) -> None:
+        if conn in self._ids:
+            return
+        connid = self._next_id
+        self._next_id += 1
+        self._ids[conn] = connid
+        self._by_id[connid] = conn
+        self.connections[conn] = None
+
+    def remove_connection(self, conn: ChatServerConnection) -> None:
+        connid = self._ids.pop(conn, None)
+        if connid is None:
+            return
+        del self._by_id[connid]
+        del self.connections[conn]
+        self._users.pop(conn, None)
+        shard = self._shards.pop(conn, None)
+        if shard is not None:
+            self.links[shard].send_op(LINK_OPS.closed, connid)
+
+    async def handle_message(
+        self, message: Dict[str, Any], source: ChatServerConnection
+    ) -> None:
+        if await self.handlers.dispatch(message, source):
+            return
+
+        connid = self._ids.get(source, None)
+        if connid is None:
+            return
+        shard = self.route(message, source)
+        current = self._shards.get(source, None)
+        if current is not None and current != shard:
+            # The old core forgets the connection, the new one learns its user
+            self.links[current].send_op(LINK_OPS.closed, connid)
+        self._shards[source] = shard
+        user = self._users.get(source, None)
+        self.links[shard].send_op(LINK_OPS.message, connid, source.codec, user, message)
+
+    def route(self, message: Dict[str, Any], source: ChatServerConnection) -> int:
+        """The core that handles a message
+
+        Returns:
+            int: The core owning the room the message is about, or the
+                connection's current core for messages about no room
+        """
+        if self.shards == 1:
+            return 0
+
+        current = self._shards.get(source, self._lobby_shard)
+        message_type = message.get(MESSAGE_TYPE, None)
+        if message_type == MESSAGE_TYPES.join_room:
+            return self._by_name(
+                message.get(FIELDS_JOIN_ROOM_MESSAGE.roomname), current
+            )
+        if message_type == MESSAGE_TYPES.create_room:
+            return self._by_name(message.get(FIELDS_CREATE_ROOM_MESSAGE.name), current)
+        if message_type in (MESSAGE_TYPES.login, MESSAGE_TYPES.register):
+            # Signing in puts the user in the lobby
+            return self._lobby_shard
+        if message_type == MESSAGE_TYPES.resume:
+            # A room no longer in memory is resumed in the lobby
+            roomid = message.get(FIELDS_RESUME_MESSAGE.roomid, None)
+            return self._rooms.get(roomid, self._lobby_shard)
+        if message_type == MESSAGE_TYPES.history:
+            roomid = message.get(FIELDS_HISTORY_MESSAGE.roomid, None)
+            return self._rooms.get(roomid, current)
+        if message_type == MESSAGE_TYPES.list_users:
+            roomid = message.get(FIELDS_LIST_USERS_MESSAGE.roomid, None)
+            return self._rooms.get(roomid, current)
+        return current
+
+    def _by_name(self, roomname: Any, default: int) -> int:
+        if not isinstance(roomname, str):
+            return default
+        return shard_for_room(roomname.strip(), self.shards)
+
+    def handle_op(self, shard: int, op: int, *args: Any) -> None:
+        if op == LINK_OPS.send:
+            connid, kind, payload = args
+            connection = self._by_id.get(connid, None)
+            if connection is not None:
+                asyncio.create_task(connection.send(payload, kind))
+        elif op == LINK_OPS.shared:
+            kind, connids, message = args
+            connections = [self._by_id.get(connid, None) for connid in connids]
+            asyncio.create_task(
+                self._send_shared(SharedFrame(message), kind, connections)
+            )
+        elif op == LINK_OPS.room:
+            roomid, in_memory = args
+            if in_memory:
+                self._rooms[roomid] = shard
+            elif self._rooms.get(roomid, None) == shard:
+                del self._rooms[roomid]
+        else:
+            # Ignore cores the connection has since moved away from
+            connid, *args = args
+            connection = self._by_id.get(connid, None)
+            if connection is None or self._shards.get(connection, None) != shard:
+                return
+            if op == LINK_OPS.close:
+                connection.close()
+            elif op == LINK_OPS.user:
+                (user,) = args
+                if user is None:
+                    self._users.pop(connection, None)
+                else:
+                    self._users[connection] = tuple(user)
+
+    async def _send_shared(
+        self,
+        frame: SharedFrame,
+        kind: str,
+        connections: List[ChatServerConnection | None],
+    ) -> None:
+        for connection in connections:
+            if connection is not None:
+                await connection.send_shared(frame, kind)
+
+
+async def _connect_unix(
+    factory: Callable[[], asyncio.Protocol], socket_path: str
+) -> Tuple[asyncio.Transport, asyncio.Protocol]:
+    # Processes start in any order, wait for the socket to appear
+    loop = asyncio.get_running_loop()
+    deadline = time.monotonic() + CORE_CONNECT_TIMEOUT
+    while True:
+        try:
+            return await loop.create_unix_connection(factory, socket_path)
+        except (FileNotFoundError, ConnectionRefusedError):
+            if time.monotonic() > deadline:
+                raise
+            await asyncio.sleep(0.1)
+
+
+async def serve_bus(socket_path: str) -> None:
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+    bus = Bus()
+    loop = asyncio.get_running_loop()
+    server = await loop.create_unix_server(bus.link, socket_path)
+    logging.info("Bus listening on %s", socket_path)
+    async with server:
+        await server.serve_forever()
+
+
+async def serve_core(
+    socket_path: str,
+    db_name: str | None = None,
+    config: ServerConfig | None = None,
+    shard: int = 0,
+    bus_path: str | None = None,
+) -> None:
+    db = SqliteDatabase() if db_name is None else SqliteDatabase(db_name=db_name)
+    db._initialize_database(drop=False)
+    server = ShardServer(db=db, config=config, shard=shard)
+    if bus_path is not None:
+        _, server.bus = await _connect_unix(lambda: BusClient(server), bus_path)
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+
+    loop = asyncio.get_running_loop()
+    core = await loop.create_unix_server(lambda: CoreLink(server), socket_path)
+    logging.info("Core %s listening on %s", shard, socket_path)
+    # Heartbeats are run by the frontends, which hold the real connections
+    try:
+        async with core:
+            if server.bus is None:
+                await core.serve_forever()
+            else:
+                # Without the bus users on other cores can not be reached
+                await server.bus.lost
+    finally:
+        server.passwords.close()
+
+
+async def serve_frontend(
+    host: str,
+    port: int,
+    socket_paths: List[str],
+    websocket_port: int | None = None,
+    config: ServerConfig | None = None,
+) -> None:
+    loop = asyncio.get_running_loop()
+    frontend = Frontend(config, shards=len(socket_paths))
+    for link, socket_path in zip(frontend.links, socket_paths):
+        await _connect_unix(lambda link=link: link, socket_path)
+
+    servers = [
+        await loop.create_server(
+            lambda: ChatServerConnection(parent=frontend), host, port, reuse_port=True
+        )
+    ]
+    if websocket_port is not None:
+        servers.append(
+            await loop.create_server(
+                lambda: WebSocketConnection(parent=frontend),
+                host,
+                websocket_port,
+                reuse_port=True,
+            )
+        )
+    logging.info("Frontend %s serving %s:%s", os.getpid(), host, port)
+
+    heartbeat: asyncio.Task | None = None
+    if frontend.config.heartbeat_interval > 0:
+        heartbeat = asyncio.create_task(frontend._heartbeat())
+    try:
+        await frontend.lost
+    finally:
+        if heartbeat is not None:
+            heartbeat.cancel()
+        for server in servers:
+            server.close()
+        for link in frontend.links:
+            if link.transport is not None:
+                link.transport.close()
+
+
+def _run_bus(socket_path: str):
+    logging.basicConfig(filename="server.log", level=logging.DEBUG, filemode="a")
+    asyncio.run(serve_bus(socket_path))
+
+
+def _run_core(
+    socket_path: str,
+    db_name: str | None,
+    config: ServerConfig | None,
+    shard: int,
+    bus_path: str | None,
+):
+    logging.basicConfig(filename="server.log", level=logging.DEBUG, filemode="a")
+    asyncio.run(serve_core(socket_path, db_name, config, shard, bus_path))
+    # The bus went away, exit so the supervisor starts a fresh core
+    raise SystemExit(1)
+
+
+def _run_frontend(
+    host: str,
+    port: int,
+    socket_paths: List[str],
+    websocket_port: int | None,
+    config: ServerConfig | None,
+):
+    logging.basicConfig(filename="server.log", level=logging.DEBUG, filemode="a")
+    asyncio.run(serve_frontend(host, port, socket_paths, websocket_port, config))
+    # A core went away, exit so the supervisor starts a fresh frontend
+    raise SystemExit(1)
+
+
+def run_multiprocess_server(
+    host: str = "127.0.0.1",
+    port: int = 5001,
+    workers: int | None = None,
+    websocket_port: int | None = None,
+    db_name: str | None = None,
+    config: ServerConfig | None = None,
+    shards: int = 1,
+):
+    """Runs the core processes and a frontend per worker until interrupted
+
+    Args:
+        workers (int | None, optional): Frontend processes. Defaults to
+            the number of CPUs.
+        db_name (str | None, optional): Database file of the cores.
+        shards (int, optional): Core processes the rooms are partitioned
+            across. More than one also starts the bus.
+    """
+    logging.basicConfig(filename="server.log", level=logging.DEBUG, filemode="w")
+    workers = workers if workers is not None else os.cpu_count() or 1
+    if workers <= 0:
+        raise ValueError("workers must be positive")
+    if shards <= 0:
+        raise ValueError("shards must be positive")
+    # Every core has to accept tokens issued by the others and by itself
+    # before a restart
+    config = copy.copy(config) if config is not None else ServerConfig()
+    if config.session_secret is None:
+        config.session_secret = os.urandom(32)
+
+    base_path = os.path.join(tempfile.gettempdir(), f"conchat-{os.getpid()}")
+    socket_paths = [f"{base_path}-core-{shard}.sock" for shard in range(shards)]
+    bus_path = f"{base_path}-bus.sock" if shards > 1 else None
+
+    context = multiprocessing.get_context("spawn")
+    targets: Dict[str, Callable[[], multiprocessing.Process]] = {}
+    if bus_path is not None:
+        targets["bus"] = lambda: context.Process(
+            target=_run_bus, args=(bus_path,), name="bus"
+        )
+    for shard, socket_path in enumerate(socket_paths):
+        targets[f"core-{shard}"] = lambda shard=shard, path=socket_path: (
+            context.Process(
+                target=_run_core,
+                args=(path, db_name, config, shard, bus_path),
+                name=f"core-{shard}",
+            )
+        )
+    for i in range(workers):
+        targets[f"frontend-{i}"] = lambda i=i: context.Process(
+            target=_run_frontend,
+            args=(host, port, socket_paths, websocket_port, config),
+            name=f"frontend-{i}",
+        )
+
+    # Stop the workers and remove the sockets on kill as well as on ctrl+c
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    processes: Dict[str, multiprocessing.Process] = {}
+    try:
+        for name, target in targets.items():
+            processes[name] = target()
+            processes[name].start()
+
+        while True:
+            wait([p.sentinel for p in processes.values()])
+            time.sleep(RESTART_DELAY)
+            for name, process in processes.items():
+                if process.is_alive():
+                    continue
+                logging.error("%s exited with %s, restarting", name, process.exitcode)
+                processes[name] = targets[name]()
+                processes[name].start()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for process in processes.values():
+            process.terminate()
+        for process in processes.values():
+            process.join()
+        for socket_path in [*socket_paths, bus_path]:
+            if socket_path is not None and os.path.exists(socket_path):
+                os.unlink(socket_path)
@@ -0,0 +1,207 @@
+"""Message handler registry and middleware
+
+Handlers are registered per message type and wrapped by every middleware
+in use when they are registered, or when a middleware is added later. A
+middleware returns the handler unchanged for message types it does not
+apply to, so dispatch is one dict lookup and a disabled or inapplicable
+middleware adds nothing to a message's path.
+"""
+
+from __future__ import annotations
+import logging
+import time
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Tuple
+
+from .chat_server_protocol import AbstractChatConnection
+from .metrics import METRICS, ServerMetrics
+from .rate_limit import RateLimiter, take_all
+from common import (
+    ERROR_TYPES,
+    ERRORS,
+    MESSAGE_TAGS,
+    MESSAGE_TYPE,
+    REQUEST_ID,
+    serialize_error_message,
+)
+
+Handler = Callable[[Dict[str, Any], AbstractChatConnection], Awaitable[None]]
+# Takes a message type and its handler, returns the handler to use instead
+Middleware = Callable[[str, Handler], Handler]
+# Returns the (limiter, key, cost) of every bucket a message takes from
+Charges = Callable[
+    [Dict[str, Any], AbstractChatConnection], List[Tuple[RateLimiter, Hashable, float]]
+]
+
+# Id of the request being handled. Every message is handled in its own
+# task, so each task sees the id of its own request.
+_request_id: ContextVar[str | None] = ContextVar("request_id", default=None)
+
+
+class HandlerRegistry:
+    """Handlers keyed by message type, each wrapped in the middleware chain
+
+    Middleware added first is outermost, so it sees a message first.
+    """
+
+    def __init__(self) -> None:
+        self._handlers: Dict[str, Handler] = {}
+        self._middleware: List[Middleware] = []
+        self._chains: Dict[str, Handler] = {}
+
+    @property
+    def message_types(self) -> List[str]:
+        return list(self._handlers)
+
+    def register(self, message_type: str, handler: Handler) -> None:
+        """Sets the handler of a message type, replacing any previous one
+
+        Raises:
+            ValueError: Unknown message type
+        """
+        if message_type not in MESSAGE_TAGS:
+            raise ValueError(f"Unknown message type: {message_type}")
+        self._handlers[message_type] = handler
+        self._chains[message_type] = self._wrap(message_type, handler)
+
+    def use(self, middleware: Middleware) -> None:
+        """Adds a middleware inside the ones already in use"""
+        self._middleware.append(middleware)
+        for message_type, handler in self._handlers.items():
+            self._chains[message_type] = self._wrap(message_type, handler)
+
+    async def dispatch(
+        self, message: Dict[str, Any], source: AbstractChatConnection
+    ) -> bool:
+        """Runs the handler chain for a message
+
+        Returns:
+            bool: False when no handler is registered for the message type
+        """
+        handler = self._chains.get(message.get(MESSAGE_TYPE, None), None)
+        if handler is None:
+            return False
+        _request_id.set(message.get(REQUEST_ID, None))
+        await handler(message, source)
+        return True
+
+    def _wrap(self, message_type: str, handler: Handler) -> Handler:
+        for middleware in reversed(self._middleware):
+            handler = middleware(message_type, handler)
+        return handler
+
+
+def authorize(userid_fields: Dict[str, str]) -> Middleware:
+    """Drops messages that claim to come from another user
+
+    Args:
+        userid_fields (Dict[str, str]): The field holding the sender's
+            userid, for each message type that has one. Connections that
+            have not signed in are not checked.
+    """
+
+    def middleware(message_type: str, handler: Handler) -> Handler:
+        field = userid_fields.get(message_type, None)
+        if field is None:
+            return handler
+
+        async def authorized(
+            message: Dict[str, Any], source: AbstractChatConnection
+        ) -> None:
+            user = source.user
+            if user is not None and message.get(field, None) != user.userid:
+                logging.info("Dropping %s for another user", message_type)
+                return
+            await handler(message, source)
+
+        return authorized
+
+    return middleware
+
+
+def validate(required: Dict[str, Tuple[Tuple[str, ...], str | None]]) -> Middleware:
+    """Rejects messages missing a required field
+
+    Args:
+        required (Dict[str, Tuple[Tuple[str, ...], str | None]]): For each
+            message type, the fields that must be non-blank strings and the
+            ERROR_TYPES to answer with when one is not, or None to drop the
+            message without an answer.
+    """
+
+    def middleware(message_type: str, handler: Handler) -> Handler:
+        spec = required.get(message_type, None)
+        if spec is None:
+            return handler
+        fields, errortype = spec
+
+        async def validated(
+            message: Dict[str, Any], source: AbstractChatConnection
+        ) -> None:
+            for field in fields:
+                value = message.get(field, None)
+                if not isinstance(value, str) or len(value.strip()) == 0:
+                    logging.info("Missing %s in %s message", field, message_type)
+                    if errortype is not None:
+                        await source.send(
+                            serialize_error_message(
+                                errortype,
+                                getattr(ERRORS, errortype),
+                                codec=source.codec,
+                                requestid=_request_id.get(),
+                            )
+                        )
+                    return
+            await handler(message, source)
+
+        return validated
+
+    return middleware
+
+
+def rate_limit(charges: Dict[str, Charges], metrics: ServerMetrics) -> Middleware:
+    """Rejects messages once one of the buckets they take from is empty
+
+    Args:
+        charges (Dict[str, Charges]): For each limited message type, returns
+            the buckets a message takes tokens from. A message is only let
+            through when every bucket has enough tokens.
+    """
+
+    def middleware(message_type: str, handler: Handler) -> Handler:
+        charge = charges.get(message_type, None)
+        if charge is None:
+            return handler
+
+        async def limited(message: Dict[str, Any], source: AbstractChatConnection):
+            if not take_all(charge(message, source)):
+                metrics.increment(METRICS.messages_rate_limited)
+                return await source.send(
+                    serialize_error_message(
+                        ERROR_TYPES.rate_limited,
+                        ERRORS.rate_limited,
+                        codec=source.codec,
+                        requestid=_request_id.get(),
+                    )
+                )
+            await handler(message, source)
+
+        return limited
+
+    return middleware
+
+
+def timing(metrics: ServerMetrics) -> Middleware:
+    """Counts calls to each handler and the time spent in them"""
+
+    def middleware(message_type: str, handler: Handler) -> Handler:
+        async def timed(message: Dict[str, Any], source: AbstractChatConnection):
+            start = time.perf_counter()
+            try:
+                await handler(message, source)
+            finally:
+                metrics.record_handler(message_type, time.perf_counter() - start)
+
+        return timed
+
+    return middleware
@@ -0,0 +1,69 @@
+from collections import namedtuple
+from typing import Dict
+
+_metrics = namedtuple(
+    "METRICS",
+    [
+        "frames_dropped",
+        "frames_oversized",
+        "slow_consumers_disconnected",
+        "outbound_queue_frames",
+        "outbound_queue_max_frames",
+        "outbound_queue_bytes",
+        "frames_resent",
+        "resend_gaps",
+        "resyncs_delta",
+        "resyncs_full",
+        "resync_messages",
+        "pings_sent",
+        "connections_reaped",
+        "sessions_resumed",
+        "session_resumes_rejected",
+        "password_jobs_rejected",
+        "messages_rate_limited",
+    ],
+)
+
+METRICS = _metrics(
+    frames_dropped="frames_dropped",
+    frames_oversized="frames_oversized",
+    slow_consumers_disconnected="slow_consumers_disconnected",
+    outbound_queue_frames="outbound_queue_frames",
+    outbound_queue_max_frames="outbound_queue_max_frames",
+    outbound_queue_bytes="outbound_queue_bytes",
+    frames_resent="frames_resent",
+    resend_gaps="resend_gaps",
+    resyncs_delta="resyncs_delta",
+    resyncs_full="resyncs_full",
+    resync_messages="resync_messages",
+    pings_sent="pings_sent",
+    connections_reaped="connections_reaped",
+    sessions_resumed="sessions_resumed",
+    session_resumes_rejected="session_resumes_rejected",
+    password_jobs_rejected="password_jobs_rejected",
+    messages_rate_limited="messages_rate_limited",
+)
+
+
+class ServerMetrics:
+    """Counters and gauges the server wants to expose"""
+
+    def __init__(self) -> None:
+        self._values: Dict[str, int] = {name: 0 for name in METRICS}
+
+    def increment(self, name: str, amount: int = 1) -> None:
+        self._values[name] = self._values.get(name, 0) + amount
+
+    def set(self, name: str, value: int) -> None:
+        self._values[name] = value
+
+    def get(self, name: str) -> int:
+        return self._values.get(name, 0)
+
+    def record_handler(self, message_type: str, seconds: float) -> None:
+        """Adds a call of a message type's handler and its duration"""
+        self.increment(f"handler_{message_type}_calls")
+        self.increment(f"handler_{message_type}_us", int(seconds * 1_000_000))
+
+    def snapshot(self) -> Dict[str, int]:
+        return dict(self._values)
@@ -0,0 +1,77 @@
+import asyncio
+import multiprocessing
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import Any, Callable
+
+import bcrypt
+from common import ENCODING
+
+
+class ServerBusyError(Exception):
+    def __init__(self, *args: object) -> None:
+        super().__init__(*args)
+
+
+def _hash_password(password: str) -> bytes:
+    return bcrypt.hashpw(password.encode(ENCODING), bcrypt.gensalt())
+
+
+def _check_password(password: str, pwhash: bytes) -> bool:
+    return bcrypt.checkpw(password.encode(ENCODING), pwhash)
+
+
+class PasswordHasher:
+    """Runs bcrypt off the event loop with a bound on waiting work
+
+    A single bcrypt call takes long enough to stall every room, so hashes
+    and checks run in a process pool. Once max_pending calls are queued or
+    running, new ones fail straight away with ServerBusyError.
+
+    Args:
+        workers (int): Processes in the pool. 0 uses the event loop's
+            default thread pool instead, bcrypt releases the GIL.
+        max_pending (int): Calls allowed to wait or run at once.
+    """
+
+    def __init__(self, workers: int = 2, max_pending: int = 64) -> None:
+        if workers < 0:
+            raise ValueError("workers can not be negative")
+        if max_pending <= 0:
+            raise ValueError("max_pending must be positive")
+        self.workers = workers
+        self.max_pending = max_pending
+        self._pending: int = 0
+        self._executor: Executor | None = None
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    async def hash(self, password: str) -> bytes:
+        """Raises ServerBusyError when too many calls are waiting"""
+        return await self._run(_hash_password, password)
+
+    async def check(self, password: str, pwhash: bytes) -> bool:
+        """Raises ServerBusyError when too many calls are waiting"""
+        return await self._run(_check_password, password, pwhash)
+
+    def close(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def _run(self, func: Callable[..., Any], *args: Any) -> Any:
+        if self._pending >= self.max_pending:
+            raise ServerBusyError(f"{self._pending} password checks waiting")
+        if self._executor is None and self.workers > 0:
+            # Started on first use, spawned so workers share no loop state
+            self._executor = ProcessPoolExecutor(
+                self.workers, mp_context=multiprocessing.get_context("spawn")
+            )
+
+        self._pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, func, *args)
+        finally:
+            self._pending -= 1
@@ -0,0 +1,92 @@
+import time
+from typing import Dict, Hashable, Iterable, Tuple
+
+# Seconds between sweeps that forget buckets which have refilled
+PRUNE_INTERVAL = 60.0
+
+
+class TokenBucket:
+    """Holds up to burst tokens and regains rate tokens per second"""
+
+    __slots__ = ("tokens", "updated")
+
+    def __init__(self, burst: float, now: float) -> None:
+        self.tokens = burst
+        self.updated = now
+
+
+class RateLimiter:
+    """Token buckets keyed by user, connection, room or anything hashable
+
+    Args:
+        rate (float): Tokens regained per second.
+        burst (float): Most tokens a bucket holds, and so the largest
+            burst allowed after a quiet period.
+    """
+
+    def __init__(self, rate: float, burst: float) -> None:
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        if burst < 1:
+            raise ValueError("burst must be at least 1")
+        self.rate = rate
+        self.burst = burst
+        self._buckets: Dict[Hashable, TokenBucket] = {}
+        self._pruned: float = 0.0
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    def allowed(self, key: Hashable, cost: float = 1, now: float | None = None) -> bool:
+        """Whether key has cost tokens, without taking them"""
+        now = time.monotonic() if now is None else now
+        return self._refill(key, now).tokens >= cost
+
+    def take(self, key: Hashable, cost: float = 1, now: float | None = None) -> None:
+        now = time.monotonic() if now is None else now
+        self._refill(key, now).tokens -= cost
+        if now - self._pruned >= PRUNE_INTERVAL:
+            self._prune(now)
+
+    def _refill(self, key: Hashable, now: float) -> TokenBucket:
+        bucket = self._buckets.get(key, None)
+        if bucket is None:
+            bucket = TokenBucket(self.burst, now)
+            self._buckets[key] = bucket
+        elif now > bucket.updated:
+            bucket.tokens = min(
+                self.burst, bucket.tokens + (now - bucket.updated) * self.rate
+            )
+            bucket.updated = now
+        return bucket
+
+    def _prune(self, now: float) -> None:
+        # A full bucket is the same as no bucket
+        self._pruned = now
+        refilled = [
+            key
+            for key, bucket in self._buckets.items()
+            if bucket.tokens + (now - bucket.updated) * self.rate >= self.burst
+        ]
+        for key in refilled:
+            del self._buckets[key]
+
+
+def take_all(
+    charges: Iterable[Tuple[RateLimiter, Hashable, float]], now: float | None = None
+) -> bool:
+    """Takes tokens from every bucket, or from none if any is short
+
+    Args:
+        charges: (limiter, key, cost) for each bucket to take from.
+
+    Returns:
+        bool: False when a bucket did not have enough tokens
+    """
+    now = time.monotonic() if now is None else now
+    charges = list(charges)
+    if not all(limiter.allowed(key, cost, now) for limiter, key, cost in charges):
+        return False
+    for limiter, key, cost in charges:
+        limiter.take(key, cost, now)
+    return True
@@ -0,0 +1,211 @@
+from collections import namedtuple
+from common import COMPRESSION_MIN_SIZE
+from .session_tokens import SESSION_TOKEN_TTL
+
+# What to do when a connection's outbound queue is full
+_overflow_policies = namedtuple(
+    "OVERFLOW_POLICIES", ["drop_oldest", "drop_room", "disconnect"]
+)
+
+OVERFLOW_POLICIES = _overflow_policies(
+    drop_oldest="drop_oldest",
+    drop_room="drop_room",
+    disconnect="disconnect",
+)
+
+
+class ServerConfig:
+    """Tunable settings for ChatServer
+
+    Args:
+        flush_max_delay (float): Seconds outbound frames may wait to be
+            coalesced into one write. 0 flushes at the end of the current
+            event loop tick.
+        flush_max_bytes (int): Flush immediately once this many bytes are
+            waiting to be written.
+        outbound_max_frames (int): Frames a connection may hold while its
+            transport is paused before the overflow policy applies.
+        outbound_max_bytes (int): Bytes a connection may hold while its
+            transport is paused before the overflow policy applies.
+        overflow_policy (str): One of OVERFLOW_POLICIES. drop_oldest drops
+            the oldest queued frames, drop_room drops room traffic but keeps
+            direct messages and control messages, disconnect closes the
+            connection.
+        compression_min_size (int): Frames smaller than this are sent
+            uncompressed even when the connection negotiated compression.
+        resend_window_frames (int): Sequenced frames kept per connection
+            until the client acknowledges them, so gaps can be resent.
+        resend_window_bytes (int): Bytes of sequenced frames kept per
+            connection for resends.
+        history_page_size (int): Messages sent when joining a room.
+        history_max_page (int): Most messages a history request can ask for.
+        history_chunk_size (int): Messages per history_response frame, so a
+            large page is streamed as several bounded frames.
+        room_history (bool): Keep the latest history_page_size messages of
+            each room in memory, so joins do not read the database.
+        users_page_size (int): Names in a list_users response that does not
+            ask for a limit.
+        users_max_page (int): Most names a list_users request can ask for.
+        rooms_page_size (int): Names in a list_rooms response that does not
+            ask for a limit.
+        rooms_max_page (int): Most names a list_rooms request can ask for.
+        rooms_refresh_interval (float): Seconds between reads of the room
+            list from the database, for rooms created by other processes
+            sharing it. 0 only reads it at startup.
+        resync_max_messages (int): Most missed messages replayed when a client
+            rejoins with the last message id it saw. Clients further behind
+            get a full reload of the latest history page instead.
+        heartbeat_interval (float): Seconds a connection can be silent
+            before it is sent a ping. 0 disables heartbeats.
+        heartbeat_timeout (float): Seconds a connection can be silent
+            before it is considered dead and reaped.
+        session_secret (bytes | None): Key that signs session tokens. Servers
+            that should accept each other's tokens need the same key.
+            Defaults to a random key per server.
+        session_token_ttl (float): Seconds a session token can be used to
+            resume a session.
+        cluster_secret (bytes | None): Key a cluster node proves to the
+            broker that it has. Required for cluster nodes only.
+        password_workers (int): Processes that run bcrypt for logins and
+            registrations. 0 runs it on threads of the event loop instead.
+        password_max_pending (int): Password checks that may wait or run
+            at once. Further logins and registrations get a server_busy
+            error straight away.
+        chat_rate_connection (float): Chat messages a connection may send
+            per second on average. 0 disables the limit.
+        chat_burst_connection (float): Chat messages a connection may send
+            at once after being quiet.
+        chat_rate_user (float): Chat messages per second for a signed in
+            user. 0 disables the limit.
+        chat_burst_user (float): Burst of chat messages for a user.
+        chat_rate_room (float): Chat messages per second into one room,
+            from all of its members together. 0 disables the limit.
+        chat_burst_room (float): Burst of chat messages into a room.
+        handler_timing (bool): Count calls to each message handler and the
+            time spent in it, see ServerMetrics.record_handler.
+    """
+
+    def __init__(
+        self,
+        *,
+        flush_max_delay: float = 0.0,
+        flush_max_bytes: int = 64 * 1024,
+        outbound_max_frames: int = 1024,
+        outbound_max_bytes: int = 1024 * 1024,
+        overflow_policy: str = OVERFLOW_POLICIES.drop_room,
+        compression_min_size: int = COMPRESSION_MIN_SIZE,
+        resend_window_frames: int = 256,
+        resend_window_bytes: int = 256 * 1024,
+        history_page_size: int = 30,
+        history_max_page: int = 200,
+        history_chunk_size: int = 50,
+        room_history: bool = True,
+        users_page_size: int = 500,
+        users_max_page: int = 1000,
+        rooms_page_size: int = 500,
+        rooms_max_page: int = 1000,
+        rooms_refresh_interval: float = 30.0,
+        resync_max_messages: int = 500,
+        heartbeat_interval: float = 30.0,
+        heartbeat_timeout: float = 90.0,
+        session_secret: bytes | None = None,
+        session_token_ttl: float = SESSION_TOKEN_TTL,
+        cluster_secret: bytes | None = None,
+        password_workers: int = 2,
+        password_max_pending: int = 64,
+        chat_rate_connection: float = 10.0,
+        chat_burst_connection: float = 30.0,
+        chat_rate_user: float = 5.0,
+        chat_burst_user: float = 20.0,
+        chat_rate_room: float = 100.0,
+        chat_burst_room: float = 200.0,
+        handler_timing: bool = False,
+    ) -> None:
+        if flush_max_delay < 0:
+            raise ValueError("flush_max_delay can not be negative")
+        if flush_max_bytes <= 0:
+            raise ValueError("flush_max_bytes must be a positive integer > 0")
+        if outbound_max_frames <= 0:
+            raise ValueError("outbound_max_frames must be a positive integer > 0")
+        if outbound_max_bytes <= 0:
+            raise ValueError("outbound_max_bytes must be a positive integer > 0")
+        if overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy: {overflow_policy}")
+        if compression_min_size < 0:
+            raise ValueError("compression_min_size can not be negative")
+        if resend_window_frames < 0:
+            raise ValueError("resend_window_frames can not be negative")
+        if resend_window_bytes < 0:
+            raise ValueError("resend_window_bytes can not be negative")
+        if history_page_size <= 0:
+            raise ValueError("history_page_size must be a positive integer > 0")
+        if history_max_page <= 0:
+            raise ValueError("history_max_page must be a positive integer > 0")
+        if history_chunk_size <= 0:
+            raise ValueError("history_chunk_size must be a positive integer > 0")
+        if users_page_size <= 0:
+            raise ValueError("users_page_size must be a positive integer > 0")
+        if users_max_page <= 0:
+            raise ValueError("users_max_page must be a positive integer > 0")
+        if rooms_page_size <= 0:
+            raise ValueError("rooms_page_size must be a positive integer > 0")
+        if rooms_max_page <= 0:
+            raise ValueError("rooms_max_page must be a positive integer > 0")
+        if rooms_refresh_interval < 0:
+            raise ValueError("rooms_refresh_interval can not be negative")
+        if resync_max_messages < 0:
+            raise ValueError("resync_max_messages can not be negative")
+        if heartbeat_interval < 0:
+            raise ValueError("heartbeat_interval can not be negative")
+        if heartbeat_interval > 0 and heartbeat_timeout <= heartbeat_interval:
+            raise ValueError(
+                "heartbeat_timeout must be greater than heartbeat_interval"
+            )
+        if session_token_ttl <= 0:
+            raise ValueError("session_token_ttl must be positive")
+        if password_workers < 0:
+            raise ValueError("password_workers can not be negative")
+        if password_max_pending <= 0:
+            raise ValueError("password_max_pending must be positive")
+        for name, rate, burst in [
+            ("connection", chat_rate_connection, chat_burst_connection),
+            ("user", chat_rate_user, chat_burst_user),
+            ("room", chat_rate_room, chat_burst_room),
+        ]:
+            if rate < 0:
+                raise ValueError(f"chat_rate_{name} can not be negative")
+            if rate > 0 and burst < 1:
+                raise ValueError(f"chat_burst_{name} must be at least 1")
+
+        self.flush_max_delay = flush_max_delay
+        self.flush_max_bytes = flush_max_bytes
+        self.outbound_max_frames = outbound_max_frames
+        self.outbound_max_bytes = outbound_max_bytes
+        self.overflow_policy = overflow_policy
+        self.compression_min_size = compression_min_size
+        self.resend_window_frames = resend_window_frames
+        self.resend_window_bytes = resend_window_bytes
+        self.history_page_size = history_page_size
+        self.history_max_page = history_max_page
+        self.history_chunk_size = history_chunk_size
+        self.room_history = room_history
+        self.users_page_size = users_page_size
+        self.users_max_page = users_max_page
+        self.rooms_page_size = rooms_page_size
+        self.rooms_max_page = rooms_max_page
+        self.rooms_refresh_interval = rooms_refresh_interval
+        self.resync_max_messages = resync_max_messages
+        self.heartbeat_interval = heartbeat_interval
+        self.heartbeat_timeout = heartbeat_timeout
+        self.session_secret = session_secret
+        self.session_token_ttl = session_token_ttl
+        self.cluster_secret = cluster_secret
+        self.password_workers = password_workers
+        self.password_max_pending = password_max_pending
+        self.chat_rate_connection = chat_rate_connection
+        self.chat_burst_connection = chat_burst_connection
+        self.chat_rate_user = chat_rate_user
+        self.chat_burst_user = chat_burst_user
+        self.chat_rate_room = chat_rate_room
+        self.chat_burst_room = chat_burst_room
+        self.handler_timing = handler_timing
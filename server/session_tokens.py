@@ -0,0 +1,83 @@
+import base64
+import hashlib
+import hmac
+import json
+import os
+import time
+from typing import Tuple
+
+# Seconds a session token stays valid
+SESSION_TOKEN_TTL = 24 * 60 * 60
+
+
+class InvalidTokenError(Exception):
+    def __init__(self, *args: object) -> None:
+        super().__init__(*args)
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+
+def _b64decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+
+class SessionTokens:
+    """Issues and checks signed, expiring session tokens
+
+    A token is the base64 encoded [userid, username, expires] followed by
+    its HMAC-SHA256 signature, so checking one needs no database lookup and
+    no password hash. Tokens are only valid on servers sharing the secret.
+
+    Args:
+        secret (bytes | None): HMAC key. Defaults to a random key, which
+            invalidates every token when the server restarts.
+        ttl (float): Seconds a token stays valid.
+    """
+
+    def __init__(self, secret: bytes | None = None, ttl: float = SESSION_TOKEN_TTL):
+        if ttl <= 0:
+            raise ValueError("ttl must be positive")
+        self._secret = secret if secret is not None else os.urandom(32)
+        self.ttl = ttl
+
+    def issue(self, userid: str, username: str, now: float | None = None) -> str:
+        now = time.time() if now is None else now
+        body = json.dumps([userid, username, int(now + self.ttl)])
+        payload = _b64encode(body.encode("utf-8"))
+        return f"{payload}.{self._sign(payload)}"
+
+    def verify(self, token: str, now: float | None = None) -> Tuple[str, str]:
+        """Checks a token's signature and expiry
+
+        Raises:
+            InvalidTokenError: The token is malformed, forged or expired
+
+        Returns:
+            Tuple[str, str]: The (userid, username) the token was issued to
+        """
+        if not isinstance(token, str) or token.count(".") != 1:
+            raise InvalidTokenError("Malformed session token")
+        payload, signature = token.split(".")
+        try:
+            # Both only take ASCII text, tokens are base64
+            valid = hmac.compare_digest(signature, self._sign(payload))
+        except (TypeError, UnicodeError) as e:
+            raise InvalidTokenError("Malformed session token") from e
+        if not valid:
+            raise InvalidTokenError("Invalid session token signature")
+
+        try:
+            userid, username, expires = json.loads(_b64decode(payload))
+        except ValueError as e:
+            raise InvalidTokenError("Malformed session token") from e
+
+        now = time.time() if now is None else now
+        if now >= expires:
+            raise InvalidTokenError("Session token expired")
+        return userid, username
+
+    def _sign(self, payload: str) -> str:
+        digest = hmac.new(self._secret, payload.encode("ascii"), hashlib.sha256)
+        return _b64encode(digest.digest())
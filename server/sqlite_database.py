@@ -57,6 +57,12 @@ DROP_TABLE_MESSAGES = """
 DROP TABLE IF EXISTS messages
 """
 
+# Serves history pages by keyset on (createdate, rowid) within a room
+CREATE_INDEX_MESSAGES_ROOM = """
+CREATE INDEX IF NOT EXISTS index_messages_room
+ON messages (roomid, createdate)
+"""
+
 CREATE_TABLE_BLACKLIST = """
 CREATE TABLE IF NOT EXISTS blacklisted_users (
     userid TEXT NOT NULL,
@@ -228,6 +234,63 @@ ORDER BY m.createdate ASC
 LIMIT ?
 """
 
+SELECT_LATEST_MESSAGES_BY_ROOMID = """
+SELECT
+    m.id,
+    u.username AS authorname,
+    m.authorid,
+    m.roomid,
+    m.target_userid,
+    m.message,
+    m.createdate
+FROM messages AS m
+INNER JOIN users AS u
+    ON m.authorid = u.id
+WHERE m.roomid = ?
+ORDER BY m.createdate DESC, m.rowid DESC
+LIMIT ?
+"""
+
+SELECT_MESSAGES_BY_ROOMID_BEFORE = """
+SELECT
+    m.id,
+    u.username AS authorname,
+    m.authorid,
+    m.roomid,
+    m.target_userid,
+    m.message,
+    m.createdate
+FROM messages AS m
+INNER JOIN users AS u
+    ON m.authorid = u.id
+WHERE m.roomid = ?
+    AND (m.createdate, m.rowid) < (?, ?)
+ORDER BY m.createdate DESC, m.rowid DESC
+LIMIT ?
+"""
+
+SELECT_MESSAGE_POSITION = """
+SELECT createdate, rowid FROM messages WHERE id = ? AND roomid = ?
+"""
+
+SELECT_MESSAGES_BY_ROOMID_AFTER = """
+SELECT
+    m.id,
+    u.username AS authorname,
+    m.authorid,
+    m.roomid,
+    m.target_userid,
+    m.message,
+    m.createdate
+FROM messages AS m
+INNER JOIN users AS u
+    ON m.authorid = u.id
+WHERE m.roomid = ?
+    AND (m.createdate, m.rowid) > (?, ?)
+ORDER BY m.createdate ASC, m.rowid ASC
+LIMIT ?
+"""
+
 
 class AbstractID(ABC):
     @abstractmethod
@@ -264,6 +327,7 @@ class SqliteDatabase(AbstractDatabase):
             cursor.execute(CREATE_TABLE_USERS)
             cursor.execute(CREATE_TABLE_ROOMS)
             cursor.execute(CREATE_TABLE_MESSAGES)
+            cursor.execute(CREATE_INDEX_MESSAGES_ROOM)
             cursor.execute(CREATE_TABLE_BLACKLIST)
             cursor.execute(CREATE_TRIGGER_BLACKLIST)
             cursor.execute(CREATE_TRIGGER_NONE_MESSAGE)
@@ -485,6 +549,93 @@ class SqliteDatabase(AbstractDatabase):
                 )
         return result
 
+    def get_room_messages_before(
+        self, roomid: str, before: str | None = None, limit: int = 30
+    ) -> List[Dict[str, str]] | None:
+        if roomid is None:
+            raise ValueError("roomid can not be None")
+        roomid = roomid.strip()
+        if len(roomid) == 0:
+            raise ValueError("roomid can not be empty")
+        if limit <= 0:
+            raise ValueError("limit must be a postive integer > 0")
+
+        conn = self.open_connection()
+        if conn is None:
+            return None
+
+        result: List[Dict[str, str]] = []
+
+        with conn:
+            cursor = conn.cursor()
+            if before is None or len(before) == 0:
+                cursor.execute(SELECT_LATEST_MESSAGES_BY_ROOMID, (roomid, limit))
+            else:
+                cursor.execute(SELECT_MESSAGE_POSITION, (before.strip(), roomid))
+                position = cursor.fetchone()
+                if position is None:
+                    raise ConstraintError("NOT FOUND: Message not found")
+                cursor.execute(
+                    SELECT_MESSAGES_BY_ROOMID_BEFORE, (roomid, *position, limit)
+                )
+
+            rows = cursor.fetchall()
+            # Rows come newest first, pages are returned oldest first
+            for row in reversed(rows):
+                result.append(
+                    {
+                        "id": row[0],
+                        "authorname": row[1],
+                        "authorid": row[2],
+                        "roomid": row[3],
+                        "target_userid": row[4],
+                        "message": row[5],
+                        "createdate": row[6],
+                    }
+                )
+        return result
+
+    def get_room_messages_after(
+        self, roomid: str, after: str, limit: int = 30
+    ) -> List[Dict[str, str]] | None:
+        if roomid is None:
+            raise ValueError("roomid can not be None")
+        roomid = roomid.strip()
+        if len(roomid) == 0:
+            raise ValueError("roomid can not be empty")
+        if after is None or len(after.strip()) == 0:
+            raise ValueError("after can not be empty")
+        if limit <= 0:
+            raise ValueError("limit must be a postive integer > 0")
+
+        conn = self.open_connection()
+        if conn is None:
+            return None
+
+        result: List[Dict[str, str]] = []
+
+        with conn:
+            cursor = conn.cursor()
+            cursor.execute(SELECT_MESSAGE_POSITION, (after.strip(), roomid))
+            position = cursor.fetchone()
+            if position is None:
+                raise ConstraintError("NOT FOUND: Message not found")
+
+            cursor.execute(SELECT_MESSAGES_BY_ROOMID_AFTER, (roomid, *position, limit))
+            for row in cursor.fetchall():
+                result.append(
+                    {
+                        "id": row[0],
+                        "authorname": row[1],
+                        "authorid": row[2],
+                        "roomid": row[3],
+                        "target_userid": row[4],
+                        "message": row[5],
+                        "createdate": row[6],
+                    }
+                )
+        return result
+
     def get_user_by_username(self, username: str) -> Dict[str, str]:
         if username is None:
             raise ValueError("username can not be none")
@@ -0,0 +1,879 @@
+from __future__ import annotations
+import asyncio
+from typing import List
+
+from .chat_server import ChatServer, ChatServerConnection
+from .chat_server_protocol import AbstractChatConnection, Chatroom, Presence
+from .metrics import METRICS
+from .server_config import ServerConfig
+from .sqlite_database import SqliteDatabase
+from common import (
+    CODECS,
+    COMPRESSIONS,
+    ERROR_TYPES,
+    FIELDS_ERROR_MESSAGE,
+    FIELDS_HELLO_RESPONSE_MESSAGE,
+    FIELDS_JOIN_ROOM_RESPONSE_MESSAGE,
+    FIELDS_RESEND_GAP_MESSAGE,
+    FIELDS_RESUME_RESPONSE_MESSAGE,
+    MESSAGE_TYPE,
+    MESSAGE_TYPES,
+    PROTOCOL_VERSION,
+    REQUEST_ID,
+    RESYNC_MODES,
+    FrameDecoder,
+    User,
+    WEBSOCKET_OPCODES,
+    WebSocketDecoder,
+    decode_message,
+    encode_websocket_frame,
+    handshake_request,
+    parse_handshake,
+    serialize_ack_message,
+    serialize_chat,
+    serialize_chat_messages,
+    serialize_error_message,
+    serialize_hello_message,
+    serialize_history_message,
+    serialize_join_room_message,
+    serialize_list_rooms_message,
+    serialize_list_users_message,
+    serialize_resend_message,
+    serialize_resume_message,
+)
+
+import pytest
+
+MASK = b"\x01\x02\x03\x04"
+
+
+class MockTransport(asyncio.WriteTransport):
+    def __init__(self) -> None:
+        super().__init__()
+        self.writes: List[bytes] = []
+        self.closed = False
+
+    def get_extra_info(self, name, default=None):
+        return default
+
+    def write(self, data) -> None:
+        self.writes.append(bytes(data))
+
+    def writelines(self, list_of_data) -> None:
+        self.buffers = list(list_of_data)
+        self.write(b"".join(list_of_data))
+
+    def close(self) -> None:
+        self.closed = True
+
+    def abort(self) -> None:
+        self.closed = True
+
+    def is_closing(self) -> bool:
+        return self.closed
+
+    def received(self) -> List[dict]:
+        decoder = FrameDecoder()
+        return [decode_message(p) for p in decoder.feed(b"".join(self.writes))]
+
+
+@pytest.fixture
+def server(tmp_path) -> ChatServer:
+    db = SqliteDatabase(db_name=str(tmp_path / "test.db"))
+    db._initialize_database(drop=True)
+    return ChatServer(db=db, config=ServerConfig())
+
+
+def connect(server: ChatServer) -> tuple[ChatServerConnection, MockTransport]:
+    connection = server._create_proto()
+    transport = MockTransport()
+    connection.connection_made(transport)
+    return connection, transport
+
+
+def test_sends_in_one_tick_are_coalesced(server: ChatServer):
+    async def _test():
+        connection, transport = connect(server)
+        for i in range(10):
+            await connection.send(serialize_error_message("test", f"{i}"))
+        assert transport.writes == []
+
+        await asyncio.sleep(0)
+        assert len(transport.writes) == 1
+        messages = [m["message"] for m in transport.received()]
+        assert messages == [f"{i}" for i in range(10)]
+
+    asyncio.run(_test())
+
+
+def test_flush_at_max_bytes(server: ChatServer):
+    async def _test():
+        server.config = ServerConfig(flush_max_bytes=1)
+        connection, transport = connect(server)
+        await connection.send(serialize_error_message("test", "first"))
+        assert len(transport.writes) == 1
+
+    asyncio.run(_test())
+
+
+def fill_paused_queue(connection: ChatServerConnection) -> None:
+    connection.pause_writing()
+    for i in range(3):
+        asyncio.run(connection.send(serialize_error_message("room", f"{i}"), "room"))
+    asyncio.run(connection.send(serialize_error_message("control", "c"), "control"))
+    asyncio.run(connection.send(serialize_error_message("room", "3"), "room"))
+
+
+def test_paused_connection_drops_room_traffic(server: ChatServer):
+    server.config = ServerConfig(outbound_max_frames=3)
+    connection, transport = connect(server)
+    fill_paused_queue(connection)
+
+    assert connection.queued_frames == 3
+    assert connection.dropped_frames == 2
+    assert server.get_metrics()["frames_dropped"] == 2
+
+    connection.resume_writing()
+    messages = [m["message"] for m in transport.received()]
+    assert messages == ["2", "c", "3"]
+
+
+def test_paused_connection_drops_oldest(server: ChatServer):
+    server.config = ServerConfig(outbound_max_frames=3, overflow_policy="drop_oldest")
+    connection, transport = connect(server)
+    fill_paused_queue(connection)
+
+    connection.resume_writing()
+    messages = [m["message"] for m in transport.received()]
+    assert messages == ["2", "c", "3"]
+    assert connection.dropped_frames == 2
+
+
+def test_paused_connection_disconnects(server: ChatServer):
+    server.config = ServerConfig(outbound_max_frames=3, overflow_policy="disconnect")
+    connection, transport = connect(server)
+    fill_paused_queue(connection)
+
+    assert connection.closed
+    assert connection not in server.connections
+    assert server.get_metrics()["slow_consumers_disconnected"] == 1
+
+
+def test_room_fan_out_encodes_once(server: ChatServer):
+    async def _test():
+        members = [connect(server) for _ in range(4)]
+        members[3][0].codec = CODECS.binary
+        for connection, _ in members:
+            server.lobby.join_room(connection)
+
+        chat = serialize_chat("hello", "1", "User1", roomid=server.lobby.id)
+        await server.forward_to_room(serialize_chat_messages([chat]), server.lobby.id)
+        await asyncio.sleep(0)
+
+        payloads = [transport.buffers[1] for _, transport in members]
+        assert payloads[0] is payloads[1] is payloads[2]
+        assert isinstance(payloads[3], bytes) and payloads[3] != payloads[0]
+        for _, transport in members:
+            assert transport.received()[0]["messages"][0]["message"] == "hello"
+
+    asyncio.run(_test())
+
+
+def sequenced(transport: MockTransport) -> List[tuple[int | None, dict]]:
+    frames = FrameDecoder().feed_sequenced(b"".join(transport.writes))
+    return [(sequence, decode_message(payload)) for sequence, payload in frames]
+
+
+def test_resend_from_window(server: ChatServer):
+    async def _test():
+        connection, transport = connect(server)
+        await server.handle_message(
+            decode_message(serialize_hello_message([CODECS.json], sequenced=True)),
+            connection,
+        )
+        for i in range(5):
+            await connection.send(serialize_error_message("test", f"{i}"))
+        await asyncio.sleep(0)
+        frames = sequenced(transport)
+        assert frames[0][0] is None  # hello_response
+        assert [s for s, _ in frames[1:]] == [1, 2, 3, 4, 5]
+
+        await server.handle_message(
+            decode_message(serialize_ack_message(2)), connection
+        )
+        transport.writes.clear()
+        await server.handle_message(
+            decode_message(serialize_resend_message(1, 4)), connection
+        )
+        await asyncio.sleep(0)
+        frames = sequenced(transport)
+
+        # 1 and 2 were acknowledged, so they are reported lost
+        assert frames[0][0] is None
+        assert frames[0][1][MESSAGE_TYPE] == MESSAGE_TYPES.resend_gap
+        assert frames[0][1][FIELDS_RESEND_GAP_MESSAGE.last_sequence] == 2
+        assert [(s, m["message"]) for s, m in frames[1:]] == [(3, "2"), (4, "3")]
+        assert server.get_metrics()[METRICS.frames_resent] == 2
+        assert server.get_metrics()[METRICS.resend_gaps] == 1
+
+    asyncio.run(_test())
+
+
+def test_resend_window_is_bounded(tmp_path):
+    db = SqliteDatabase(db_name=str(tmp_path / "test.db"))
+    db._initialize_database(drop=True)
+    server = ChatServer(db=db, config=ServerConfig(resend_window_frames=3))
+
+    async def _test():
+        connection, _ = connect(server)
+        connection.sequenced = True
+        for i in range(10):
+            await connection.send(serialize_error_message("test", f"{i}"))
+        assert [s for s, _, _ in connection._resend_window] == [8, 9, 10]
+
+    asyncio.run(_test())
+
+
+def test_responses_echo_request_id(server: ChatServer):
+    async def _test():
+        connection, transport = connect(server)
+        await server.handle_message(
+            decode_message(serialize_list_rooms_message(requestid="42")), connection
+        )
+        await server.handle_message(
+            decode_message(serialize_list_users_message("missing", "", requestid="43")),
+            connection,
+        )
+        await server.handle_message(
+            decode_message(serialize_list_rooms_message()), connection
+        )
+        await asyncio.sleep(0)
+        responses = transport.received()
+        assert [r[MESSAGE_TYPE] for r in responses] == [
+            MESSAGE_TYPES.list_rooms,
+            MESSAGE_TYPES.error,
+            MESSAGE_TYPES.list_rooms,
+        ]
+        assert [r.get(REQUEST_ID, None) for r in responses] == ["42", "43", None]
+
+    asyncio.run(_test())
+
+
+def test_history_pages_stream_in_chunks(tmp_path):
+    db = SqliteDatabase(db_name=str(tmp_path / "test.db"))
+    db._initialize_database(drop=True)
+    server = ChatServer(db=db, config=ServerConfig(history_chunk_size=4))
+    user = db.insert_user("User1", "Pass1")
+    for i in range(12):
+        db.insert_chat_message(user["id"], server.lobby.id, "NONE", f"{i}")
+
+    async def _test():
+        connection, transport = connect(server)
+        connection.user = User(username=user["username"], userid=user["id"])
+
+        # Not in the room yet
+        await server.handle_message(
+            decode_message(serialize_history_message(server.lobby.id)), connection
+        )
+        server.lobby.join_room(connection)
+        await server.handle_message(
+            decode_message(serialize_history_message(server.lobby.id, limit=10)),
+            connection,
+        )
+        await asyncio.sleep(0)
+        error, *chunks = transport.received()
+        assert error[MESSAGE_TYPE] == MESSAGE_TYPES.error
+
+        # Newest chunk first, each chunk oldest first
+        assert [[m["message"] for m in c["messages"]] for c in chunks] == [
+            ["8", "9", "10", "11"],
+            ["4", "5", "6", "7"],
+            ["2", "3"],
+        ]
+        assert all(c["more"] for c in chunks)
+
+        transport.writes.clear()
+        await server.handle_message(
+            decode_message(
+                serialize_history_message(server.lobby.id, chunks[-1]["cursor"])
+            ),
+            connection,
+        )
+        await asyncio.sleep(0)
+        (last,) = transport.received()
+        assert [m["message"] for m in last["messages"]] == ["0", "1"]
+        assert not last["more"]
+
+        # An unknown cursor is an error, not the end of the history
+        transport.writes.clear()
+        await server.handle_message(
+            decode_message(serialize_history_message(server.lobby.id, "unknown")),
+            connection,
+        )
+        await asyncio.sleep(0)
+        (error,) = transport.received()
+        assert error[MESSAGE_TYPE] == MESSAGE_TYPES.error
+        assert error[FIELDS_ERROR_MESSAGE.errortype] == ERROR_TYPES.message_not_found
+
+    asyncio.run(_test())
+
+
+def test_rejoin_resyncs_missed_messages(tmp_path):
+    db = SqliteDatabase(db_name=str(tmp_path / "test.db"))
+    db._initialize_database(drop=True)
+    server = ChatServer(
+        db=db,
+        config=ServerConfig(
+            history_page_size=5, history_chunk_size=2, resync_max_messages=3
+        ),
+    )
+    user = db.insert_user("User1", "Pass1")
+    ids = [
+        db.insert_chat_message(user["id"], server.lobby.id, "NONE", f"{i}")["id"]
+        for i in range(10)
+    ]
+
+    async def _test():
+        connection, transport = connect(server)
+        connection.user = User(username=user["username"], userid=user["id"])
+
+        async def join(lastid: str | None) -> List[dict]:
+            transport.writes.clear()
+            await server.handle_message(
+                decode_message(
+                    serialize_join_room_message(user["id"], "Lobby", lastid=lastid)
+                ),
+                connection,
+            )
+            await asyncio.sleep(0)
+            return transport.received()
+
+        def texts(chats: List[dict]) -> List[List[str]]:
+            return [[m["message"] for m in c["messages"]] for c in chats]
+
+        # Only the missed messages, in chunks
+        response, *chats = await join(ids[6])
+        assert response[FIELDS_JOIN_ROOM_RESPONSE_MESSAGE.resync] == RESYNC_MODES.delta
+        assert texts(chats) == [["7", "8"], ["9"]]
+
+        response, *chats = await join(ids[-1])
+        assert response[FIELDS_JOIN_ROOM_RESPONSE_MESSAGE.resync] == RESYNC_MODES.delta
+        assert chats == []
+
+        # Too far behind, or an unknown id, reloads the latest page
+        for lastid in (ids[2], "unknown"):
+            response, *chats = await join(lastid)
+            assert (
+                response[FIELDS_JOIN_ROOM_RESPONSE_MESSAGE.resync] == RESYNC_MODES.full
+            )
+            assert texts(chats) == [["5", "6"], ["7", "8"], ["9"]]
+
+        # A plain join is unchanged
+        response, *chats = await join(None)
+        assert FIELDS_JOIN_ROOM_RESPONSE_MESSAGE.resync not in response
+        assert len(chats) == 3
+
+        assert server.metrics.get(METRICS.resyncs_delta) == 2
+        assert server.metrics.get(METRICS.resyncs_full) == 2
+        assert server.metrics.get(METRICS.resync_messages) == 3
+
+    asyncio.run(_test())
+
+
+def test_silent_connections_are_pinged_then_reaped(tmp_path):
+    db = SqliteDatabase(db_name=str(tmp_path / "test.db"))
+    db._initialize_database(drop=True)
+    server = ChatServer(
+        db=db, config=ServerConfig(heartbeat_interval=10, heartbeat_timeout=30)
+    )
+
+    async def _test():
+        quiet, quiet_transport = connect(server)
+        busy, busy_transport = connect(server)
+        await server.handle_message(
+            decode_message(serialize_hello_message([CODECS.json], sequenced=True)),
+            quiet,
+        )
+        server.lobby.join_room(quiet)
+        server.lobby.join_room(busy)
+        await asyncio.sleep(0)
+        start = quiet.last_received
+        quiet_transport.writes.clear()
+
+        server.check_heartbeats(start + 5)
+        await asyncio.sleep(0)
+        assert quiet_transport.writes == []
+
+        busy.last_received = start + 12
+        server.check_heartbeats(start + 15)
+        await asyncio.sleep(0)
+        # Pings are unsequenced so they never enter the resend window
+        ((sequence, ping),) = sequenced(quiet_transport)
+        assert sequence is None
+        assert ping[MESSAGE_TYPE] == MESSAGE_TYPES.ping
+        assert busy_transport.writes == []
+
+        busy.last_received = start + 40
+        server.check_heartbeats(start + 45)
+        assert quiet_transport.closed
+        assert quiet not in server.connections
+        assert list(server.lobby.connections) == [busy]
+        assert server.metrics.get(METRICS.connections_reaped) == 1
+        assert server.metrics.get(METRICS.pings_sent) == 1
+
+    asyncio.run(_test())
+
+
+def test_resume_restores_user_and_room(server: ChatServer):
+    user = server._db.insert_user("User1", "Pass1")
+    room_data = server._db.insert_room("Room 1")
+    room = Chatroom(room_data["id"], room_data["name"])
+    server.rooms[room.id] = room
+    ids = [
+        server._db.insert_chat_message(user["id"], room.id, "NONE", f"{i}")["id"]
+        for i in range(5)
+    ]
+
+    async def _test():
+        # The old connection went half-open after message 2 arrived
+        old, old_transport = connect(server)
+        old.user = User(username=user["username"], userid=user["id"])
+        server.user_connections[user["id"]] = old
+        room.join_room(old)
+
+        connection, transport = connect(server)
+        token = server.sessions.issue(user["id"], user["username"])
+        await server.handle_message(
+            decode_message(serialize_resume_message(token, room.id, ids[2])),
+            connection,
+        )
+        await asyncio.sleep(0)
+        resumed, joined, chats = transport.received()
+        assert resumed[MESSAGE_TYPE] == MESSAGE_TYPES.resume_response
+        assert resumed[FIELDS_RESUME_RESPONSE_MESSAGE.userid] == user["id"]
+        assert server.sessions.verify(resumed[FIELDS_RESUME_RESPONSE_MESSAGE.token])
+        assert joined[FIELDS_JOIN_ROOM_RESPONSE_MESSAGE.roomid] == room.id
+        assert joined[FIELDS_JOIN_ROOM_RESPONSE_MESSAGE.resync] == RESYNC_MODES.delta
+        assert [m["message"] for m in chats["messages"]] == ["3", "4"]
+
+        assert old_transport.closed
+        assert server.user_connections[user["id"]] is connection
+        assert list(room.connections) == [connection]
+        assert server.metrics.get(METRICS.sessions_resumed) == 1
+
+        rejected, rejected_transport = connect(server)
+        await server.handle_message(
+            decode_message(serialize_resume_message(token + "x", room.id)),
+            rejected,
+        )
+        await asyncio.sleep(0)
+        (error,) = rejected_transport.received()
+        assert error[FIELDS_ERROR_MESSAGE.errortype] == ERROR_TYPES.invalid_session
+        assert rejected.user is None
+        assert server.metrics.get(METRICS.session_resumes_rejected) == 1
+
+    asyncio.run(_test())
+
+
+def test_direct_messages_reach_a_resumed_connection(server: ChatServer):
+    async def _test():
+        old, _ = connect(server)
+        old.user = User(username="User1", userid="u1")
+        server.user_connections["u1"] = old
+        server.lobby.join_room(old)
+
+        connection, transport = connect(server)
+        token = server.sessions.issue("u1", "User1")
+        await server.handle_message(
+            decode_message(serialize_resume_message(token, server.lobby.id)),
+            connection,
+        )
+        # The transport of the closed connection reports it lost afterwards
+        old.connection_lost(None)
+        assert server.user_connections["u1"] is connection
+
+        await server.forward_to_user(serialize_list_rooms_message(), "u1")
+        await asyncio.sleep(0)
+        assert transport.received()[-1][MESSAGE_TYPE] == MESSAGE_TYPES.list_rooms
+
+    asyncio.run(_test())
+
+
+def test_hello_negotiates_per_connection(tmp_path):
+    db = SqliteDatabase(db_name=str(tmp_path / "test.db"))
+    db._initialize_database(drop=True)
+    server = ChatServer(db=db, config=ServerConfig(flush_max_delay=10))
+
+    async def _test():
+        legacy, legacy_transport = connect(server)
+        await server.handle_message(
+            {MESSAGE_TYPE: MESSAGE_TYPES.hello, "codecs": [CODECS.binary]}, legacy
+        )
+        modern, modern_transport = connect(server)
+        await server.handle_message(
+            decode_message(
+                serialize_hello_message(
+                    [CODECS.json], version=PROTOCOL_VERSION + 1, max_frame_size=100
+                )
+            ),
+            modern,
+        )
+        interactive, interactive_transport = connect(server)
+        await server.handle_message(
+            decode_message(serialize_hello_message([CODECS.json], batching=False)),
+            interactive,
+        )
+
+        assert (legacy.version, legacy.batching) == (1, True)
+        assert (modern.version, modern.max_frame_size) == (PROTOCOL_VERSION, 100)
+        assert not interactive.batching
+
+        # Without batching, writes are not held back for flush_max_delay
+        await asyncio.sleep(0)
+        (response,) = interactive_transport.received()
+        assert response[FIELDS_HELLO_RESPONSE_MESSAGE.batching] is False
+        assert response[FIELDS_HELLO_RESPONSE_MESSAGE.version] == PROTOCOL_VERSION
+        assert legacy_transport.writes == []
+
+        # Frames larger than the client accepts are never sent
+        modern.flush()
+        modern_transport.writes.clear()
+        await modern.send(serialize_error_message("test", "x" * 100))
+        await modern.send(serialize_error_message("test", "ok"))
+        modern.flush()
+        assert [m["message"] for m in modern_transport.received()] == ["ok"]
+        assert server.metrics.get(METRICS.frames_oversized) == 1
+
+    asyncio.run(_test())
+
+
+def test_websocket_connection(server: ChatServer):
+    async def _test():
+        connection = server._create_websocket_proto()
+        transport = MockTransport()
+        connection.connection_made(transport)
+        # Not a chat connection until the upgrade completes
+        assert connection not in server.connections
+
+        request, expected = handshake_request("localhost", 5002)
+        hello = serialize_hello_message(
+            [CODECS.json], compressions=[COMPRESSIONS.deflate], sequenced=True
+        ).encode()
+        connection.data_received(request[:10])
+        connection.data_received(
+            request[10:] + encode_websocket_frame(WEBSOCKET_OPCODES.text, hello, MASK)
+        )
+        assert connection in server.connections
+        assert parse_handshake(transport.writes[0])["sec-websocket-accept"] == expected
+        await asyncio.sleep(0)
+        # Compression and sequencing belong to chat frames, not WebSockets
+        assert connection.compression == COMPRESSIONS.none
+        assert not connection.sequenced
+
+        connection.data_received(
+            encode_websocket_frame(
+                WEBSOCKET_OPCODES.text, serialize_list_rooms_message().encode(), MASK
+            )
+            + encode_websocket_frame(WEBSOCKET_OPCODES.ping, b"hi", MASK)
+        )
+        await asyncio.sleep(0)
+        connection.flush()
+        decoder = WebSocketDecoder(require_mask=False)
+        messages = decoder.feed(b"".join(transport.writes[1:]))
+        assert [opcode for opcode, _ in messages] == [
+            WEBSOCKET_OPCODES.text,
+            WEBSOCKET_OPCODES.pong,
+            WEBSOCKET_OPCODES.text,
+        ]
+        assert decode_message(messages[0][1])[MESSAGE_TYPE] == (
+            MESSAGE_TYPES.hello_response
+        )
+        assert messages[1][1] == b"hi"
+        assert decode_message(messages[2][1])[MESSAGE_TYPE] == (
+            MESSAGE_TYPES.list_rooms
+        )
+
+        transport.writes.clear()
+        connection.data_received(
+            encode_websocket_frame(WEBSOCKET_OPCODES.close, b"", MASK)
+        )
+        ((opcode, _),) = decoder.feed(b"".join(transport.writes))
+        assert opcode == WEBSOCKET_OPCODES.close
+        assert transport.closed
+        assert connection not in server.connections
+
+    asyncio.run(_test())
+
+
+def test_websocket_rejects_bad_handshake(server: ChatServer):
+    connection = server._create_websocket_proto()
+    transport = MockTransport()
+
+    async def _test():
+        connection.connection_made(transport)
+        connection.data_received(b"GET / HTTP/1.1\r\nHost: localhost\r\n\r\n")
+
+    asyncio.run(_test())
+    assert transport.writes == [b"HTTP/1.1 400 Bad Request\r\n\r\n"]
+    assert transport.closed
+    assert connection not in server.connections
+
+
+def test_missing_fields_are_rejected_before_handlers(server: ChatServer):
+    async def _test():
+        connection, transport = connect(server)
+        await server.handle_message(
+            {MESSAGE_TYPE: MESSAGE_TYPES.register, "username": "User1"}, connection
+        )
+        await asyncio.sleep(0)
+        (error,) = transport.received()
+        assert error[FIELDS_ERROR_MESSAGE.errortype] == (
+            ERROR_TYPES.invalid_username_password
+        )
+
+    asyncio.run(_test())
+
+
+def test_password_work_is_bounded(tmp_path):
+    db = SqliteDatabase(db_name=str(tmp_path / "test.db"))
+    db._initialize_database(drop=True)
+    config = ServerConfig(password_workers=0, password_max_pending=1)
+    server = ChatServer(db=db, config=config)
+
+    async def _test():
+        first, first_transport = connect(server)
+        second, second_transport = connect(server)
+        await asyncio.gather(
+            *(
+                server.handle_message(
+                    {
+                        MESSAGE_TYPE: MESSAGE_TYPES.register,
+                        "username": f"User{i}",
+                        "password": "secret",
+                    },
+                    connection,
+                )
+                for i, connection in enumerate([first, second])
+            )
+        )
+        await asyncio.sleep(0)
+        (registered,) = first_transport.received()
+        assert registered["status"] == "registered"
+        (error,) = second_transport.received()
+        assert error[FIELDS_ERROR_MESSAGE.errortype] == ERROR_TYPES.server_busy
+        assert server.metrics.get(METRICS.password_jobs_rejected) == 1
+
+    asyncio.run(_test())
+
+
+def test_chat_is_rate_limited(tmp_path):
+    db = SqliteDatabase(db_name=str(tmp_path / "test.db"))
+    db._initialize_database(drop=True)
+    config = ServerConfig(
+        chat_rate_connection=0.001,
+        chat_burst_connection=3,
+        chat_rate_user=0.001,
+        chat_burst_user=2,
+        chat_rate_room=0.001,
+        chat_burst_room=4,
+    )
+    server = ChatServer(db=db, config=config)
+    handled: List[AbstractChatConnection] = []
+
+    async def handle_chat(message, source):
+        handled.append(source)
+
+    server.handlers.register(MESSAGE_TYPES.chat, handle_chat)
+
+    def chat(userid: str, roomid: str = "room1") -> dict:
+        return decode_message(
+            serialize_chat_messages([serialize_chat("hi", userid, "User", roomid)])
+        )
+
+    async def _test():
+        anonymous, anonymous_transport = connect(server)
+        for _ in range(4):
+            await server.handle_message(chat("", roomid="other"), anonymous)
+        user1, _ = connect(server)
+        user1.user = User(userid="id1", username="User1")
+        for _ in range(3):
+            await server.handle_message(chat("id1"), user1)
+        user2, _ = connect(server)
+        user2.user = User(userid="id2", username="User2")
+        for _ in range(3):
+            await server.handle_message(chat("id2"), user2)
+
+        # 3 per connection, 2 per user and 4 into room1
+        assert [handled.count(c) for c in [anonymous, user1, user2]] == [3, 2, 2]
+        await asyncio.sleep(0)
+        (error,) = anonymous_transport.received()
+        assert error[FIELDS_ERROR_MESSAGE.errortype] == ERROR_TYPES.rate_limited
+        assert server.metrics.get(METRICS.messages_rate_limited) == 3
+
+    asyncio.run(_test())
+
+
+def test_rooms_are_indexed_and_dropped_once_empty(server: ChatServer):
+    rooms = [Chatroom(f"id{i}", f"Room {i}") for i in range(3)]
+    for room in rooms:
+        server.rooms[room.id] = room
+    assert server.rooms.by_name("Room 1") is rooms[1]
+    assert server.rooms.by_name(server.lobby.name) is server.lobby
+
+    first, _ = connect(server)
+    second, _ = connect(server)
+    rooms[0].join_room(first)
+    server.lobby.join_room(second)
+    # Moving rooms leaves the previous one
+    rooms[1].join_room(first)
+    assert list(rooms[0].connections) == [] and list(rooms[1].connections) == [first]
+
+    # Empty rooms go, the lobby stays even once empty
+    server.remove_connection(second)
+    assert set(server.rooms) == {server.lobby.id, rooms[1].id}
+    assert server.rooms.by_name("Room 0") is None
+    server.remove_connection(first)
+    assert set(server.rooms) == {server.lobby.id}
+    assert len(server.connections) == 0
+
+
+def test_list_users_pages_from_the_presence_index(tmp_path):
+    db = SqliteDatabase(db_name=str(tmp_path / "test.db"))
+    db._initialize_database(drop=True)
+    server = ChatServer(db=db, config=ServerConfig(users_page_size=2))
+    lobby = server.lobby
+    members = []
+    for name in ["carol", "alice", "bob", "alan"]:
+        connection, _ = connect(server)
+        connection.user = User(userid=f"id-{name}", username=name)
+        lobby.join_room(connection)
+        members.append(connection)
+
+    async def list_users(**fields):
+        connection, transport = connect(server)
+        message = serialize_list_users_message(lobby.id, lobby.name, **fields)
+        await server.handle_message(decode_message(message), connection)
+        await asyncio.sleep(0)
+        (response,) = transport.received()
+        return response
+
+    async def _test():
+        first = await list_users(requestid="1")
+        assert first["users"] == ["alan", "alice"] and first["more"]
+        assert first[REQUEST_ID] == "1"
+        version = first["version"]
+        second = await list_users(cursor=first["cursor"], requestid="2")
+        assert second["users"] == ["bob", "carol"] and not second["more"]
+        assert (await list_users(prefix="al", limit=5))["users"] == ["alan", "alice"]
+
+        # The first page is encoded once until someone joins or leaves
+        assert len(lobby.presence._payloads) == 2
+        again = await list_users(requestid="3")
+        assert again["users"] == first["users"] and again[REQUEST_ID] == "3"
+        lobby.leave_room(members[3])
+        assert len(lobby.presence._payloads) == 0
+        after = await list_users()
+        assert after["users"] == ["alice", "bob"] and after["version"] > version
+
+    asyncio.run(_test())
+
+
+def test_presence_keeps_names_sorted_as_members_change():
+    presence = Presence()
+    for name in ["carol", "alice", "bob"]:
+        presence.add(name)
+    names = presence.usernames
+    presence.add("alan")
+    presence.add("bob")
+    presence.remove("carol")
+    presence.remove("bob")
+    # Updated in place, never sorted again
+    assert presence.usernames is names
+    assert names == ["alan", "alice", "bob"]
+
+
+def test_list_rooms_served_from_the_room_directory(tmp_path):
+    db = SqliteDatabase(db_name=str(tmp_path / "test.db"))
+    db._initialize_database(drop=True)
+    for name in ["Dogs", "Cats", "Cars"]:
+        db.insert_room(name)
+    server = ChatServer(
+        db=db, config=ServerConfig(rooms_page_size=2, rooms_refresh_interval=0)
+    )
+
+    async def list_rooms(**fields):
+        connection, transport = connect(server)
+        message = serialize_list_rooms_message(**fields)
+        await server.handle_message(decode_message(message), connection)
+        await asyncio.sleep(0)
+        (response,) = transport.received()
+        return response
+
+    async def _test():
+        first = await list_rooms(requestid="1")
+        assert first["rooms"] == ["Cars", "Cats"] and first["more"]
+        assert first[REQUEST_ID] == "1"
+        version = first["version"]
+        second = await list_rooms(cursor=first["cursor"])
+        assert second["rooms"] == ["Dogs", "Lobby"] and not second["more"]
+        assert (await list_rooms(prefix="Ca", limit=5))["rooms"] == ["Cars", "Cats"]
+
+        # A client holding the current version only gets the version back
+        unchanged = await list_rooms(version=version, requestid="2")
+        assert "rooms" not in unchanged
+        assert unchanged["version"] == version and unchanged[REQUEST_ID] == "2"
+
+        # Rooms are added without reading the database again
+        server.room_directory.add("Birds")
+        changed = await list_rooms(version=version)
+        assert changed["rooms"] == ["Birds", "Cars"] and changed["version"] > version
+
+    asyncio.run(_test())
+
+
+def test_joins_are_answered_from_the_room_history(tmp_path):
+    db = SqliteDatabase(db_name=str(tmp_path / "test.db"))
+    db._initialize_database(drop=True)
+    server = ChatServer(
+        db=db, config=ServerConfig(history_page_size=3, history_chunk_size=2)
+    )
+    user = db.insert_user("User1", "Pass1")
+    ids = [
+        db.insert_chat_message(user["id"], server.lobby.id, "NONE", f"{i}")["id"]
+        for i in range(4)
+    ]
+    reads = []
+    get_room_messages_before = db.get_room_messages_before
+
+    def counted(*args):
+        reads.append(args)
+        return get_room_messages_before(*args)
+
+    db.get_room_messages_before = counted
+
+    async def join(lastid: str | None = None) -> List[List[str]]:
+        connection, transport = connect(server)
+        connection.user = User(username=user["username"], userid=user["id"])
+        message = serialize_join_room_message(user["id"], "Lobby", lastid=lastid)
+        await server.handle_message(decode_message(message), connection)
+        await asyncio.sleep(0)
+        _, *chats = transport.received()
+        return [[m["message"] for m in c["messages"]] for c in chats]
+
+    async def _test():
+        assert await join() == [["1", "2"], ["3"]]
+        frames = server.lobby.history.frames(CODECS.json)
+        assert await join() == [["1", "2"], ["3"]]
+        assert server.lobby.history.frames(CODECS.json) is frames
+
+        # New chat traffic is kept without reading the database again
+        chat = serialize_chat("4", user["id"], user["username"], server.lobby.id)
+        chat["id"] = "new"
+        await server.forward_to_room(
+            serialize_chat_messages([chat]), server.lobby.id, [chat]
+        )
+        assert await join() == [["2", "3"], ["4"]]
+        assert await join(ids[-1]) == [["4"]]
+        assert len(reads) == 1
+
+    asyncio.run(_test())
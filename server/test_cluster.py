@@ -0,0 +1,156 @@
+from __future__ import annotations
+import asyncio
+from typing import Any, Dict, List
+
+from .chat_server_protocol import AbstractChatConnection
+from .cluster import BROKER_OPS, Broker, BrokerClient, ClusterServer, encode_broker_op
+from .server_config import ServerConfig
+from .sqlite_database import SqliteDatabase
+from common import (
+    MESSAGE_TYPE,
+    MESSAGE_TYPES,
+    User,
+    decode_message,
+    encode_frame,
+    serialize_chat,
+    serialize_chat_messages,
+    serialize_list_rooms_message,
+    serialize_resume_message,
+)
+
+
+class MockConnection(AbstractChatConnection):
+    def __init__(self, parent: ClusterServer, user: User) -> None:
+        super().__init__(user, None)
+        self.parent = parent
+        self.sent: List[Dict[str, Any]] = []
+        parent.add_connection(self)
+        parent.user_connections[user.userid] = self
+
+    async def send(self, message, kind=None) -> None:
+        self.sent.append(decode_message(message))
+
+    def close(self):
+        self._is_closed = True
+        self.parent.remove_connection(self)
+
+
+def test_nodes_share_rooms_and_users_through_the_broker(tmp_path):
+    db_name = str(tmp_path / "test.db")
+    SqliteDatabase(db_name=db_name)._initialize_database(drop=True)
+    # Nodes share a database and accept each other's session tokens
+    config = ServerConfig(session_secret=b"secret", cluster_secret=b"cluster")
+    nodes = [
+        ClusterServer(db=SqliteDatabase(db_name=db_name), config=config)
+        for _ in range(2)
+    ]
+    lobby = nodes[0].lobby
+
+    async def _test():
+        loop = asyncio.get_running_loop()
+        broker = Broker(b"cluster")
+        listener = await loop.create_server(broker.link, "127.0.0.1", 0)
+        port = listener.sockets[0].getsockname()[1]
+        for node in nodes:
+            _, node.broker = await loop.create_connection(
+                lambda: BrokerClient(node), "127.0.0.1", port
+            )
+
+        first = MockConnection(nodes[0], User("id1", "User1"))
+        second = MockConnection(nodes[1], User("id2", "User2"))
+        await nodes[0]._join_room(lobby, first)
+        await nodes[1]._join_room(lobby, second)
+        await asyncio.sleep(0.05)
+        assert len(broker.subscribers[lobby.id]) == 2
+        assert set(broker.directory) == {"id1", "id2"}
+
+        # Room messages reach members on both nodes, once each
+        first.sent.clear()
+        second.sent.clear()
+        await nodes[0].forward_to_room(serialize_list_rooms_message(), lobby.id)
+        await asyncio.sleep(0.05)
+        assert [m[MESSAGE_TYPE] for m in first.sent] == [MESSAGE_TYPES.list_rooms]
+        assert [m[MESSAGE_TYPE] for m in second.sent] == [MESSAGE_TYPES.list_rooms]
+
+        # Direct messages are routed to the node holding the user
+        await nodes[1].forward_to_user(serialize_list_rooms_message(), "id1")
+        await asyncio.sleep(0.05)
+        assert len(first.sent) == 2 and len(second.sent) == 1
+
+        # Chats published by another node are kept in the room history
+        histories = [node._room_history(node.lobby) for node in nodes]
+        chat = serialize_chat("hello", "id1", "User1", roomid=lobby.id)
+        await nodes[0].forward_to_room(
+            serialize_chat_messages([chat]), lobby.id, [chat]
+        )
+        await asyncio.sleep(0.05)
+        assert [len(history) for history in histories] == [1, 1]
+
+        # Resuming on another node closes the connection left behind
+        token = nodes[1].sessions.issue("id2", "User2")
+        resumed = MockConnection(nodes[0], User("id3", "User3"))
+        await nodes[0].handle_resume(
+            decode_message(serialize_resume_message(token)), resumed
+        )
+        await asyncio.sleep(0.05)
+        assert second.closed
+        assert broker.directory["id2"] is broker.directory["id1"]
+        # The node without members stops receiving the lobby's messages
+        (link,) = broker.subscribers[lobby.id]
+        assert link is broker.directory["id1"]
+
+        for node in nodes:
+            node.broker.close()
+        await asyncio.sleep(0.05)
+        assert broker.subscribers == {} and broker.directory == {}
+        listener.close()
+
+    asyncio.run(_test())
+
+
+def test_broker_only_serves_nodes_that_know_the_secret(tmp_path):
+    db_name = str(tmp_path / "test.db")
+    SqliteDatabase(db_name=db_name)._initialize_database(drop=True)
+    node = ClusterServer(
+        db=SqliteDatabase(db_name=db_name),
+        config=ServerConfig(cluster_secret=b"cluster"),
+    )
+    intruder = ClusterServer(
+        db=SqliteDatabase(db_name=db_name),
+        config=ServerConfig(cluster_secret=b"guess"),
+    )
+
+    async def _test():
+        loop = asyncio.get_running_loop()
+        broker = Broker(b"cluster")
+        listener = await loop.create_server(broker.link, "127.0.0.1", 0)
+        port = listener.sockets[0].getsockname()[1]
+        _, node.broker = await loop.create_connection(
+            lambda: BrokerClient(node), "127.0.0.1", port
+        )
+        # Sent before the challenge arrives, held until it is answered
+        node.broker.subscribe("room")
+        _, intruder.broker = await loop.create_connection(
+            lambda: BrokerClient(intruder), "127.0.0.1", port
+        )
+        intruder.broker.subscribe("room")
+        await asyncio.wait_for(intruder.broker.lost, 1)
+        (link,) = broker.subscribers["room"]
+        assert link.authenticated
+
+        # Operations without the handshake, or that are not JSON, are refused
+        for frame in [
+            encode_broker_op(BROKER_OPS.publish, "room", "{}"),
+            encode_frame(b"\xe9not json"),
+        ]:
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.write(frame)
+            while await reader.read(65536) != b"":
+                pass
+            writer.close()
+        assert list(broker.subscribers) == ["room"]
+
+        node.broker.close()
+        listener.close()
+
+    asyncio.run(_test())
@@ -0,0 +1,250 @@
+from __future__ import annotations
+import asyncio
+
+from .chat_server import ChatServerConnection
+from .chat_server_protocol import Chatroom
+from .frontends import (
+    BusClient,
+    Bus,
+    CoreLink,
+    Frontend,
+    LINK_OPS,
+    ShardServer,
+    shard_for_room,
+)
+from .server_config import ServerConfig
+from .sqlite_database import SqliteDatabase
+from common import (
+    CODECS,
+    MESSAGE_TYPE,
+    MESSAGE_TYPES,
+    REQUEST_ID,
+    FrameDecoder,
+    decode_message,
+    encode_frame,
+    serialize_hello_message,
+    serialize_list_rooms_message,
+    serialize_list_users_message,
+    serialize_resume_message,
+)
+
+
+def test_frontend_forwards_to_core(tmp_path):
+    db = SqliteDatabase(db_name=str(tmp_path / "test.db"))
+    db._initialize_database(drop=True)
+    server = ShardServer(db=db, config=ServerConfig())
+    socket_path = str(tmp_path / "core.sock")
+
+    async def _test():
+        loop = asyncio.get_running_loop()
+        core = await loop.create_unix_server(lambda: CoreLink(server), socket_path)
+        frontend = Frontend(ServerConfig())
+        await loop.create_unix_connection(lambda: frontend.links[0], socket_path)
+        listener = await loop.create_server(
+            lambda: ChatServerConnection(parent=frontend), "127.0.0.1", 0
+        )
+        port = listener.sockets[0].getsockname()[1]
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        decoder = FrameDecoder()
+
+        async def receive():
+            while True:
+                payloads = decoder.feed(await reader.read(65536))
+                if len(payloads) > 0:
+                    return [decode_message(p) for p in payloads]
+
+        # hello is answered by the frontend, list_rooms by the core
+        writer.write(encode_frame(serialize_hello_message([CODECS.binary]).encode()))
+        (response,) = await receive()
+        assert response[MESSAGE_TYPE] == MESSAGE_TYPES.hello_response
+        assert len(frontend.connections) == 1
+        assert len(server.connections) == 0
+
+        list_rooms = serialize_list_rooms_message(codec=CODECS.binary, requestid="r1")
+        writer.write(encode_frame(list_rooms))
+        (response,) = await receive()
+        assert response[MESSAGE_TYPE] == MESSAGE_TYPES.list_rooms
+        assert response[REQUEST_ID] == "r1"
+        assert "Lobby" in response["rooms"]
+        (proxy,) = server.connections
+        assert proxy.codec == CODECS.binary
+
+        # Closing on the core closes the client's socket
+        proxy.close()
+        assert await reader.read() == b""
+        await asyncio.sleep(0.05)
+        assert len(frontend.connections) == 0
+
+        # A client leaving removes its stand-in from the core
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(encode_frame(serialize_list_rooms_message().encode()))
+        await receive()
+        assert len(server.connections) == 1
+        writer.close()
+        await asyncio.sleep(0.05)
+        assert len(server.connections) == 0
+
+        # Losing the core drops every client of the frontend
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        await asyncio.sleep(0.05)
+        frontend.links[0].transport.close()
+        await asyncio.wait_for(frontend.lost, 1)
+        assert await reader.read() == b""
+
+        listener.close()
+        core.close()
+
+    asyncio.run(_test())
+
+
+def test_shards_route_rooms_and_reach_users_through_the_bus(tmp_path):
+    db_name = str(tmp_path / "test.db")
+    SqliteDatabase(db_name=db_name)._initialize_database(drop=True)
+    # Tokens issued by one core are accepted by the other
+    config = ServerConfig(session_secret=b"secret")
+    servers = [
+        ShardServer(db=SqliteDatabase(db_name=db_name), config=config, shard=shard)
+        for shard in range(2)
+    ]
+    user = servers[0]._db.insert_user("User1", b"hash")
+    token = servers[0].sessions.issue(user["id"], user["username"])
+    lobby = shard_for_room("Lobby", 2)
+    other = 1 - lobby
+    roomname = next(
+        f"room{i}" for i in range(10) if shard_for_room(f"room{i}", 2) == other
+    )
+    room = Chatroom("r2", roomname)
+    servers[other].rooms[room.id] = room
+
+    async def _test():
+        loop = asyncio.get_running_loop()
+        bus = Bus()
+        listeners = [
+            await loop.create_unix_server(bus.link, str(tmp_path / "bus.sock"))
+        ]
+        frontend = Frontend(ServerConfig(), shards=2)
+        for server in servers:
+            _, server.bus = await loop.create_unix_connection(
+                lambda: BusClient(server), str(tmp_path / "bus.sock")
+            )
+            path = str(tmp_path / f"core-{server.shard}.sock")
+            listeners.append(
+                await loop.create_unix_server(lambda s=server: CoreLink(s), path)
+            )
+            await loop.create_unix_connection(
+                lambda: frontend.links[server.shard], path
+            )
+        listener = await loop.create_server(
+            lambda: ChatServerConnection(parent=frontend), "127.0.0.1", 0
+        )
+        port = listener.sockets[0].getsockname()[1]
+
+        async def connect():
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            decoder = FrameDecoder()
+
+            async def receive(message_type):
+                while True:
+                    data = await asyncio.wait_for(reader.read(65536), 1)
+                    if data == b"":
+                        return None
+                    for payload in decoder.feed(data):
+                        message = decode_message(payload)
+                        if message[MESSAGE_TYPE] == message_type:
+                            return message
+
+            return writer, receive
+
+        # Resuming with a room no core holds lands in the lobby's core
+        writer, receive = await connect()
+        writer.write(encode_frame(serialize_resume_message(token).encode()))
+        assert await receive(MESSAGE_TYPES.resume_response) is not None
+        assert user["id"] in servers[lobby].user_connections
+        await asyncio.sleep(0.05)
+        assert bus.directory == {user["id"]: lobby}
+
+        # A direct message from the other core goes through the bus
+        await servers[other].forward_to_user(serialize_list_rooms_message(), user["id"])
+        assert await receive(MESSAGE_TYPES.list_rooms) is not None
+
+        # A message about a room moves the connection and its user
+        servers[other].announce(room.id)
+        await asyncio.sleep(0.05)
+        writer.write(
+            encode_frame(serialize_list_users_message(room.id, roomname).encode())
+        )
+        assert await receive(MESSAGE_TYPES.list_users) is not None
+        await asyncio.sleep(0.05)
+        assert user["id"] not in servers[lobby].user_connections
+        assert user["id"] in servers[other].user_connections
+        assert bus.directory == {user["id"]: other}
+
+        # Resuming on another core closes the connection left behind
+        other_writer, receive_again = await connect()
+        other_writer.write(encode_frame(serialize_resume_message(token).encode()))
+        assert await receive_again(MESSAGE_TYPES.resume_response) is not None
+        assert await receive(MESSAGE_TYPES.list_rooms) is None
+        await asyncio.sleep(0.05)
+        assert bus.directory == {user["id"]: lobby}
+
+        listener.close()
+        for server in listeners:
+            server.close()
+
+    asyncio.run(_test())
+
+
+def test_room_fan_out_is_one_op_per_frontend(tmp_path):
+    db = SqliteDatabase(db_name=str(tmp_path / "test.db"))
+    db._initialize_database(drop=True)
+    server = ShardServer(db=db, config=ServerConfig())
+    socket_path = str(tmp_path / "core.sock")
+
+    async def _test():
+        loop = asyncio.get_running_loop()
+        core = await loop.create_unix_server(lambda: CoreLink(server), socket_path)
+        frontend = Frontend(ServerConfig())
+        ops = []
+        handle_op = frontend.handle_op
+
+        def record(shard, op, *args):
+            ops.append(op)
+            handle_op(shard, op, *args)
+
+        frontend.handle_op = record
+        await loop.create_unix_connection(lambda: frontend.links[0], socket_path)
+        listener = await loop.create_server(
+            lambda: ChatServerConnection(parent=frontend), "127.0.0.1", 0
+        )
+        port = listener.sockets[0].getsockname()[1]
+
+        clients = []
+        for codec in [CODECS.json, CODECS.binary]:
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.write(encode_frame(serialize_hello_message([codec]).encode()))
+            list_rooms = serialize_list_rooms_message(codec=codec)
+            if isinstance(list_rooms, str):
+                list_rooms = list_rooms.encode()
+            writer.write(encode_frame(list_rooms))
+            clients.append((reader, writer, FrameDecoder()))
+        await asyncio.sleep(0.05)
+        for proxy in list(server.connections):
+            server.lobby.join_room(proxy)
+        await asyncio.sleep(0.05)
+
+        ops.clear()
+        await server.forward_to_room(serialize_list_rooms_message(), server.lobby.id)
+        await asyncio.sleep(0.05)
+        assert ops == [LINK_OPS.shared]
+        for reader, _, decoder in clients:
+            payloads = decoder.feed(await reader.read(65536))
+            assert (
+                decode_message(payloads[-1])[MESSAGE_TYPE] == MESSAGE_TYPES.list_rooms
+            )
+
+        for _, writer, _ in clients:
+            writer.close()
+        listener.close()
+        core.close()
+
+    asyncio.run(_test())
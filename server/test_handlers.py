@@ -0,0 +1,128 @@
+from __future__ import annotations
+import asyncio
+from typing import Any, Dict, List
+
+from .chat_server_protocol import AbstractChatConnection
+from .handlers import HandlerRegistry, authorize, timing, validate
+from .metrics import ServerMetrics
+from common import (
+    ERROR_TYPES,
+    MESSAGE_TYPE,
+    MESSAGE_TYPES,
+    REQUEST_ID,
+    User,
+    decode_message,
+)
+
+import pytest
+
+
+class MockConnection(AbstractChatConnection):
+    def __init__(self, user: User | None = None) -> None:
+        super().__init__(user, None)
+        self.sent: List[Dict[str, Any]] = []
+
+    async def send(self, message, kind=None) -> None:
+        self.sent.append(decode_message(message))
+
+    def close(self):
+        self._is_closed = True
+
+
+def test_middleware_order_and_opt_out():
+    calls: List[str] = []
+    registry = HandlerRegistry()
+
+    def tracer(name: str, only: str | None = None):
+        def middleware(message_type, handler):
+            if only is not None and message_type != only:
+                return handler
+
+            async def traced(message, source):
+                calls.append(name)
+                await handler(message, source)
+
+            return traced
+
+        return middleware
+
+    async def handle(message, source):
+        calls.append("handler")
+
+    registry.use(tracer("outer"))
+    registry.register(MESSAGE_TYPES.list_rooms, handle)
+    registry.register(MESSAGE_TYPES.logout, handle)
+    # Middleware added later wraps handlers registered before it
+    registry.use(tracer("inner", only=MESSAGE_TYPES.logout))
+
+    async def _test():
+        source = MockConnection()
+        assert await registry.dispatch({MESSAGE_TYPE: MESSAGE_TYPES.logout}, source)
+        assert calls == ["outer", "inner", "handler"]
+        calls.clear()
+        assert await registry.dispatch({MESSAGE_TYPE: MESSAGE_TYPES.list_rooms}, source)
+        assert calls == ["outer", "handler"]
+        assert not await registry.dispatch({MESSAGE_TYPE: MESSAGE_TYPES.chat}, source)
+
+    asyncio.run(_test())
+
+    with pytest.raises(ValueError):
+        registry.register("not a message type", handle)
+
+
+def test_authorize_and_validate():
+    handled: List[Dict[str, Any]] = []
+    registry = HandlerRegistry()
+    registry.use(authorize({MESSAGE_TYPES.logout: "id"}))
+    registry.use(
+        validate(
+            {
+                MESSAGE_TYPES.logout: (("id",), None),
+                MESSAGE_TYPES.login: (
+                    ("username", "password"),
+                    ERROR_TYPES.invalid_username_password,
+                ),
+            }
+        )
+    )
+
+    async def handle(message, source):
+        handled.append(message)
+
+    registry.register(MESSAGE_TYPES.login, handle)
+    registry.register(MESSAGE_TYPES.logout, handle)
+
+    async def _test():
+        source = MockConnection(User(userid="id1", username="User1"))
+        logout = {MESSAGE_TYPE: MESSAGE_TYPES.logout}
+        await registry.dispatch({**logout, "id": "id2"}, source)
+        await registry.dispatch({**logout, "id": ""}, MockConnection())
+        assert handled == [] and source.sent == []
+        await registry.dispatch({**logout, "id": "id1"}, source)
+        assert len(handled) == 1
+
+        login = {MESSAGE_TYPE: MESSAGE_TYPES.login, REQUEST_ID: "r1"}
+        await registry.dispatch({**login, "username": "User1", "password": 5}, source)
+        assert len(handled) == 1
+        (error,) = source.sent
+        assert error["errortype"] == ERROR_TYPES.invalid_username_password
+        assert error[REQUEST_ID] == "r1"
+
+    asyncio.run(_test())
+
+
+def test_timing():
+    metrics = ServerMetrics()
+    registry = HandlerRegistry()
+    registry.use(timing(metrics))
+
+    async def handle(message, source):
+        await asyncio.sleep(0.01)
+
+    registry.register(MESSAGE_TYPES.list_rooms, handle)
+    message = {MESSAGE_TYPE: MESSAGE_TYPES.list_rooms}
+    asyncio.run(registry.dispatch(message, MockConnection()))
+
+    snapshot = metrics.snapshot()
+    assert snapshot["handler_list_rooms_calls"] == 1
+    assert snapshot["handler_list_rooms_us"] >= 10_000
@@ -0,0 +1,33 @@
+import asyncio
+
+from .password_hasher import PasswordHasher, ServerBusyError
+
+
+def test_hash_and_check_in_process_pool():
+    hasher = PasswordHasher(workers=1)
+
+    async def _test():
+        pwhash = await hasher.hash("secret")
+        assert await hasher.check("secret", pwhash)
+        assert not await hasher.check("wrong", pwhash)
+
+    try:
+        asyncio.run(_test())
+    finally:
+        hasher.close()
+
+
+def test_rejects_when_full():
+    hasher = PasswordHasher(workers=0, max_pending=2)
+
+    async def _test():
+        results = await asyncio.gather(
+            *(hasher.hash("secret") for _ in range(3)), return_exceptions=True
+        )
+        assert isinstance(results[2], ServerBusyError)
+        assert all(isinstance(r, bytes) for r in results[:2])
+        assert hasher.pending == 0
+        # Capacity is back once the earlier calls finish
+        assert isinstance(await hasher.hash("secret"), bytes)
+
+    asyncio.run(_test())
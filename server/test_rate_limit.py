@@ -0,0 +1,38 @@
+from .rate_limit import PRUNE_INTERVAL, RateLimiter, take_all
+
+import pytest
+
+
+def test_burst_then_rate():
+    limiter = RateLimiter(rate=2, burst=3)
+    for _ in range(3):
+        assert limiter.allowed("a", now=0)
+        limiter.take("a", now=0)
+    assert not limiter.allowed("a", now=0)
+    # Other keys have their own bucket
+    assert limiter.allowed("b", now=0)
+    # Two tokens a second, never more than the burst
+    assert limiter.allowed("a", now=0.5)
+    assert not limiter.allowed("a", 2, now=0.5)
+    assert limiter.allowed("a", 3, now=100)
+    assert not limiter.allowed("a", 4, now=100)
+
+    with pytest.raises(ValueError):
+        RateLimiter(rate=0, burst=1)
+
+
+def test_take_all_is_all_or_nothing():
+    first = RateLimiter(rate=1, burst=5)
+    second = RateLimiter(rate=1, burst=2)
+    assert take_all([(first, "a", 2), (second, "a", 2)], now=0)
+    assert not take_all([(first, "a", 2), (second, "a", 1)], now=0)
+    # The refused charge took nothing from the first bucket
+    assert first.allowed("a", 3, now=0)
+
+
+def test_refilled_buckets_are_pruned():
+    limiter = RateLimiter(rate=1, burst=1)
+    limiter.take("a", now=0)
+    limiter.take("b", now=PRUNE_INTERVAL - 0.5)
+    limiter.take("c", now=PRUNE_INTERVAL)
+    assert len(limiter) == 2
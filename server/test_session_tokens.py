@@ -0,0 +1,45 @@
+from .session_tokens import InvalidTokenError, SessionTokens
+
+import pytest
+
+
+def test_issue_and_verify():
+    tokens = SessionTokens(b"secret", ttl=60)
+    token = tokens.issue("id1", "User1", now=1000)
+    assert tokens.verify(token, now=1059) == ("id1", "User1")
+    # Any server with the same secret accepts the token
+    assert SessionTokens(b"secret").verify(token, now=1000) == ("id1", "User1")
+
+
+def test_expired_token():
+    tokens = SessionTokens(b"secret", ttl=60)
+    token = tokens.issue("id1", "User1", now=1000)
+    with pytest.raises(InvalidTokenError):
+        tokens.verify(token, now=1060)
+
+
+def test_forged_tokens():
+    tokens = SessionTokens(b"secret")
+    token = tokens.issue("id1", "User1")
+    payload, signature = token.split(".")
+    other = SessionTokens(b"other").issue("id2", "User2")
+
+    for forged in [
+        other,
+        f"{other.split('.')[0]}.{signature}",
+        f"{payload}.{signature[:-2]}",
+        payload,
+        "",
+        None,
+    ]:
+        with pytest.raises(InvalidTokenError):
+            tokens.verify(forged)
+
+
+def test_malformed_tokens():
+    tokens = SessionTokens(b"secret")
+    payload, signature = tokens.issue("id1", "User1").split(".")
+
+    for malformed in [f"{payload}é.{signature}", f"{payload}.{signature}é", "é.é"]:
+        with pytest.raises(InvalidTokenError):
+            tokens.verify(malformed)
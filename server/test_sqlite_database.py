@@ -1,6 +1,7 @@
 from __future__ import annotations
 import sqlite3
 from typing import Iterable
+from .database_protocol import ConstraintError
 from .sqlite_database import SqliteDatabase, AbstractID
 
 import pytest
@@ -172,3 +173,52 @@ def test_get_room_list(database: SqliteDatabase):
     assert result is not None
     assert isinstance(result, list) == True
     assert len(result) == num_rooms
+
+
+def test_get_room_messages_before(database: SqliteDatabase):
+    u1 = database.insert_user("User1", "Pass1")
+    r1 = database.insert_room("Room 1")
+    r2 = database.insert_room("Room 2")
+
+    for i in range(25):
+        database.insert_chat_message(u1["id"], r1["id"], "NONE", f"Message {i}")
+        database.insert_chat_message(u1["id"], r2["id"], "NONE", f"Other {i}")
+
+    latest = database.get_room_messages_before(r1["id"], None, limit=10)
+    assert [m["message"] for m in latest] == [f"Message {i}" for i in range(15, 25)]
+
+    older = database.get_room_messages_before(r1["id"], latest[0]["id"], limit=10)
+    assert [m["message"] for m in older] == [f"Message {i}" for i in range(5, 15)]
+
+    oldest = database.get_room_messages_before(r1["id"], older[0]["id"], limit=10)
+    assert [m["message"] for m in oldest] == [f"Message {i}" for i in range(5)]
+    assert database.get_room_messages_before(r1["id"], oldest[0]["id"]) == []
+
+
+def test_get_room_messages_after(database: SqliteDatabase):
+    u1 = database.insert_user("User1", "Pass1")
+    r1 = database.insert_room("Room 1")
+    r2 = database.insert_room("Room 2")
+
+    ids = []
+    for i in range(10):
+        ids.append(
+            database.insert_chat_message(u1["id"], r1["id"], "NONE", f"Message {i}")[
+                "id"
+            ]
+        )
+        database.insert_chat_message(u1["id"], r2["id"], "NONE", f"Other {i}")
+
+    missed = database.get_room_messages_after(r1["id"], ids[6])
+    assert [m["message"] for m in missed] == [f"Message {i}" for i in range(7, 10)]
+
+    capped = database.get_room_messages_after(r1["id"], ids[0], limit=4)
+    assert [m["message"] for m in capped] == [f"Message {i}" for i in range(1, 5)]
+    assert database.get_room_messages_after(r1["id"], ids[-1]) == []
+
+    # Ids from another room are not a position in this one
+    other = database.get_room_messages_before(r2["id"], None, limit=1)
+    with pytest.raises(ConstraintError):
+        database.get_room_messages_after(r1["id"], other[0]["id"])
+    with pytest.raises(ValueError):
+        database.get_room_messages_after(r1["id"], "")